@@ -1,25 +1,42 @@
-from flask import Flask, request, jsonify, make_response, session, redirect
+from flask import Flask, Response, request, jsonify, make_response, session, redirect
 from flask_cors import CORS
-import openai
+from werkzeug.exceptions import RequestEntityTooLarge
 import time
 import zlib
-import requests
 import logging
+import logging.handlers
+import atexit
+import re
 import os
-from PIL import Image, ImageDraw, ImageFont
+import json
+import asyncio
+import queue
+import select
+import signal
+import subprocess
 from io import BytesIO
-import cairosvg
 import base64
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.image import MIMEImage
-from email.mime.application import MIMEApplication
-from threading import Lock, Timer
+import gzip
+import threading
+import heapq
+import itertools
+from threading import Condition, Lock
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import secrets
-from fpdf import FPDF
+import random
+import hashlib
+import bisect
+import contextvars
+import importlib
+import multiprocessing
+import sys
+import sqlite3
+from contextlib import contextmanager
+from collections import OrderedDict, deque
 
 # Környezeti változók betöltéses
 load_dotenv()
@@ -28,8 +45,9 @@ app = Flask(__name__)
 app.secret_key = "supersecretkey123"
 
 # CORS beállítások egyszerűsítése
+CORS_ORIGINS = ["https://xflower.ai"]
 CORS(app, 
-     origins=["https://xflower.ai"],
+     origins=CORS_ORIGINS,
      methods=["GET", "POST", "OPTIONS"],
      allow_headers=["Content-Type", "X-Session-ID"],
      supports_credentials=True)
@@ -42,6 +60,12 @@ app.config.update(
     SESSION_COOKIE_NAME='xflower_session'
 )
 
+# Bejövő kérések méretkorlátja (413 fölötte); a multipart fájlrészeket a Werkzeug
+# 500 KB fölött ideiglenes fájlba írja, nem tartja memóriában
+REQUEST_MAX_BYTES = int(os.getenv("REQUEST_MAX_BYTES", 16 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = REQUEST_MAX_BYTES
+SEND_EMAIL_UPLOAD_TYPES = ('image/png', 'image/jpeg')
+
 # Környezeti változók (Most már a .env fájlból töltődnek be)
 SMTP_SERVER = os.getenv("SMTP_SERVER")
 SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
@@ -54,156 +78,1236 @@ ADMIN_EMAIL = os.getenv("ADMIN_EMAIL")
 ERROR_EMAIL = os.getenv("ERROR_EMAIL")
 INACTIVITY_TIMEOUT = 600  # 10 perc másodpercekben
 
-# OpenAI beállítások
-openai.api_key = OPENAI_API_KEY
+# PDF jelentésbe ágyazott diagramok felbontása
+REPORT_IMAGE_DPI = int(os.getenv("REPORT_IMAGE_DPI", 150))
+
+# Kimenő levelek sora
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"  # helyi teszt SMTP szerverhez kikapcsolható
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", 30))
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", 2))
+SMTP_BATCH_SIZE = int(os.getenv("SMTP_BATCH_SIZE", 20))
+SMTP_MAX_RETRIES = int(os.getenv("SMTP_MAX_RETRIES", 5))
+SMTP_DRAIN_TIMEOUT = float(os.getenv("SMTP_DRAIN_TIMEOUT", 10))  # leálláskor ennyit várunk a sorban lévő levelekre
+
+# Hidegindítás: a nehéz csomagokat (OpenAI kliens, cairo, PIL, fpdf, SMTP/MIME) csak az első használat tölti be
+LAZY_IMPORTS = os.getenv("LAZY_IMPORTS", "1") == "1"
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "0") == "1"  # előmelegítés a háttérben, a port megnyitása után
+STARTUP_WARMUP_DELAY = float(os.getenv("STARTUP_WARMUP_DELAY", 1.0))
+
+lazy_import_lock = threading.RLock()
+
+def reset_lazy_import_lock():
+    # Fork után a gyermek nem örökölhet egy másik szál által éppen fogott zárat
+    global lazy_import_lock
+    lazy_import_lock = threading.RLock()
+
+os.register_at_fork(after_in_child=reset_lazy_import_lock)
+
+class LazyImport:
+    """Modul vagy modul attribútum helyettesítője, amely csak az első attribútum-hozzáféréskor/híváskor importál
+
+    A betöltés ideje 'lazy_import' szakaszként a kérés trace-ébe kerül. LAZY_IMPORTS=0 esetén
+    a példány létrehozásakor importál, mint egy sima import utasítás.
+    """
+
+    def __init__(self, module_name, attribute=None, configure=None):
+        self._module_name = module_name
+        self._attribute = attribute
+        self._configure = configure
+        self._target = None
+        if not LAZY_IMPORTS:
+            self._load()
+
+    def _load(self):
+        with lazy_import_lock:
+            if self._target is None:
+                module = importlib.import_module(self._module_name)
+                if self._configure:
+                    self._configure(module)
+                self._target = getattr(module, self._attribute) if self._attribute else module
+            return self._target
+
+    def resolve(self):
+        target = self._target
+        if target is None:
+            fresh = self._module_name not in sys.modules
+            started = time.perf_counter()
+            target = self._load()
+            if fresh:
+                seconds = time.perf_counter() - started
+                record_stage('lazy_import', seconds)
+                logger.info("Lusta import: %s (%.1f ms)", self._module_name, seconds * 1000)
+        return target
+
+    def __getattr__(self, attribute):
+        return getattr(self.resolve(), attribute)
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
 
-# Logolás beállítása
-logging.basicConfig(level=logging.DEBUG)
+# OpenAI beállítások
+openai = LazyImport('openai', configure=lambda module: setattr(module, 'api_key', OPENAI_API_KEY))
+requests = LazyImport('requests')
+cairosvg = LazyImport('cairosvg')
+Image = LazyImport('PIL.Image')
+ImageDraw = LazyImport('PIL.ImageDraw')
+ImageFont = LazyImport('PIL.ImageFont')
+FPDF = LazyImport('fpdf', 'FPDF')
+XPos = LazyImport('fpdf', 'XPos')
+YPos = LazyImport('fpdf', 'YPos')
+smtplib = LazyImport('smtplib')
+MIMEText = LazyImport('email.mime.text', 'MIMEText')
+MIMEMultipart = LazyImport('email.mime.multipart', 'MIMEMultipart')
+MIMEImage = LazyImport('email.mime.image', 'MIMEImage')
+MIMEApplication = LazyImport('email.mime.application', 'MIMEApplication')
+lazy_imports = (openai, requests, cairosvg, Image, ImageDraw, ImageFont, FPDF, XPos, YPos,
+                smtplib, MIMEText, MIMEMultipart, MIMEImage, MIMEApplication)
+
+# Kérésenkénti nyomkövetés: trace id és a szakaszok ideje (contextvar, így szálanként külön él)
+request_trace = contextvars.ContextVar('request_trace', default=None)
+
+class TraceIdFilter(logging.Filter):
+    """A futó kérés trace id-ját minden log rekordhoz hozzáadja"""
+
+    def filter(self, record):
+        trace = request_trace.get()
+        record.trace_id = trace['trace_id'] if trace else '-'
+        return True
+
+# Logolás: a kérés szála csak sorba teszi a rekordot, a formázás és a kiírás háttérszálon történik
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Alrendszerenkénti szintek 'név=SZINT' párokként; a HTTP kliensek zaja alapból csak WARNING-tól
+LOG_LEVELS = os.getenv("LOG_LEVELS", "fontTools=WARNING,httpcore=WARNING,httpx=WARNING,openai=WARNING,urllib3=WARNING")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # 'json' vagy 'text'
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", 2000))  # PlantUML, válaszok stb. levágása
+LOG_SAMPLE_PER_SECOND = float(os.getenv("LOG_SAMPLE_PER_SECOND", 1))  # ismétlődő (sample_key-es) sorok kulcsonként
+
+class SamplingFilter(logging.Filter):
+    """Ismétlődő sorok ritkítása: az extra={'sample_key': ...} rekordokból kulcsonként legfeljebb rate / s megy át
+
+    A kihagyott sorok számát a következő átengedett rekord 'suppressed' mezője mutatja.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._last = {}
+        self._suppressed = {}
+        self._lock = Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'sample_key', None)
+        if key is None or record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last.get(key, 0.0) < self.interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return False
+            self._last[key] = now
+            record.suppressed = self._suppressed.pop(key, 0)
+        return True
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, amely nem formáz a hívó szálán: az üzenet összeállítása a háttérszálra marad"""
+
+    def prepare(self, record):
+        return record
+
+BASE64_PATTERN = re.compile(r'(data:[\w/+.-]+;base64,)[A-Za-z0-9+/=]{64,}')
+
+def truncate_log_text(text, limit=LOG_MAX_FIELD_CHARS):
+    """Base64 adatok kivágása és a túl hosszú szöveg levágása"""
+    text = BASE64_PATTERN.sub(lambda match: f'{match.group(1)}<{len(match.group(0)) - len(match.group(1))} karakter>', text)
+    if len(text) > limit:
+        return f'{text[:limit]}… (+{len(text) - limit} karakter)'
+    return text
+
+class JsonLogFormatter(logging.Formatter):
+    """Egysoros JSON log rekord; az extra={'fields': {...}} mezők a rekord részévé válnak"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'trace_id': getattr(record, 'trace_id', '-'),
+            'msg': truncate_log_text(record.getMessage()),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exc'] = truncate_log_text(self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextLogFormatter(logging.Formatter):
+    """Olvasható sorformátum helyi fejlesztéshez, ugyanazzal a levágással"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s')
+
+    def formatMessage(self, record):
+        record.message = truncate_log_text(record.message)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            record.message = f"{record.message} {json.dumps(fields, ensure_ascii=False, default=str)}"
+        return super().formatMessage(record)
+
+def configure_logging():
+    """Sor alapú logolás beállítása; visszaadja a háttérben író QueueListener-t"""
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    # A trace id-t a kérés szálán kell kiolvasni (contextvar), a mintavételezés is itt olcsó
+    queue_handler.addFilter(TraceIdFilter())
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_PER_SECOND))
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonLogFormatter() if LOG_FORMAT == 'json' else TextLogFormatter())
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL.upper())
+    for pair in LOG_LEVELS.split(','):
+        if '=' in pair:
+            name, level = pair.split('=', 1)
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    listener.start()
+    # Leálláskor a sorban maradt rekordok is kiíródnak
+    atexit.register(listener.stop)
+
+    def log_directly_after_fork():
+        # Fork után a gyermekben nem fut a háttérszál: ott közvetlenül írunk
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        stream_handler.addFilter(TraceIdFilter())
+        root.addHandler(stream_handler)
+
+    os.register_at_fork(after_in_child=log_directly_after_fork)
+    return listener
+
+log_listener = configure_logging()
 logger = logging.getLogger(__name__)
 
+# Késleltetés hisztogramok vödörhatárai (másodperc)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class LatencyHistogram:
+    """Címkénkénti késleltetés hisztogram Prometheus szöveges exporttal; egy megfigyelés egy bisect és egy zár"""
+
+    def __init__(self, name, help_text, label, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}  # címke -> [vödör darabszámok..., összeg, darabszám]
+        self._lock = Lock()
+
+    def observe(self, label_value, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series_items = [(label_value, list(series)) for label_value, series in sorted(self._series.items())]
+        for label_value, series in series_items:
+            labels = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{labels}}} {series[-2]:.6f}')
+            lines.append(f'{self.name}_count{{{labels}}} {series[-1]}')
+        return lines
+
+stage_latency = LatencyHistogram('xflower_stage_seconds', 'Feldolgozási szakaszok ideje', 'stage')
+request_latency = LatencyHistogram('xflower_request_seconds', 'HTTP kérések teljes ideje', 'endpoint')
+
+def start_trace(trace_id=None):
+    """Új nyomkövetés indítása az aktuális kontextusban"""
+    # A kliens által küldött azonosítót csak rövidítve vesszük át
+    trace = {'trace_id': (trace_id or '')[:64] or secrets.token_hex(8), 'started': time.perf_counter(), 'stages': {}}
+    request_trace.set(trace)
+    return trace
+
+def finish_trace(trace, **fields):
+    """A nyomkövetés lezárása egy strukturált (JSON) log sorral"""
+    record = {
+        'trace_id': trace['trace_id'],
+        'duration_ms': round((time.perf_counter() - trace['started']) * 1000, 1),
+        'stages_ms': {stage: round(seconds * 1000, 1) for stage, seconds in trace['stages'].items()},
+    }
+    record.update(fields)
+    logger.info('Kérés vége', extra={'fields': record})
+    request_trace.set(None)
+
+def record_stage(stage, seconds):
+    """Szakaszidő rögzítése a hisztogramba és a futó kérés nyomkövetésébe"""
+    stage_latency.observe(stage, seconds)
+    trace = request_trace.get()
+    if trace is not None:
+        trace['stages'][stage] = trace['stages'].get(stage, 0.0) + seconds
+
+@contextmanager
+def timed_stage(stage):
+    """Egy szakasz idejének mérése"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
 # A4 méret 300 DPI-vel (mm to pixels at 300 DPI)
 A4_WIDTH = int(297 * 11.811)  # 297mm * (300/25.4)
 A4_HEIGHT = int(210 * 11.811)  # 210mm * (300/25.4)
+# Diagram kicsinyítése: 'quality' (teljes LANCZOS), 'fast' (előbb egész szorzós kicsinyítés) vagy 'auto'
+A4_RESAMPLE = os.getenv("A4_RESAMPLE", "auto")
+A4_FAST_RESAMPLE_PIXELS = 2 * A4_WIDTH * A4_HEIGHT  # 'auto' esetén e fölött gyors mód
 
-# Thread tárolás módosítása - hozzáadjunk időbélyeget és cleanup funkciót
-user_threads = {
-    # 'session_id': {'thread_id': 'xxx', 'last_used': datetime}
-}
-thread_lock = Lock()
+# Session állapot tárolása: 'memory' (folyamaton belül) vagy 'sqlite' (több worker/replika között megosztva)
+STATE_STORE = os.getenv("STATE_STORE", "memory")
+STATE_STORE_PATH = os.getenv("STATE_STORE_PATH", "xflower_state.db")
 
 # Konstans a thread élettartamához
 THREAD_LIFETIME_HOURS = 24
+THREAD_CLEANUP_INTERVAL = int(os.getenv("THREAD_CLEANUP_INTERVAL", 600))
+THREAD_CREATE_TIMEOUT = 60
+THREAD_DELETE_BATCH = int(os.getenv("THREAD_DELETE_BATCH", 8))
+THREAD_DELETE_RATE = float(os.getenv("THREAD_DELETE_RATE", 5))  # törlés / másodperc
+
+# Thread kontextus kezelés: 'full' (minden üzenet a teljes utasítással, a thread korlátlanul nő) vagy
+# 'compact' (a session aktuális diagramja a kanonikus állapot; a küszöb felett tömör új thread indul)
+CONTEXT_MODE = os.getenv("CONTEXT_MODE", "compact")
+THREAD_COMPACT_CHARS = int(os.getenv("THREAD_COMPACT_CHARS", 24000))  # a thread-be küldött szöveg mennyisége
+THREAD_COMPACT_KEEP_REQUESTS = int(os.getenv("THREAD_COMPACT_KEEP_REQUESTS", 3))
+# Legalább ennyi karaktert kell megtakarítania a tömörítésnek, különben a nagy diagramú session minden körben tömörítene
+THREAD_COMPACT_MIN_SAVINGS = int(os.getenv("THREAD_COMPACT_MIN_SAVINGS", THREAD_COMPACT_CHARS // 2))
+context_stats = {'runs': 0, 'prompt_chars': 0, 'context_chars': 0, 'run_seconds': 0.0, 'compactions': 0}
+context_stats_lock = Lock()
 
 # Új globális változók
-conversation_timers = {}
-conversation_history = {}
+SESSION_EXPIRY_WORKERS = int(os.getenv("SESSION_EXPIRY_WORKERS", 2))
+# Beszélgetés történet: csak a prompt és a PlantUML forrás, a képek a render cache-ben vannak
+HISTORY_SESSION_MAX_ENTRIES = int(os.getenv("HISTORY_SESSION_MAX_ENTRIES", 100))
+HISTORY_SESSION_MAX_BYTES = int(os.getenv("HISTORY_SESSION_MAX_BYTES", 1024 * 1024))
+HISTORY_MAX_BYTES = int(os.getenv("HISTORY_MAX_BYTES", 64 * 1024 * 1024))
+
+# Asszisztens futások várakoztatása
+# 'stream': eseményalapú várakozás, 'poll': adaptív visszalépéses lekérdezés
+RUN_WAIT_MODE = os.getenv("RUN_WAIT_MODE", "stream")
+RUN_WAIT_TIMEOUT = float(os.getenv("RUN_WAIT_TIMEOUT", 120))
+RUN_POLL_INITIAL_DELAY = 0.25
+RUN_POLL_MAX_DELAY = 4.0
+RUN_POLL_BACKOFF = 1.5
+# requires_action: az asszisztens nem használ eszközöket, így ebből az állapotból nem lép tovább (a run_assistant megszakítja)
+RUN_TERMINAL_STATUSES = {"completed", "failed", "cancelled", "expired", "incomplete", "requires_action"}
+run_wait_stats = {'runs': 0, 'total_wait': 0.0, 'max_wait': 0.0, 'by_status': {}}
+run_wait_lock = Lock()
+
+# PlantUML renderelés: 'remote' (HTTP szerver), 'local' (jar -pipe workerek), 'picoweb' (jar HTTP módban)
+PLANTUML_RENDERER = os.getenv("PLANTUML_RENDERER", "remote")
+PLANTUML_SERVER_URL = os.getenv("PLANTUML_SERVER_URL", "http://www.plantuml.com/plantuml")
+PLANTUML_JAR = os.getenv("PLANTUML_JAR", "plantuml.jar")
+PLANTUML_WORKERS = int(os.getenv("PLANTUML_WORKERS", 2))
+PLANTUML_PICOWEB_PORT = int(os.getenv("PLANTUML_PICOWEB_PORT", 8765))
+PLANTUML_RENDER_TIMEOUT = float(os.getenv("PLANTUML_RENDER_TIMEOUT", 30))
+
+# Háttérben futó /chat jobok
+CHAT_JOB_WORKERS = int(os.getenv("CHAT_JOB_WORKERS", 4))
+CHAT_JOB_MAX_QUEUE = int(os.getenv("CHAT_JOB_MAX_QUEUE", 50))
+CHAT_JOB_TTL = int(os.getenv("CHAT_JOB_TTL", 900))  # befejezett jobok megőrzése másodpercben
+CHAT_JOB_SSE_KEEPALIVE = 15
+CHAT_FAILED_MESSAGE = 'Nem sikerült érvényes diagramot generálni többszöri próbálkozás után sem.'
+chat_jobs = {}
+chat_jobs_cond = Condition()
+chat_job_stats = {'submitted': 0, 'rejected': 0, 'done': 0, 'failed': 0, 'stage_totals': {}}
+chat_job_executor = ThreadPoolExecutor(max_workers=CHAT_JOB_WORKERS, thread_name_prefix='chat-job')
+
+# Streamelt generálás közbeni előnézetek a jobok SSE csatornáján
+CHAT_PREVIEWS = os.getenv("CHAT_PREVIEWS", "1") == "1"
+CHAT_PREVIEW_INTERVAL = float(os.getenv("CHAT_PREVIEW_INTERVAL", 1.5))  # két előnézet között legalább ennyi másodperc
+preview_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='diagram-preview')
+
+# Újrapróbálkozási keret és megszakítók
+CHAT_MAX_ATTEMPTS = int(os.getenv("CHAT_MAX_ATTEMPTS", 4))  # asszisztens futás + renderelés összesen
+CHAT_DEADLINE = float(os.getenv("CHAT_DEADLINE", 150))
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RECOVERY_TIMEOUT = float(os.getenv("BREAKER_RECOVERY_TIMEOUT", 30))
+
+# Beengedés-szabályozás: tokenvödör sessionönként és IP-nként, korlátozott számú párhuzamos futás
+ADMISSION_SESSION_RATE = float(os.getenv("ADMISSION_SESSION_RATE", 6))  # kérés percenként; 0: nincs korlát
+ADMISSION_SESSION_BURST = int(os.getenv("ADMISSION_SESSION_BURST", 3))
+ADMISSION_IP_RATE = float(os.getenv("ADMISSION_IP_RATE", 30))
+ADMISSION_IP_BURST = int(os.getenv("ADMISSION_IP_BURST", 10))
+ADMISSION_MAX_KEYS = int(os.getenv("ADMISSION_MAX_KEYS", 10000))  # ennyi vödröt tartunk nyilván (LRU)
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", 8))  # egyszerre futó chat folyamat (asszisztens + render); 0: nincs korlát
+ADMISSION_MAX_RENDERS = int(os.getenv("ADMISSION_MAX_RENDERS", 8))  # egyszerre futó /diagram renderelés
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", 8))  # szabad helyre várakozó kérések felső határa
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", 2.0))  # ennyi másodperc várakozás után 429
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 5))  # Retry-After telített sornál
+
+# A generált diagramok megjelenése (a @startuml után egyszer szúrjuk be)
+PLANTUML_THEME = os.getenv("PLANTUML_THEME")  # pl. 'plain'; üres: nincs !theme
+PLANTUML_FONT = os.getenv("PLANTUML_FONT", "Montserrat")
+PLANTUML_SKINPARAMS = os.getenv("PLANTUML_SKINPARAMS", "ConditionEndStyle hline")  # ';'-vel elválasztva
+
+# Renderelt diagramok cache-e
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", 128))
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR")  # üres: csak memória
+RENDER_CACHE_DISK_SIZE = int(os.getenv("RENDER_CACHE_DISK_SIZE", 1024))
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Generálási cache: azonos (normalizált) kérés és azonos kiinduló diagram esetén nincs új asszisztens futás
+GENERATION_CACHE_SIZE = int(os.getenv("GENERATION_CACHE_SIZE", 256))  # 0: kikapcsolva
+GENERATION_CACHE_TTL = int(os.getenv("GENERATION_CACHE_TTL", 3600))
+
+# Diagram kimeneti formátumok; a raszterizálás csak PNG/bélyegkép kérésekor fut
+DIAGRAM_FORMATS = ('svg', 'png', 'thumbnail')
+DIAGRAM_DEFAULT_FORMAT = os.getenv("DIAGRAM_DEFAULT_FORMAT", "png")  # a régi kliensek PNG-t várnak
+RASTER_DEFAULT_DPI = 300
+RASTER_MIN_DPI = 36
+RASTER_MAX_DPI = 600
+THUMBNAIL_WIDTH = int(os.getenv("THUMBNAIL_WIDTH", 320))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))  # folyamatok száma; 0: a kérés szálán fut
+GZIP_MIN_BYTES = 1024
+
+class CircuitOpenError(Exception):
+    """A függőség megszakítója nyitva van, a hívást azonnal elutasítjuk"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"A(z) {name} szolgáltatás átmenetileg nem elérhető")
+        self.name = name
+        self.retry_after = retry_after
+
+class RunFailedError(Exception):
+    """Az asszisztens futása nem 'completed' státusszal ért véget"""
+
+class CircuitBreaker:
+    """Függőségenkénti megszakító: sorozatos hibák után gyorsan hibázik, majd félig nyitott próbahívással áll helyre"""
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, recovery_timeout=BREAKER_RECOVERY_TIMEOUT,
+                 half_open_max_calls=1, ignored=()):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.ignored = ignored
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probes = 0
+        self._lock = Lock()
+        self.stats = {'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = 'half_open'
+                self._probes = 0
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return True
+            self.stats['rejected'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.stats['successes'] += 1
+            if self.state != 'closed':
+                logger.info(f"Megszakító zárva: {self.name}")
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.stats['failures'] += 1
+            self.failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                logger.warning(f"Megszakító nyitva: {self.name} ({self.failures} egymást követő hiba)")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.stats['opened'] += 1
+
+    def retry_after(self):
+        with self._lock:
+            return max(0.0, self.opened_at + self.recovery_timeout - time.monotonic())
+
+    def __enter__(self):
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_after())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Az ignored lehet függvény is, hogy a kivételosztály modulját ne kelljen induláskor betölteni
+        ignored = self.ignored() if callable(self.ignored) else self.ignored
+        if exc_type is None or (ignored and issubclass(exc_type, ignored)):
+            self.record_success()
+        elif issubclass(exc_type, Exception):
+            self.record_failure()
+        else:
+            # Megszakítás (CancelledError, KeyboardInterrupt): nem hiba, de a próbahelyet vissza kell adni
+            self.release_probe()
+        return False
+
+    def release_probe(self):
+        with self._lock:
+            if self.state == 'half_open' and self._probes > 0:
+                self._probes -= 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, state=self.state, consecutive_failures=self.failures)
+
+openai_breaker = CircuitBreaker('openai')
+renderer_breaker = CircuitBreaker('plantuml')
+# A félkész diagramok előnézete spekulatív: a hibái nem nyithatják a valódi renderelés megszakítóját
+preview_breaker = CircuitBreaker('plantuml_preview')
+smtp_breaker = CircuitBreaker('smtp', ignored=lambda: (smtplib.SMTPRecipientsRefused,))
+circuit_breakers = {
+    breaker.name: breaker for breaker in (openai_breaker, renderer_breaker, preview_breaker, smtp_breaker)
+}
+
+class AdmissionRejectedError(Exception):
+    """A kérést a beengedés-szabályozás elutasította; a kliens retry_after másodperc múlva próbálkozzon újra"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__("Túl sok kérés, kérlek próbáld újra később")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class TokenBucketLimiter:
+    """Kulcsonkénti tokenvödör: percenként rate token, legfeljebb burst gyűlhet össze
+
+    A kulcsok száma korlátos; a legrégebben használt vödör kiesik (újra teli vödörrel indul).
+    """
+
+    def __init__(self, name, rate_per_minute, burst, max_keys=ADMISSION_MAX_KEYS):
+        self.name = name
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+        self.stats = {'admitted': 0, 'rejected': 0}
+
+    def take(self, key):
+        """Egy token elvétele; 0, ha a kérés mehet, különben a következő tokenig hátralévő másodpercek"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+                self.stats['admitted'] += 1
+            else:
+                wait = (1 - tokens) / self.rate
+                self.stats['rejected'] += 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def refund(self, key):
+        """Elvett token visszaadása (ha a kérést egy másik korlát utasította el)"""
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated = self._buckets[key]
+                self._buckets[key] = (min(self.burst, tokens + 1), updated)
+                self.stats['admitted'] -= 1
+
+class ConcurrencyGate:
+    """Egyszerre futó munkák korlátja rövid, korlátos várakozási sorral
+
+    Ha minden hely foglalt és a sor is tele van, azonnal elutasít; a sorban állók legfeljebb
+    max_wait másodpercig várnak. Így túlterheléskor olcsón utasítunk el, nem halmozunk fel munkát.
+    """
+
+    def __init__(self, name, limit, max_waiting=ADMISSION_MAX_WAITING, max_wait=ADMISSION_MAX_WAIT):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiting = 0
+        self._cond = Condition()
+        self._async_waiters = deque()  # (loop, future) párok; a release ébreszti őket
+        self.stats = {'admitted': 0, 'waited': 0, 'queue_full': 0, 'wait_timeout': 0}
+
+    def acquire(self, timeout=None, bounded=True):
+        """Hely foglalása; bounded=False esetén a várakozási sor méretét nem ellenőrizzük (a hívó maga korlátos)"""
+        if self.limit <= 0:
+            return
+        deadline = time.monotonic() + (self.max_wait if timeout is None else timeout)
+        if not self._enter_or_queue(bounded):
+            self._wait(deadline)
+
+    def _enter_or_queue(self, bounded):
+        """Szabad hely azonnali foglalása (True) vagy beállás a várakozási sorba (False); telített sornál elutasít"""
+        with self._cond:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                self.stats['admitted'] += 1
+                return True
+            if bounded and self.waiting >= self.max_waiting:
+                raise self._reject('queue_full')
+            self.waiting += 1
+            return False
+
+    def _wait(self, deadline):
+        """A sorba állt hívó várakozása szabad helyre legfeljebb a határidőig"""
+        started = time.perf_counter()
+        with self._cond:
+            try:
+                while self.in_flight >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._reject('wait_timeout')
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+                self.stats['admitted'] += 1
+                self.stats['waited'] += 1
+            finally:
+                self.waiting -= 1
+        record_stage('admission_wait', time.perf_counter() - started)
+
+    def _reject(self, reason):
+        self.stats[reason] += 1
+        logger.info("Kérés elutasítva (%s): %s, %d futó, %d várakozó", reason, self.name, self.in_flight, self.waiting,
+                       extra={'sample_key': f'admission_{self.name}_{reason}'})
+        return AdmissionRejectedError(reason, ADMISSION_RETRY_AFTER)
+
+    def release(self):
+        if self.limit <= 0:
+            return
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+            self._wake_async_waiter()
+
+    def _wake_async_waiter(self):
+        """A legrégebbi aszinkron várakozó felébresztése a saját eseményhurkában (a _cond zár alatt hívandó)"""
+        while self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+                return
+            except RuntimeError:
+                # A hurok már leállt, a várakozó nem él
+                continue
+
+    @contextmanager
+    def slot(self, timeout=None, bounded=True):
+        self.acquire(timeout, bounded)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire_async(self):
+        """acquire az eseményhurok blokkolása nélkül
+
+        A várakozó egy future-re vár, amit a release ébreszt, így nem foglal szálat a
+        végrehajtó készletből (az a már beengedett kérések tároló hívásaihoz kell). A sorba
+        állás az eseményhurokban történik, így a várakozási sor korlátos marad.
+        """
+        if self.limit <= 0 or self._enter_or_queue(bounded=True):
+            return
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + self.max_wait
+        started = time.perf_counter()
+        retry = False
+        try:
+            while True:
+                future = loop.create_future()
+                with self._cond:
+                    if self.in_flight < self.limit:
+                        self.in_flight += 1
+                        self.stats['admitted'] += 1
+                        self.stats['waited'] += 1
+                        break
+                    # Ébresztés után, ha közben más vitte el a helyet, a sor elején marad
+                    (self._async_waiters.appendleft if retry else self._async_waiters.append)((loop, future))
+                remaining = deadline - time.monotonic()
+                woken = False
+                try:
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError
+                    await asyncio.wait_for(future, remaining)
+                    woken = True
+                except asyncio.TimeoutError:
+                    raise self._reject('wait_timeout') from None
+                finally:
+                    if not woken:
+                        with self._cond:
+                            try:
+                                self._async_waiters.remove((loop, future))
+                            except ValueError:
+                                # Közben ébresztést kaptunk, de nem használjuk fel: a következő várakozóé
+                                self._wake_async_waiter()
+                retry = True
+        finally:
+            with self._cond:
+                self.waiting -= 1
+        record_stage('admission_wait', time.perf_counter() - started)
+
+session_limiter = TokenBucketLimiter('session', ADMISSION_SESSION_RATE, ADMISSION_SESSION_BURST)
+ip_limiter = TokenBucketLimiter('ip', ADMISSION_IP_RATE, ADMISSION_IP_BURST)
+chat_gate = ConcurrencyGate('chat', ADMISSION_MAX_INFLIGHT)
+render_gate = ConcurrencyGate('render', ADMISSION_MAX_RENDERS)
+admission_limiters = (session_limiter, ip_limiter, chat_gate, render_gate)
+
+def forwarded_client_ip(forwarded_for, remote_addr):
+    """A kliens IP címe; proxy mögött az X-Forwarded-For utolsó, a saját proxynk által hozzáfűzött eleme"""
+    if forwarded_for:
+        return forwarded_for.split(',')[-1].strip()
+    return remote_addr or '-'
+
+def request_client_ip():
+    return forwarded_client_ip(request.headers.get('X-Forwarded-For'), request.remote_addr)
+
+def check_rate_limits(session_id, client_ip):
+    """Session és IP tokenvödrök ellenőrzése; túllépésnél AdmissionRejectedError, még a kérés feldolgozása előtt"""
+    wait = session_limiter.take(session_id)
+    reason = 'session_rate'
+    if not wait:
+        wait = ip_limiter.take(client_ip)
+        reason = 'ip_rate'
+        if wait:
+            session_limiter.refund(session_id)
+    if wait:
+        logger.info("Kérés elutasítva (%s): session %s, IP %s", reason, session_id, client_ip,
+                       extra={'sample_key': f'admission_{reason}'})
+        raise AdmissionRejectedError(reason, wait)
+
+def refund_rate_limits(session_id, client_ip):
+    """A check_rate_limits által elvett tokenek visszaadása, ha a kérést utána a futás- vagy jobkorlát utasította el
+
+    Az a szerver terheltsége, nem a kliensé: a kliens keretét nem fogyaszthatja.
+    """
+    session_limiter.refund(session_id)
+    ip_limiter.refund(client_ip)
+
+class RetryBudget:
+    """Kérésenkénti közös újrapróbálkozási keret: kísérletszám, teljes határidő és jitteres exponenciális várakozás"""
+
+    def __init__(self, max_attempts=CHAT_MAX_ATTEMPTS, deadline=CHAT_DEADLINE,
+                 base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+        self.max_attempts = max_attempts
+        self.deadline = time.monotonic() + deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempts = 0
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def _reserve(self):
+        """A következő kísérlet előtti várakozás, vagy None, ha a keret elfogyott"""
+        if self.attempts >= self.max_attempts:
+            return None
+        delay = 0.0
+        if self.attempts:
+            delay = min(self.max_delay, self.base_delay * 2 ** (self.attempts - 1)) * random.uniform(0.5, 1.0)
+        if delay >= self.remaining():
+            return None
+        self.attempts += 1
+        return delay
+
+    def next_attempt(self):
+        delay = self._reserve()
+        if delay is None:
+            return False
+        time.sleep(delay)
+        return True
+
+    async def next_attempt_async(self):
+        delay = self._reserve()
+        if delay is None:
+            return False
+        await asyncio.sleep(delay)
+        return True
 
 def cleanup_old_threads():
-    """Régi thread-ek törlése"""
-    current_time = datetime.now()
-    with thread_lock:
-        for session_id in list(user_threads.keys()):
-            if current_time - user_threads[session_id]['last_used'] > timedelta(hours=THREAD_LIFETIME_HOURS):
+    """Lejárt thread-ek átadása törlésre; a tároló atomikusan adja ki őket, így több worker sem törli kétszer"""
+    for session_id, thread_id in state_store.pop_expired_threads(THREAD_LIFETIME_HOURS * 3600):
+        thread_reaper.enqueue(thread_id, session_id)
+
+class ThreadReaper:
+    """Háttérszál, amely kötegekben, rátakorláttal törli az OpenAI thread-eket
+
+    A keresési zárat nem tartja: a tárolóból már kivett azonosítókkal dolgozik,
+    így a törlések alatt a többi session kérése zavartalanul fut.
+    """
+
+    def __init__(self, interval, batch_size=8, rate_per_second=5.0, max_attempts=3):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.rate_per_second = rate_per_second
+        self.max_attempts = max_attempts
+        self._pending = deque()
+        self._lock = Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=batch_size, thread_name_prefix='thread-reaper')
+        self.stats = {'deleted': 0, 'failed': 0}
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='thread-reaper', daemon=True)
+                self._thread.start()
+
+    def enqueue(self, thread_id, session_id=None, attempt=0):
+        with self._lock:
+            self._pending.append((thread_id, session_id, attempt))
+        self.start()
+        self._wake.set()
+
+    def _delete(self, item):
+        thread_id, session_id, attempt = item
+        try:
+            openai.beta.threads.delete(thread_id)
+            logger.info(f"Thread törölve: {thread_id} (session: {session_id})")
+            return None
+        except Exception as e:
+            logger.error(f"Hiba a thread törlésekor: {str(e)}")
+            return (thread_id, session_id, attempt + 1)
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            if not batch:
+                return
+            started = time.monotonic()
+            for item, failed in zip(batch, self._executor.map(self._delete, batch)):
+                if failed is None:
+                    self.stats['deleted'] += 1
+                elif failed[2] < self.max_attempts:
+                    with self._lock:
+                        self._pending.append(failed)
+                else:
+                    self.stats['failed'] += 1
+            # Rátakorlát: egy köteg legalább len(batch) / rate másodpercig tart
+            remaining = len(batch) / self.rate_per_second - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def _run(self):
+        next_cleanup = time.monotonic() + self.interval
+        while True:
+            self._wake.wait(max(0.0, next_cleanup - time.monotonic()))
+            self._wake.clear()
+            if time.monotonic() >= next_cleanup:
                 try:
-                    # OpenAI thread törlése
-                    openai.beta.threads.delete(user_threads[session_id]['thread_id'])
-                    logger.info(f"Thread törölve: {user_threads[session_id]['thread_id']} (session: {session_id})")
+                    cleanup_old_threads()
                 except Exception as e:
-                    logger.error(f"Hiba a thread törlésekor: {str(e)}")
-                del user_threads[session_id]
+                    logger.error(f"Hiba a lejárt thread-ek összegyűjtésekor: {str(e)}")
+                next_cleanup = time.monotonic() + self.interval
+            self._drain()
+
+def create_openai_thread():
+    with openai_breaker:
+        thread = openai.beta.threads.create()
+    logger.debug("Új thread létrehozva: %s", thread.id)
+    return thread.id
 
 def get_or_create_thread(session_id):
     """Thread kezelése egy session-höz"""
-    with thread_lock:
-        if session_id in user_threads:
-            thread_data = user_threads[session_id]
-            # Frissítjük az utolsó hasznlat időpontját
-            thread_data['last_used'] = datetime.now()
-            logger.debug(f"Meglévő thread használata: {thread_data['thread_id']} (session: {session_id})")
-            return thread_data['thread_id']
-        else:
-            try:
-                thread = openai.beta.threads.create()
-                user_threads[session_id] = {
-                    'thread_id': thread.id,
-                    'last_used': datetime.now()
-                }
-                logger.debug(f"Új thread létrehozva: {thread.id} (session: {session_id})")
-                return thread.id
-            except Exception as e:
-                logger.error(f"Hiba új thread létrehozásakor: {str(e)}")
-                return None
-
-def clean_plantuml_notes(plantuml_code):
-    """Eltávolítja a zárójeleket a note sorokból"""
-    cleaned_lines = []
-    for line in plantuml_code.split('\n'):
-        if line.strip().lower().startswith('note'):
-            # Zárójelek eltávolítása a sorból
-            cleaned_line = line.replace('(', '').replace(')', '')
-            cleaned_lines.append(cleaned_line)
-        else:
-            cleaned_lines.append(line)
-    return '\n'.join(cleaned_lines)
+    # Az időszakos takarítás az első használattal indul
+    thread_reaper.start()
+    try:
+        thread_id = state_store.get_or_create_thread(session_id, create_openai_thread, discard_thread=thread_reaper.enqueue)
+        logger.debug("Thread használata: %s (session: %s)", thread_id, session_id)
+        return thread_id
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        logger.error(f"Hiba új thread létrehozásakor: {str(e)}")
+        return None
+
+def build_compact_seed(history):
+    """Tömör új thread kezdő üzenetei: utasítás, az utolsó néhány kérés és a kanonikus aktuális diagram"""
+    recent = '\n'.join(f'- {entry.prompt}' for entry in history[-THREAD_COMPACT_KEEP_REQUESTS:])
+    return [
+        {'role': 'user', 'content': f"""{USER_PROMPT_PREAMBLE}(Earlier conversation, most recent last:)
+{recent}"""},
+        # A téma direktívákat a normalizáló teszi hozzá, a modell a nyers diagramot látja
+        {'role': 'assistant', 'content': '\n'.join(
+            line for line in history[-1].plantuml.split('\n') if line not in plantuml_normalizer.theme_directives
+        )},
+    ]
+
+def compact_thread_if_needed(session_id, thread_id):
+    """A küszöböt átlépő thread helyett tömör új thread; visszaadja a használandó thread azonosítót"""
+    if CONTEXT_MODE != 'compact':
+        return thread_id
+    context_chars = state_store.thread_context_chars(session_id)
+    if context_chars < THREAD_COMPACT_CHARS:
+        return thread_id
+    history = state_store.history(session_id)
+    if not history:
+        return thread_id
+
+    seed = build_compact_seed(history)
+    seed_chars = sum(len(m['content']) for m in seed)
+    if context_chars - seed_chars < THREAD_COMPACT_MIN_SAVINGS:
+        # A mag maga is a küszöb közelében van: az előző tömörítés óta nem nőtt eleget a thread
+        logger.debug(f"Tömörítés kihagyva (session: {session_id}): {context_chars} karakter, mag: {seed_chars}")
+        return thread_id
+    try:
+        with openai_breaker:
+            new_thread_id = openai.beta.threads.create(messages=seed).id
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        logger.error(f"Hiba a thread tömörítésekor, a régi thread marad: {str(e)}")
+        return thread_id
+
+    if not state_store.replace_thread(session_id, thread_id, new_thread_id, seed_chars):
+        # Egy párhuzamos kérés már tömörített; a miénk felesleges
+        thread_reaper.enqueue(new_thread_id)
+        return get_or_create_thread(session_id)
+    thread_reaper.enqueue(thread_id, session_id)
+    with context_stats_lock:
+        context_stats['compactions'] += 1
+    logger.info(f"Thread tömörítve (session: {session_id}): {thread_id} -> {new_thread_id}")
+    return new_thread_id
+
+def record_context_usage(session_id, prompt_chars, response_chars, run_seconds):
+    """A thread-be került szöveg könyvelése és futásonkénti kontextusméret statisztika"""
+    context_chars = state_store.thread_context_chars(session_id)
+    state_store.add_thread_context(session_id, prompt_chars + response_chars)
+    with context_stats_lock:
+        context_stats['runs'] += 1
+        context_stats['prompt_chars'] += prompt_chars
+        context_stats['context_chars'] += context_chars + prompt_chars
+        context_stats['run_seconds'] += run_seconds
+    logger.info("Futás kontextusa: %d karakter (prompt: %d), %.2f s", context_chars + prompt_chars, prompt_chars, run_seconds)
+
+# Blokknyitó és -záró kulcsszavak az activity diagramokban (sor eleji egyezés, kisbetűsen)
+PLANTUML_BLOCK_CLOSERS = (
+    ('endif', 'if'), ('end if', 'if'),
+    ('endwhile', 'while'), ('end while', 'while'),
+    ('repeat while', 'repeat'), ('repeatwhile', 'repeat'),
+    ('end fork', 'fork'), ('endfork', 'fork'), ('end merge', 'fork'),
+    ('end split', 'split'), ('endsplit', 'split'),
+    ('endswitch', 'switch'), ('end switch', 'switch'),
+    ('end group', 'group'), ('endgroup', 'group'),
+)
+PLANTUML_BLOCK_CONTINUATIONS = (
+    ('elseif', 'if'), ('else if', 'if'), ('else', 'if'),
+    ('fork again', 'fork'), ('split again', 'split'), ('case', 'switch'),
+    ('backward', 'repeat'),
+)
+PLANTUML_BLOCK_OPENERS = ('if', 'while', 'repeat', 'fork', 'split', 'switch', 'group')
+PLANTUML_STOP_KEYWORDS = ('stop', 'end', 'kill', 'detach')
+PLANTUML_ACTIVITY_TERMINATORS = (';', '|', '<', '>', '/', ']', '}')
+
+def _starts_with_keyword(text, keyword):
+    """Szóhatáron illeszkedő kulcsszó a sor elején ('if' igen, 'iframe' nem)"""
+    return text.startswith(keyword) and (len(text) == len(keyword) or not (text[len(keyword)].isalnum() or text[len(keyword)] == '_'))
+
+class PlantUMLNormalizer:
+    """Asszisztens kimenetének normalizálása egyetlen lineáris menetben
+
+    Egy lépésben kinyeri az első @startuml ... @enduml blokkot (markdown kerettel vagy anélkül),
+    közvetlenül a @startuml után egyszer beszúrja a téma direktíváit, kitisztítja a note
+    sorokat, és ellenőrzi az activity diagram blokkjainak egyensúlyát.
+    """
+
+    def __init__(self, theme_directives=(), sanitize_notes=True):
+        self.theme_directives = list(theme_directives)
+        self.sanitize_notes = sanitize_notes
+
+    def normalize(self, text):
+        """Visszaadja a normalizált kódot és a hibák listáját ({'line': sorszám, 'message': leírás})"""
+        errors = []
+        output = []
+        stack = []  # (blokk típusa, nyitó sor száma)
+        seen_start = seen_stop = False
+        start_line = end_line = None
+        in_note = in_comment = in_activity = False
+        number = 0
+
+        for number, line in enumerate(text.split('\n'), 1):
+            text_line = line.strip()
+            lowered = text_line.lower()
+
+            if start_line is None:
+                # A blokk előtti szöveg (markdown keret, magyarázat) kimarad
+                if lowered.startswith('@startuml'):
+                    start_line = number
+                    output.append(text_line)
+                    output.extend(self.theme_directives)
+                continue
+            if lowered.startswith('@enduml') and not (in_note or in_comment or in_activity):
+                # Csak az első blokkot tartjuk meg, a további @startuml blokkok kimaradnak
+                end_line = number
+                output.append(text_line)
+                break
+
+            output.append(line)
+            if in_comment:
+                in_comment = not lowered.endswith("'/")
+                continue
+            if in_note:
+                in_note = lowered not in ('end note', 'endnote')
+                continue
+            if in_activity:
+                in_activity = not lowered.endswith(PLANTUML_ACTIVITY_TERMINATORS)
+                continue
+            if not text_line or text_line.startswith("'"):
+                continue
+            if text_line.startswith("/'"):
+                in_comment = not lowered.endswith("'/")
+                continue
+            if text_line.startswith(':'):
+                # Több soros tevékenység: a lezáró karakterig nem értelmezzük a kulcsszavakat
+                in_activity = not lowered.endswith(PLANTUML_ACTIVITY_TERMINATORS)
+                continue
 
-def generate_plantuml_with_assistant(user_message, session_id):
-    logger.debug(f"PlantUML generálás indítása: {user_message}, session: {session_id}")
+            if _starts_with_keyword(lowered, 'note') or _starts_with_keyword(lowered, 'floating note'):
+                if self.sanitize_notes:
+                    # Zárójelek eltávolítása a note sorból
+                    output[-1] = line.replace('(', '').replace(')', '')
+                in_note = ':' not in text_line
+                continue
+            if lowered == 'start':
+                seen_start = True
+                continue
+            if lowered in PLANTUML_STOP_KEYWORDS:
+                seen_stop = True
+                continue
 
-    # Thread kezelés session alapján
-    thread_id = get_or_create_thread(session_id)
+            closer = next((kind for keyword, kind in PLANTUML_BLOCK_CLOSERS if _starts_with_keyword(lowered, keyword)), None)
+            if closer:
+                if not stack or stack[-1][0] != closer:
+                    found = f"'{stack[-1][0]}' opened on line {stack[-1][1]}" if stack else 'no open block'
+                    errors.append({'line': number, 'message': f"'{text_line}' does not close a '{closer}' block ({found})"})
+                else:
+                    stack.pop()
+                continue
+            continuation = next((kind for keyword, kind in PLANTUML_BLOCK_CONTINUATIONS if _starts_with_keyword(lowered, keyword)), None)
+            if continuation:
+                if not stack or stack[-1][0] != continuation:
+                    errors.append({'line': number, 'message': f"'{text_line}' outside of a '{continuation}' block"})
+                continue
+            opener = next((keyword for keyword in PLANTUML_BLOCK_OPENERS if _starts_with_keyword(lowered, keyword)), None)
+            if opener:
+                stack.append((opener, number))
+                continue
+            if lowered.startswith('partition') and lowered.endswith('{'):
+                stack.append(('partition', number))
+                continue
+            if lowered == '}':
+                if not stack or stack[-1][0] != 'partition':
+                    errors.append({'line': number, 'message': "'}' does not close a partition"})
+                else:
+                    stack.pop()
+
+        if start_line is None:
+            errors.append({'line': 0, 'message': 'missing @startuml'})
+        elif end_line is None:
+            errors.append({'line': number, 'message': 'missing @enduml'})
+        if in_note:
+            errors.append({'line': number, 'message': "multi-line note is not closed with 'end note'"})
+        for kind, opened_on in stack:
+            errors.append({'line': opened_on, 'message': f"'{kind}' block is never closed"})
+        if start_line is not None and not seen_start:
+            errors.append({'line': start_line, 'message': "missing 'start'"})
+        if start_line is not None and not seen_stop:
+            errors.append({'line': start_line, 'message': "missing 'stop' or 'end'"})
+
+        return '\n'.join(output), errors
+
+def plantuml_theme_directives():
+    """A beállításokból összeállított téma direktívák"""
+    directives = []
+    if PLANTUML_THEME:
+        directives.append(f'!theme {PLANTUML_THEME}')
+    directives.extend(f'skinparam {skinparam.strip()}' for skinparam in PLANTUML_SKINPARAMS.split(';') if skinparam.strip())
+    if PLANTUML_FONT:
+        directives.append(f'skinparam defaultFontName {PLANTUML_FONT}')
+    return directives
+
+plantuml_normalizer = PlantUMLNormalizer(theme_directives=plantuml_theme_directives())
+
+USER_PROMPT_PREAMBLE = """ ALWAYS GIVE THE SAME LANGUAGE AS THE USERS INPUT!  Create PlantUML Activity diagram code for this business process, ensuring the code strictly follows PlantUML syntax.   Only return the PlantUML code, which should include extra PLANTUML notes for steps.  The output should be in in the input language, and return nothing else but the PlantUML code. Don't use swimlanes! Always remember and modify based on previous processes in one conversation! Be cautious with conditionals, sepecially with if and else structures!
+User input: """
+
+FOLLOWUP_PROMPT_PREAMBLE = """Modify your last PlantUML Activity diagram according to the request below. Keep the same language, return only the complete PlantUML code and nothing else.
+User input: """
+
+def build_user_prompt(user_message, followup=False):
+    """Az asszisztensnek küldött üzenet összeállítása; tömör módban a folytatás nem ismétli a teljes utasítást"""
+    if followup and CONTEXT_MODE == 'compact':
+        return FOLLOWUP_PROMPT_PREAMBLE + user_message
+    return USER_PROMPT_PREAMBLE + user_message
+
+def build_correction_prompt(errors):
+    """Javítási kérés az asszisztensnek a helyi ellenőrzés hibái alapján (renderelés előtt)"""
+    error_lines = '\n'.join(f"- line {error['line']}: {error['message']}" for error in errors)
+    return f""" ALWAYS GIVE THE SAME LANGUAGE AS THE USERS INPUT!  The PlantUML code you returned is invalid:
+{error_lines}
+Fix these problems and return the complete corrected PlantUML Activity diagram code, and nothing else."""
+
+def process_assistant_response(assistant_response):
+    """Asszisztens válaszának ellenőrzése és tisztítása; visszaadja a (kód vagy None, hibák) párt"""
+    # Kinyerés, validáció, téma és note-ok tisztítása egy menetben
+    cleaned_response, errors = plantuml_normalizer.normalize(assistant_response)
+    if errors:
+        logger.warning(f"Hibás PlantUML kód a válaszban, újrapróbálkozás: {errors}")
+        return None, errors
+
+    logger.debug("Tisztított válasz: %s", cleaned_response)
+    return cleaned_response, []
+
+def generate_plantuml_with_assistant(user_message, session_id, budget=None, preview=None):
+    logger.debug("PlantUML generálás indítása: %s, session: %s", user_message, session_id)
+    budget = budget or RetryBudget()
+
+    # Thread kezelés session alapján; túl hosszú thread helyett tömör új thread
+    with timed_stage('thread_lookup'):
+        thread_id = get_or_create_thread(session_id)
+        if thread_id:
+            thread_id = compact_thread_if_needed(session_id, thread_id)
     if not thread_id:
         return None, None
+    followup = state_store.thread_context_chars(session_id) > 0
 
-    max_attempts = 3
-    attempt = 0
-    
-    while attempt < max_attempts:
+    errors = None
+    while budget.next_attempt():
         try:
-            # Üzenet küldése
-            message = openai.beta.threads.messages.create(
-                thread_id=thread_id,
-                role="user",
-                content=f""" ALWAYS GIVE THE SAME LANGUAGE AS THE USERS INPUT!  Create PlantUML Activity diagram code for this business process, ensuring the code strictly follows PlantUML syntax.   Only return the PlantUML code, which should include extra PLANTUML notes for steps.  The output should be in in the input language, and return nothing else but the PlantUML code. Don't use swimlanes! Always remember and modify based on previous processes in one conversation! Be cautious with conditionals, sepecially with if and else structures!
-User input: {user_message}"""
-            )
-            logger.debug(f"OpenAI üzenet elküldve: {message}")
-
-            # Futtatás indítása
-            run = openai.beta.threads.runs.create(
-                thread_id=thread_id,
-                assistant_id=ASSISTANT_ID,
-            )
-            logger.debug(f"OpenAI futtatás indítva: {run}")
-
-            # Státusz ellenőrzése
-            status = check_status(run.id, thread_id)
-            while status != "completed":
-                logger.debug(f"Várakozás a futás befejezésére, jelenlegi státusz: {status}")
-                status = check_status(run.id, thread_id)
-                time.sleep(2)
-
-            # Válasz lekérése
-            response = openai.beta.threads.messages.list(thread_id=thread_id)
-            logger.debug(f"OpenAI válasz: {response}")
+            with openai_breaker:
+                # Üzenet küldése; hibás előző válasz esetén a hibák javítását kérjük
+                prompt = build_correction_prompt(errors) if errors else build_user_prompt(user_message, followup)
+                with timed_stage('message_create'):
+                    message = openai.beta.threads.messages.create(
+                        thread_id=thread_id,
+                        role="user",
+                        content=prompt
+                    )
+                logger.debug("OpenAI üzenet elküldve: %s", message)
+
+                # Futtatás indítása és várakozás a befejezésre; előnézetnél a válasz menet közben érkezik
+                if preview is not None:
+                    preview.reset()
+                run_started = time.monotonic()
+                with timed_stage('run_wait'):
+                    run_id, status = run_assistant(
+                        thread_id,
+                        timeout=budget.remaining(),
+                        on_delta=preview.feed if preview is not None else None
+                    )
+                run_seconds = time.monotonic() - run_started
+                if preview is not None:
+                    preview.close()
+                if status != "completed":
+                    record_context_usage(session_id, len(prompt), 0, run_seconds)
+                    raise RunFailedError(f"A futás nem fejeződött be sikeresen (run: {run_id}, státusz: {status})")
+
+                # Válasz lekérése
+                with timed_stage('message_list'):
+                    response = openai.beta.threads.messages.list(thread_id=thread_id)
+            logger.debug("OpenAI válasz: %s", response)
             
             if not response.data:
                 logger.error("Nem sikerült asszisztens válaszát lekérni.")
-                attempt += 1
                 continue
 
             assistant_response = response.data[0].content[0].text.value
-            logger.debug(f"Asszisztens válasza: {assistant_response}")
+            logger.debug("Asszisztens válasza: %s", assistant_response)
+            record_context_usage(session_id, len(prompt), len(assistant_response), run_seconds)
             
-            # PlantUML kód validáció
-            if not "@startuml" in assistant_response or not "@enduml" in assistant_response:
-                logger.warning("Hiányzó @startuml vagy @enduml a válaszból, újrapróbálkozás...")
-                attempt += 1
+            with timed_stage('normalize'):
+                cleaned_response, errors = process_assistant_response(assistant_response)
+            if cleaned_response is None:
                 continue
 
-            # További PlantUML szintaxis ellenőrzések
-            if not "start" in assistant_response.lower() or not "stop" in assistant_response.lower():
-                logger.warning("Hiányzó start/stop elemek a PlantUML kódból, újrapróbálkozás...")
-                attempt += 1
-                continue
-
-            cleaned_response = assistant_response.replace("```plantuml", "").rstrip("`").strip()
-            cleaned_response = cleaned_response.replace(
-                '@startuml',
-                '@startuml\nskinparam ConditionEndStyle hline\nskinparam defaultFontName Montserrat'
-            )
-            # Note-ok tisztítása
-            cleaned_response = clean_plantuml_notes(cleaned_response)
-            logger.debug(f"Tisztított válasz: {cleaned_response}")
-
             return thread_id, cleaned_response
 
+        except CircuitOpenError:
+            raise
         except Exception as e:
             logger.error(f"Hiba történt a PlantUML generálás során: {str(e)}")
-            attempt += 1
-            time.sleep(2)
 
     return None, None
 
+def wants_generation_cache(data, cache_control):
+    """Kérésenkénti kikapcsolás: {"cache": false} a törzsben vagy Cache-Control: no-cache fejléc"""
+    return data.get('cache', True) is not False and 'no-cache' not in (cache_control or '').lower()
+
+def append_cached_exchange(session_id, thread_id, user_message, plantuml_code):
+    """Cache-ből kiszolgált válasz rögzítése a thread-ben, hogy a későbbi módosító kérések ismerjék"""
+    try:
+        prompt = build_user_prompt(user_message, followup=state_store.thread_context_chars(session_id) > 0)
+        with openai_breaker:
+            openai.beta.threads.messages.create(thread_id=thread_id, role="user", content=prompt)
+            openai.beta.threads.messages.create(thread_id=thread_id, role="assistant", content=plantuml_code)
+        state_store.add_thread_context(session_id, len(prompt) + len(plantuml_code))
+    except Exception as e:
+        logger.warning(f"Nem sikerült a cache-elt választ a thread-hez fűzni: {str(e)}")
+
+def generate_plantuml_cached(user_message, session_id, budget, preview=None, use_cache=True):
+    """generate_plantuml_with_assistant generálási cache-sel; visszaadja a (thread_id, kód, cache kulcs) hármast"""
+    if not use_cache or GENERATION_CACHE_SIZE <= 0:
+        thread_id, plantuml_code = generate_plantuml_with_assistant(user_message, session_id, budget, preview)
+        return thread_id, plantuml_code, None
+
+    latest = state_store.latest_history(session_id)
+    key = generation_cache.key_for(user_message, latest.plantuml if latest else '')
+    plantuml_code = generation_cache.lookup(key)
+    if plantuml_code is None:
+        future, leader = generation_cache.begin(key)
+        if leader:
+            try:
+                thread_id, plantuml_code = generate_plantuml_with_assistant(user_message, session_id, budget, preview)
+            except BaseException as e:
+                generation_cache.fail(key, future, e)
+                raise
+            generation_cache.finish(key, future, plantuml_code)
+            return thread_id, plantuml_code, key
+        try:
+            plantuml_code = future.result(timeout=budget.remaining())
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.warning(f"Az összevont generálás sikertelen, saját futás indul: {str(e)}")
+        if not plantuml_code:
+            thread_id, plantuml_code = generate_plantuml_with_assistant(user_message, session_id, budget, preview)
+            return thread_id, plantuml_code, None
+
+    logger.info("Generálás a cache-ből, asszisztens futás nélkül")
+    thread_id = get_or_create_thread(session_id)
+    if not thread_id:
+        return None, None, None
+    append_cached_exchange(session_id, thread_id, user_message, plantuml_code)
+    return thread_id, plantuml_code, key
+
 def check_status(run_id, thread_id):
     run = openai.beta.threads.runs.retrieve(
         thread_id=thread_id,
@@ -211,158 +1315,1438 @@ def check_status(run_id, thread_id):
     )
     return run.status
 
+def record_run_wait(run_id, status, wait_seconds):
+    """Futásonkénti várakozási idő rögzítése"""
+    with run_wait_lock:
+        run_wait_stats['runs'] += 1
+        run_wait_stats['total_wait'] += wait_seconds
+        run_wait_stats['max_wait'] = max(run_wait_stats['max_wait'], wait_seconds)
+        run_wait_stats['by_status'][status] = run_wait_stats['by_status'].get(status, 0) + 1
+    logger.info("Futás vége: %s, státusz: %s, várakozás: %.2f s", run_id, status, wait_seconds)
+
+def cancel_run(run_id, thread_id):
+    """Futás megszakítása; amíg aktív, a thread-be nem írhatunk új üzenetet"""
+    try:
+        openai.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        logger.error(f"Hiba a futás megszakításakor: {str(e)}")
+
+def wait_for_run(run_id, thread_id, deadline=None):
+    """Várakozás a futás végére adaptív visszalépéssel és határidővel"""
+    if deadline is None:
+        deadline = time.monotonic() + RUN_WAIT_TIMEOUT
+    delay = RUN_POLL_INITIAL_DELAY
+    status = check_status(run_id, thread_id)
+    while status not in RUN_TERMINAL_STATUSES:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning(f"Lejárt a várakozási határidő (run: {run_id}), futás megszakítása")
+            cancel_run(run_id, thread_id)
+            return "timeout"
+        time.sleep(min(delay, remaining))
+        delay = min(delay * RUN_POLL_BACKOFF, RUN_POLL_MAX_DELAY)
+        status = check_status(run_id, thread_id)
+        logger.debug("Futás státusza: %s (run: %s)", status, run_id, extra={'sample_key': 'run-status'})
+    return status
+
+class StreamInterruptedError(Exception):
+    """A futás eseményfolyama megszakadt; run_id a már elindult futás (None, ha még nem indult el)"""
+
+    def __init__(self, run_id, cause):
+        super().__init__(f"Az eseményfolyam megszakadt: {cause}")
+        self.run_id = run_id
+
+def stream_run(thread_id, deadline, on_delta=None):
+    """Futás indítása streameléssel, a befejező eseményig olvasva; on_delta a válasz szövegdarabjait kapja
+
+    Ha az eseményfolyam hibával megszakad, StreamInterruptedError jelzi, melyik futás indult már el.
+    """
+    run_id, status = None, None
+    try:
+        # A timeout a két esemény közötti olvasásra is vonatkozik, így egy elakadt stream sem lépi túl a határidőt
+        with openai.beta.threads.runs.stream(
+            thread_id=thread_id,
+            assistant_id=ASSISTANT_ID,
+            timeout=max(1.0, deadline - time.monotonic()),
+        ) as stream:
+            for event in stream:
+                if run_id is not None and time.monotonic() > deadline:
+                    logger.warning(f"Lejárt a várakozási határidő (run: {run_id}), futás megszakítása")
+                    cancel_run(run_id, thread_id)
+                    return run_id, "timeout"
+                if event.event == 'thread.message.delta' and on_delta is not None:
+                    for block in event.data.delta.content or ():
+                        if block.type == 'text' and block.text and block.text.value:
+                            on_delta(block.text.value)
+                    continue
+                if not event.event.startswith('thread.run.') or event.event.startswith('thread.run.step'):
+                    continue
+                run_id = event.data.id
+                status = event.data.status
+                if status in RUN_TERMINAL_STATUSES:
+                    break
+    except Exception as e:
+        raise StreamInterruptedError(run_id, e) from e
+    if run_id is not None and status not in RUN_TERMINAL_STATUSES:
+        # A stream a befejező esemény előtt ért véget, pollozással folytatjuk
+        status = wait_for_run(run_id, thread_id, deadline)
+    return run_id, status
+
+def run_assistant(thread_id, timeout=RUN_WAIT_TIMEOUT, on_delta=None):
+    """Asszisztens futtatása a thread-en; visszaadja a run azonosítót és a végső státuszt
+
+    on_delta megadásakor mindig streamelve fut, hogy a válasz darabjai menet közben továbbíthatók legyenek.
+    """
+    started = time.monotonic()
+    deadline = started + min(timeout, RUN_WAIT_TIMEOUT)
+    run_id, status = None, None
+    if RUN_WAIT_MODE == 'stream' or on_delta is not None:
+        try:
+            run_id, status = stream_run(thread_id, deadline, on_delta)
+        except StreamInterruptedError as e:
+            logger.warning(f"Streamelt futás sikertelen, visszatérés pollozásra: {str(e)}")
+            # A már elindult futást követjük tovább; új futás csak akkor indul, ha az első létre sem jött
+            run_id = e.run_id
+            if run_id is not None:
+                status = wait_for_run(run_id, thread_id, deadline)
+    if run_id is None:
+        run = openai.beta.threads.runs.create(
+            thread_id=thread_id,
+            assistant_id=ASSISTANT_ID,
+        )
+        logger.debug("OpenAI futtatás indítva: %s", run.id)
+        run_id = run.id
+        status = run.status if run.status in RUN_TERMINAL_STATUSES else wait_for_run(run_id, thread_id, deadline)
+    if status == 'requires_action':
+        # Magától nem lép tovább, és amíg aktív, az újrapróbálkozás sem írhat a thread-be
+        logger.warning(f"A futás eszközhívásra vár (run: {run_id}), megszakítás")
+        cancel_run(run_id, thread_id)
+    record_run_wait(run_id, status, time.monotonic() - started)
+    return run_id, status
+
 def compress_and_encode_plantuml(plantuml_code):
     compressed = zlib.compress(plantuml_code.encode('utf-8'))
     return encode64_for_ascii(compressed)
 
+# A PlantUML saját base64 ábécéje a szabványos helyett; a két tábla között bytes.translate fordít
+PLANTUML_BASE64_CHARS = b'0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_'
+STANDARD_BASE64_CHARS = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+_TO_PLANTUML_BASE64 = bytes.maketrans(STANDARD_BASE64_CHARS, PLANTUML_BASE64_CHARS)
+_FROM_PLANTUML_BASE64 = bytes.maketrans(PLANTUML_BASE64_CHARS, STANDARD_BASE64_CHARS)
+
 def encode64_for_ascii(bytes_data):
-    base64_chars = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_'
-    result = ''
-    i = 0
-    while i < len(bytes_data):
-        b1 = bytes_data[i] if i < len(bytes_data) else 0
-        b2 = bytes_data[i + 1] if i + 1 < len(bytes_data) else 0
-        b3 = bytes_data[i + 2] if i + 2 < len(bytes_data) else 0
-        
-        c1 = b1 >> 2
-        c2 = ((b1 & 0x3) << 4) | (b2 >> 4)
-        c3 = ((b2 & 0xF) << 2) | (b3 >> 6)
-        c4 = b3 & 0x3F
-        
-        result += (base64_chars[c1] + base64_chars[c2] +
-                  (base64_chars[c3] if i + 1 < len(bytes_data) else '') +
-                  (base64_chars[c4] if i + 2 < len(bytes_data) else ''))
-        i += 3
-    
-    return result
+    """PlantUML base64 kódolás egy menetben (padding nélkül, ahogy a szerver várja)"""
+    return base64.b64encode(bytes_data).translate(_TO_PLANTUML_BASE64).rstrip(b'=').decode('ascii')
+
+def decode64_for_ascii(text):
+    """Az encode64_for_ascii inverze"""
+    data = text.encode('ascii').translate(_FROM_PLANTUML_BASE64)
+    return base64.b64decode(data + b'=' * (-len(data) % 4))
+
+def decode_plantuml(encoded_uml):
+    """Kódolt diagram (URL rész, opcionális ~1 előtaggal) visszaalakítása PlantUML forrássá"""
+    if encoded_uml.startswith('~1'):
+        encoded_uml = encoded_uml[2:]
+    return zlib.decompress(decode64_for_ascii(encoded_uml)).decode('utf-8')
+
+class DiagramRenderer:
+    """PlantUML renderelő backend közös felülete"""
+    name = 'base'
+
+    def render_svg(self, plantuml_code):
+        """SVG szöveg előállítása; sikertelen renderelésnél None"""
+        raise NotImplementedError
+
+    def render_many(self, plantuml_codes):
+        return [self.render_svg(code) for code in plantuml_codes]
+
+    def warm_up(self):
+        """Előmelegítés az első kérés előtt (folyamatok, kapcsolatok); alapból nincs teendő"""
+
+    def close(self):
+        pass
+
+class RemoteRenderer(DiagramRenderer):
+    """PlantUML szerver HTTP-n keresztül (plantuml.com vagy saját példány)"""
+    name = 'remote'
+
+    def __init__(self, base_url=PLANTUML_SERVER_URL, timeout=PLANTUML_RENDER_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._http = None
+
+    @property
+    def http(self):
+        # A requests csomagot és a kapcsolatkészletet csak az első renderelés tölti be
+        if self._http is None:
+            self._http = requests.Session()
+        return self._http
+
+    def warm_up(self):
+        """Kapcsolat (TLS kézfogás) felépítése a készletben, hogy az első renderelés ne várjon rá"""
+        self.http.head(self.base_url, timeout=self.timeout)
+
+    def render_svg(self, plantuml_code):
+        encoded_uml = compress_and_encode_plantuml(plantuml_code)
+        response = self.http.get(f"{self.base_url}/svg/~1{encoded_uml}", timeout=self.timeout)
+        # Szerveroldali hiba a megszakítónak számít, a hibás diagram (4xx) nem
+        if response.status_code >= 500:
+            response.raise_for_status()
+        if response.status_code != 200:
+            logger.warning(f"PlantUML szerver hibakód: {response.status_code}")
+            return None
+        return response.text
+
+class PlantUMLPipeWorker:
+    """Egy hosszan futó `plantuml -pipe` folyamat; a JVM indítását csak egyszer fizetjük meg"""
+    DELIMITER = '___XFLOWER_PLANTUML_END___'
+
+    def __init__(self, jar_path, java_cmd='java'):
+        self.command = [
+            java_cmd, '-Djava.awt.headless=true', '-jar', jar_path,
+            '-tsvg', '-charset', 'UTF-8', '-pipe', '-pipedelimitor', self.DELIMITER,
+        ]
+        self.process = None
+
+    def _ensure_started(self):
+        if self.process is None or self.process.poll() is not None:
+            self.process = subprocess.Popen(
+                self.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            # A bemenetet select mellett írjuk, egy teli pipe nem blokkolhat
+            os.set_blocking(self.process.stdin.fileno(), False)
+            logger.info(f"PlantUML worker elindítva (pid: {self.process.pid})")
 
-def create_a4_image(image_data, recipient_name):
-    # Base64 kép feldolgozása
-    image_bytes = base64.b64decode(image_data.split('base64,')[1])
-    image = Image.open(BytesIO(image_bytes))
-    
-    # Új A4 méretű kép létrehozása fehér háttérrel
-    a4_image = Image.new('RGB', (A4_WIDTH, A4_HEIGHT), 'white')
-    draw = ImageDraw.Draw(a4_image)
-    margin = int(A4_WIDTH * 0.02)
+    def _exchange(self, payload, count, deadline):
+        """A bemenet írása és a kimenetek olvasása egyszerre, select-tel
 
-    # Cím hozzáadása
-    try:
-        font = ImageFont.truetype('Montserrat-Bold.ttf', size=int(A4_WIDTH * 0.02))
-    except Exception as e:
-        logger.warning(f"Nem sikerült a Montserrat betöltése: {e}")
-        font = ImageFont.load_default()
+        Nem írhatjuk ki a teljes köteget olvasás előtt: ha a kimenet megtelíti a pipe-ot, a
+        PlantUML az írásnál, mi pedig a bemenet írásánál akadnánk el, és a határidő sem érvényesülne.
+        """
+        marker = self.DELIMITER.encode('utf-8')
+        in_fd, out_fd = self.process.stdin.fileno(), self.process.stdout.fileno()
+        pending = memoryview(payload)
+        outputs, buffer = [], b''
+        while len(outputs) < count:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("PlantUML worker nem válaszolt időben")
+            readable, writable, _ = select.select([out_fd], [in_fd] if pending else [], [], remaining)
+            if writable:
+                try:
+                    pending = pending[os.write(in_fd, pending[:65536]):]
+                except BlockingIOError:
+                    pass
+            if readable:
+                chunk = os.read(out_fd, 65536)
+                if not chunk:
+                    raise RuntimeError("A PlantUML worker váratlanul leállt")
+                buffer += chunk
+                while marker in buffer and len(outputs) < count:
+                    output, _, buffer = buffer.partition(marker)
+                    outputs.append(output)
+                    buffer = buffer.lstrip(b'\r\n')
+        return outputs
+
+    def render_many(self, plantuml_codes, timeout):
+        """Több diagram egyetlen kötegként; a kimeneteket sorrendben olvassuk vissza"""
+        self._ensure_started()
+        payload = ''.join(code.strip() + '\n' for code in plantuml_codes).encode('utf-8')
+        deadline = time.monotonic() + timeout * len(plantuml_codes)
+        try:
+            outputs = self._exchange(payload, len(plantuml_codes), deadline)
+        except Exception:
+            # Félbehagyott kimenet után a folyamat állapota bizonytalan, újraindítjuk
+            self.close()
+            raise
+        results = []
+        for output in outputs:
+            svg_text = output.decode('utf-8', errors='replace').strip()
+            results.append(svg_text if svg_text.startswith(('<svg', '<?xml')) else None)
+        return results
+
+    def close(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+class LocalJarRenderer(DiagramRenderer):
+    """Helyi PlantUML jar, előre melegített worker folyamatok korlátos készletével"""
+    name = 'local'
+
+    def __init__(self, jar_path=PLANTUML_JAR, pool_size=PLANTUML_WORKERS, timeout=PLANTUML_RENDER_TIMEOUT):
+        self.timeout = timeout
+        self._idle = queue.Queue()
+        for _ in range(pool_size):
+            self._idle.put(PlantUMLPipeWorker(jar_path))
+
+    def render_many(self, plantuml_codes):
+        # A készlet mérete egyben a párhuzamos renderelések felső korlátja
+        worker = self._idle.get(timeout=self.timeout)
+        try:
+            return worker.render_many(plantuml_codes, self.timeout)
+        finally:
+            self._idle.put(worker)
 
-    title = "A Te xFLOWer folyamatod"
-    title_bbox = draw.textbbox((0, 0), title, font=font)
-    title_width = title_bbox[2] - title_bbox[0]
-    title_height = title_bbox[3] - title_bbox[1]
-    title_x = (A4_WIDTH - title_width) // 2
-    title_y = margin
+    def render_svg(self, plantuml_code):
+        return self.render_many([plantuml_code])[0]
 
-    draw.text((title_x, title_y), title, font=font, fill='black')
+    def warm_up(self):
+        """Minden worker elindítása, hogy az első kérés már meleg JVM-et kapjon"""
+        workers = [self._idle.get() for _ in range(self._idle.qsize())]
+        try:
+            for worker in workers:
+                worker._ensure_started()
+        finally:
+            for worker in workers:
+                self._idle.put(worker)
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+class PicowebRenderer(RemoteRenderer):
+    """Helyi PlantUML jar beépített HTTP szerverrel (-picoweb), a loopback interfészen"""
+    name = 'picoweb'
+
+    def __init__(self, jar_path=PLANTUML_JAR, port=PLANTUML_PICOWEB_PORT, timeout=PLANTUML_RENDER_TIMEOUT):
+        super().__init__(base_url=f"http://127.0.0.1:{port}/plantuml", timeout=timeout)
+        self.command = ['java', '-Djava.awt.headless=true', '-jar', jar_path, f'-picoweb:{port}:127.0.0.1']
+        self.process = None
+        self._start_lock = Lock()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self.process is not None and self.process.poll() is None:
+                return
+            self.process = subprocess.Popen(self.command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            logger.info(f"PlantUML picoweb elindítva (pid: {self.process.pid})")
+            deadline = time.monotonic() + self.timeout
+            while time.monotonic() < deadline:
+                try:
+                    self.http.get(f"{self.base_url}/svg/", timeout=1)
+                    return
+                except requests.exceptions.ConnectionError:
+                    time.sleep(0.2)
+            raise TimeoutError("A PlantUML picoweb szerver nem indult el időben")
+
+    def render_svg(self, plantuml_code):
+        self._ensure_started()
+        return super().render_svg(plantuml_code)
+
+    def warm_up(self):
+        self._ensure_started()
+
+    def close(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+DIAGRAM_RENDERERS = {
+    'remote': RemoteRenderer,
+    'local': LocalJarRenderer,
+    'picoweb': PicowebRenderer,
+}
 
-    # Logo betöltése és méretezése
-    logo = Image.open('logo2.png')
-    if logo.mode != 'RGBA':
-        logo = logo.convert('RGBA')
-    
-    logo_width = int(A4_WIDTH * 0.15)
-    logo_height = int(logo.height * (logo_width / logo.width))
-    logo = logo.resize((logo_width, logo_height), Image.Resampling.LANCZOS)
-
-    # Diagram méretezése és pozicionálása
-    diagram_y = title_y + title_height + margin
-    max_diagram_width = A4_WIDTH - (margin * 2)
-    max_diagram_height = A4_HEIGHT - diagram_y - logo_height - (margin * 2)
-
-    diagram_ratio = min(
-        max_diagram_width / image.width,
-        max_diagram_height / image.height
-    )
-    new_width = int(image.width * diagram_ratio)
-    new_height = int(image.height * diagram_ratio)
-    image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-    diagram_x = (A4_WIDTH - new_width) // 2
-    diagram_y = diagram_y + ((max_diagram_height - new_height) // 2)
-    a4_image.paste(image, (diagram_x, diagram_y))
-
-    # Logo és weboldal cím hozzáadása
-    logo_position = (margin, A4_HEIGHT - logo_height - margin)
-    if logo.mode == 'RGBA':
-        alpha = logo.split()[3]
-        a4_image.paste(logo, logo_position, mask=alpha)
-
-    # Weboldal cím
-    website_text = "xflower.hu"
-    website_font_size = int(logo_height * 0.5)
+def create_renderer(name=PLANTUML_RENDERER):
+    """Renderelő backend létrehozása név alapján"""
+    if name not in DIAGRAM_RENDERERS:
+        raise ValueError(f"Ismeretlen PlantUML renderelő: {name}")
+    return DIAGRAM_RENDERERS[name]()
+
+diagram_renderer = create_renderer()
+
+class RenderCache:
+    """Korlátos méretű, tartalom alapú cache a renderelt diagramokhoz (memória LRU + opcionális lemez)"""
+
+    def __init__(self, max_entries=128, disk_dir=None, disk_max_entries=1024, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes_held = 0
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'disk_evictions': 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def key_for(plantuml_code, variant='png'):
+        """Kulcs a forrás és a kimeneti változat (pl. 'svg', 'png@150', 'thumbnail@320') alapján"""
+        return hashlib.sha256(f'{variant}\0{plantuml_code.strip()}'.encode('utf-8')).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f'{key}.bin')
+
+    def get(self, plantuml_code, variant='png'):
+        key = self.key_for(plantuml_code, variant)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return self._entries[key]
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), 'rb') as f:
+                    data = f.read()
+                os.utime(self._disk_path(key))
+                with self._lock:
+                    self.stats['disk_hits'] += 1
+                self._remember(key, data)
+                return data
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Hiba a render cache olvasásakor: {str(e)}")
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, plantuml_code, data, variant='png'):
+        key = self.key_for(plantuml_code, variant)
+        self._remember(key, data)
+        if self.disk_dir:
+            try:
+                # Atomi írás, hogy párhuzamos kérések ne lássanak félig kiírt fájlt
+                tmp_path = f'{self._disk_path(key)}.{os.getpid()}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, self._disk_path(key))
+                self._trim_disk()
+            except OSError as e:
+                logger.warning(f"Hiba a render cache írásakor: {str(e)}")
+
+    def _remember(self, key, data):
+        with self._lock:
+            if key in self._entries:
+                self.bytes_held -= len(self._entries[key])
+            self._entries[key] = data
+            self.bytes_held += len(data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes is not None and self.bytes_held > self.max_bytes)
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes_held -= len(evicted)
+                self.stats['evictions'] += 1
+
+    def _trim_disk(self):
+        files = [entry for entry in os.scandir(self.disk_dir) if entry.name.endswith('.bin')]
+        if len(files) <= self.disk_max_entries:
+            return
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:len(files) - self.disk_max_entries]:
+            try:
+                os.remove(entry.path)
+                with self._lock:
+                    self.stats['disk_evictions'] += 1
+            except OSError:
+                pass
+
+render_cache = RenderCache(
+    max_entries=RENDER_CACHE_SIZE,
+    disk_dir=RENDER_CACHE_DIR,
+    disk_max_entries=RENDER_CACHE_DISK_SIZE,
+    max_bytes=RENDER_CACHE_MAX_BYTES,
+)
+
+class GenerationCache:
+    """Kérés szintű generálási cache (TTL + LRU) egyszerre futó azonos kérések összevonásával
+
+    A kulcs a normalizált felhasználói üzenet és a session aktuális diagramjának hash-e, így a
+    módosító kérések csak ugyanarról a kiinduló diagramról adnak találatot. Az első kérés
+    (leader) futtatja az asszisztenst, a közben érkező azonos kérések az ő Future-jére várnak.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # kulcs -> (PlantUML kód, lejárat)
+        self._inflight = {}  # kulcs -> Future
+        self._lock = Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'stores': 0, 'evictions': 0, 'expired': 0, 'invalidated': 0}
+
+    @staticmethod
+    def key_for(user_message, current_plantuml):
+        # Kis- és nagybetű, szóközök és a záró írásjel nem számít ("Beszerzési  folyamat." == "beszerzési folyamat")
+        normalized = ' '.join(user_message.split()).casefold().rstrip('.!?')
+        base = hashlib.sha256(current_plantuml.strip().encode('utf-8')).hexdigest() if current_plantuml else ''
+        return hashlib.sha256(f'{normalized}\0{base}'.encode('utf-8')).hexdigest()
+
+    def lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] < time.monotonic():
+                del self._entries[key]
+                self.stats['expired'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[0]
+
+    def begin(self, key):
+        """Visszaadja a kulcs futó generálásának Future-jét és azt, hogy a hívó-e a leader"""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.stats['coalesced'] += 1
+                return future, False
+            future = self._inflight[key] = Future()
+            return future, True
+
+    def finish(self, key, future, plantuml_code):
+        with self._lock:
+            self._inflight.pop(key, None)
+            if plantuml_code:
+                self._entries[key] = (plantuml_code, time.monotonic() + self.ttl)
+                self._entries.move_to_end(key)
+                self.stats['stores'] += 1
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.stats['evictions'] += 1
+        future.set_result(plantuml_code)
+
+    def fail(self, key, future, error):
+        with self._lock:
+            self._inflight.pop(key, None)
+        future.set_exception(error)
+
+    def invalidate(self, key):
+        """Hibásnak bizonyult (pl. nem renderelhető) eredmény eltávolítása"""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.stats['invalidated'] += 1
+
+    def hit_rate(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return self.stats['hits'] / lookups if lookups else 0.0
+
+generation_cache = GenerationCache(max_entries=GENERATION_CACHE_SIZE, ttl=GENERATION_CACHE_TTL)
+
+class HistoryEntry:
+    """Egy beszélgetési lépés tömör rekordja; a kép a forrásból bármikor előállítható"""
+    __slots__ = ('prompt', 'plantuml', 'created_at', 'size')
+
+    def __init__(self, prompt, plantuml, created_at=None):
+        self.prompt = prompt
+        self.plantuml = plantuml
+        self.created_at = created_at or datetime.now()
+        self.size = sys.getsizeof(self) + sys.getsizeof(prompt) + sys.getsizeof(plantuml)
+
+class ConversationHistory:
+    """Session-önkénti történet session- és globális memóriakerettel
+
+    A session-ök a legutóbbi aktivitás szerint vannak sorban; a globális keret
+    túllépésekor a legrégebben aktív session legrégebbi lépései esnek ki először.
+    """
+
+    def __init__(self, session_max_entries, session_max_bytes, max_bytes):
+        self.session_max_entries = session_max_entries
+        self.session_max_bytes = session_max_bytes
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()  # session_id -> deque[HistoryEntry]
+        self._session_bytes = {}
+        self._lock = Lock()
+        self.bytes_held = 0
+        self.evictions = 0
+
+    def _evict_oldest(self, session_id):
+        entry = self._sessions[session_id].popleft()
+        self._session_bytes[session_id] -= entry.size
+        self.bytes_held -= entry.size
+        self.evictions += 1
+        if not self._sessions[session_id]:
+            del self._sessions[session_id]
+            del self._session_bytes[session_id]
+
+    def append(self, session_id, prompt, plantuml):
+        entry = HistoryEntry(prompt, plantuml)
+        with self._lock:
+            entries = self._sessions.setdefault(session_id, deque())
+            self._sessions.move_to_end(session_id)
+            entries.append(entry)
+            self._session_bytes[session_id] = self._session_bytes.get(session_id, 0) + entry.size
+            self.bytes_held += entry.size
+            while session_id in self._sessions and len(entries) > 1 and (
+                len(entries) > self.session_max_entries
+                or self._session_bytes[session_id] > self.session_max_bytes
+            ):
+                self._evict_oldest(session_id)
+            while self.bytes_held > self.max_bytes and len(self._sessions) > 1:
+                self._evict_oldest(next(iter(self._sessions)))
+        return entry
+
+    def entries(self, session_id):
+        """A session lépéseinek másolata (a bejárás közben érkező kérések nem zavarják)"""
+        with self._lock:
+            return list(self._sessions.get(session_id, ()))
+
+    def latest(self, session_id):
+        with self._lock:
+            entries = self._sessions.get(session_id)
+            return entries[-1] if entries else None
+
+    def pop(self, session_id):
+        with self._lock:
+            entries = self._sessions.pop(session_id, None)
+            if entries is not None:
+                self.bytes_held -= self._session_bytes.pop(session_id)
+            return entries
+
+    def __contains__(self, session_id):
+        with self._lock:
+            return session_id in self._sessions
+
+    def memory_report(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'entries': sum(len(entries) for entries in self._sessions.values()),
+                'history_bytes': self.bytes_held,
+                'history_evictions': self.evictions,
+            }
+
+class MemoryStateStore:
+    """Folyamaton belüli session állapot (egy worker esetén)"""
+    name = 'memory'
+
+    def __init__(self):
+        self._threads = {}  # session_id -> {'thread_id': 'xxx', 'last_used': időbélyeg}
+        self._sessions = {}  # session_id -> {'last_activity': időbélyeg, 'notified': bool}
+        self._creating = {}  # session_id -> Future, amíg a thread létrehozása folyamatban van
+        self._lock = Lock()
+        self._history = ConversationHistory(
+            session_max_entries=HISTORY_SESSION_MAX_ENTRIES,
+            session_max_bytes=HISTORY_SESSION_MAX_BYTES,
+            max_bytes=HISTORY_MAX_BYTES,
+        )
+
+    def get_or_create_thread(self, session_id, create_thread, discard_thread=None):
+        # Gyors út zár nélkül: a dict olvasása atomi, a meglévő thread-et senki nem várakoztatja
+        thread_data = self._threads.get(session_id)
+        if thread_data is None:
+            with self._lock:
+                thread_data = self._threads.get(session_id)
+                future = self._creating.get(session_id)
+                owner = thread_data is None and future is None
+                if owner:
+                    future = self._creating[session_id] = Future()
+            if owner:
+                # A hálózati hívás a záron kívül fut; az azonos session többi kérése a future-re vár
+                try:
+                    thread_id = create_thread()
+                except Exception as e:
+                    with self._lock:
+                        del self._creating[session_id]
+                    future.set_exception(e)
+                    raise
+                with self._lock:
+                    self._threads[session_id] = {'thread_id': thread_id, 'last_used': time.time()}
+                    del self._creating[session_id]
+                future.set_result(thread_id)
+                return thread_id
+            if thread_data is None:
+                return future.result(timeout=THREAD_CREATE_TIMEOUT)
+        thread_data['last_used'] = time.time()
+        return thread_data['thread_id']
+
+    def thread_context_chars(self, session_id):
+        thread_data = self._threads.get(session_id)
+        return thread_data.get('context_chars', 0) if thread_data else 0
+
+    def add_thread_context(self, session_id, chars):
+        with self._lock:
+            thread_data = self._threads.get(session_id)
+            if thread_data is not None:
+                thread_data['context_chars'] = thread_data.get('context_chars', 0) + chars
+
+    def replace_thread(self, session_id, old_thread_id, new_thread_id, context_chars):
+        """Thread csere tömörítéskor; hamis, ha közben más kérés már lecserélte"""
+        with self._lock:
+            thread_data = self._threads.get(session_id)
+            if thread_data is None or thread_data['thread_id'] != old_thread_id:
+                return False
+            self._threads[session_id] = {'thread_id': new_thread_id, 'last_used': time.time(), 'context_chars': context_chars}
+            return True
+
+    def pop_expired_threads(self, max_age):
+        cutoff = time.time() - max_age
+        expired = []
+        with self._lock:
+            for session_id in list(self._threads.keys()):
+                if self._threads[session_id]['last_used'] < cutoff:
+                    expired.append((session_id, self._threads.pop(session_id)['thread_id']))
+            for session_id in list(self._sessions.keys()):
+                if self._sessions[session_id]['last_activity'] < cutoff:
+                    del self._sessions[session_id]
+                    self._history.pop(session_id)
+        return expired
+
+    def pop_session(self, session_id):
+        """A session teljes állapotának törlése; visszaadja a hozzá tartozó thread azonosítót"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._history.pop(session_id)
+            thread_data = self._threads.pop(session_id, None)
+        return thread_data['thread_id'] if thread_data else None
+
+    def append_history(self, session_id, prompt, plantuml):
+        self._history.append(session_id, prompt, plantuml)
+        with self._lock:
+            self._sessions[session_id] = {'last_activity': time.time(), 'notified': False}
+
+    def history(self, session_id):
+        return self._history.entries(session_id)
+
+    def latest_history(self, session_id):
+        return self._history.latest(session_id)
+
+    def claim_inactivity(self, session_id, timeout):
+        """Igaz, ha a session valóban inaktív és még senki nem küldött róla értesítést"""
+        with self._lock:
+            activity = self._sessions.get(session_id)
+            if activity is None or activity['notified'] or time.time() - activity['last_activity'] < timeout - 1:
+                return False
+            activity['notified'] = True
+            return True
+
+    def memory_report(self):
+        report = self._history.memory_report()
+        with self._lock:
+            report['threads'] = len(self._threads)
+        return report
+
+class SQLiteStateStore:
+    """Több folyamat között megosztott session állapot SQLite-ban (WAL mód)
+
+    A thread létrehozását egy foglalási sor védi: egy session-höz egyszerre csak egy
+    folyamat hoz létre OpenAI thread-et, a többi megvárja az eredményt.
+    """
+    name = 'sqlite'
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS threads (
+            session_id TEXT PRIMARY KEY,
+            thread_id TEXT,
+            claimed_at REAL NOT NULL,
+            last_used REAL NOT NULL,
+            context_chars INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            last_activity REAL NOT NULL,
+            notified INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            plantuml TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS history_session ON history (session_id, id);
+    """
+
+    def __init__(self, path, session_max_entries, claim_timeout=60):
+        self.path = path
+        self.session_max_entries = session_max_entries
+        self.claim_timeout = claim_timeout
+        self._local = threading.local()
+        self._connection().executescript(self.SCHEMA)
+        try:
+            # Korábbi sémájú adatbázis bővítése
+            self._connection().execute('ALTER TABLE threads ADD COLUMN context_chars INTEGER NOT NULL DEFAULT 0')
+        except sqlite3.OperationalError:
+            pass
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Szálanként saját kapcsolat, kézi tranzakciókezeléssel
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def get_or_create_thread(self, session_id, create_thread, discard_thread=None):
+        """A session thread-je; ha nincs, egy foglaló folyamat hozza létre, a többi megvárja
+
+        Ha a létrehozás tovább tart a claim_timeout-nál, más átveheti a foglalást. Ilyenkor a
+        saját thread-et a discard_thread kapja meg (törlésre), és a győztesét használjuk.
+        """
+        deadline = time.monotonic() + self.claim_timeout
+        while True:
+            now = time.time()
+            with self._transaction() as conn:
+                row = conn.execute(
+                    'SELECT thread_id, claimed_at FROM threads WHERE session_id = ?', (session_id,)
+                ).fetchone()
+                if row is not None and row[0]:
+                    conn.execute('UPDATE threads SET last_used = ? WHERE session_id = ?', (now, session_id))
+                    return row[0]
+                # Nincs thread, vagy a korábbi foglaló elakadt: mi foglaljuk le
+                claimed = row is None or now - row[1] > self.claim_timeout
+                if claimed:
+                    conn.execute(
+                        'INSERT OR REPLACE INTO threads (session_id, thread_id, claimed_at, last_used, context_chars) '
+                        'VALUES (?, NULL, ?, ?, 0)',
+                        (session_id, now, now),
+                    )
+
+            if claimed:
+                conn = self._connection()
+                try:
+                    thread_id = create_thread()
+                except Exception:
+                    conn.execute(
+                        'DELETE FROM threads WHERE session_id = ? AND thread_id IS NULL AND claimed_at = ?',
+                        (session_id, now),
+                    )
+                    raise
+                cursor = conn.execute(
+                    'UPDATE threads SET thread_id = ?, last_used = ? WHERE session_id = ? AND claimed_at = ?',
+                    (thread_id, time.time(), session_id, now),
+                )
+                if cursor.rowcount == 1:
+                    return thread_id
+                # Közben más vette át a foglalást: a mi thread-ünk sehol nincs eltárolva, törölni kell
+                logger.warning(f"Thread foglalás elveszett (session: {session_id}), {thread_id} eldobva")
+                if discard_thread is not None:
+                    discard_thread(thread_id)
+                deadline = time.monotonic() + self.claim_timeout
+                continue
+
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Nem készült el időben a thread (session: {session_id})")
+            time.sleep(0.1)
+
+    def thread_context_chars(self, session_id):
+        row = self._connection().execute(
+            'SELECT context_chars FROM threads WHERE session_id = ?', (session_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def add_thread_context(self, session_id, chars):
+        self._connection().execute(
+            'UPDATE threads SET context_chars = context_chars + ? WHERE session_id = ?', (chars, session_id)
+        )
+
+    def replace_thread(self, session_id, old_thread_id, new_thread_id, context_chars):
+        cursor = self._connection().execute(
+            'UPDATE threads SET thread_id = ?, last_used = ?, context_chars = ? WHERE session_id = ? AND thread_id = ?',
+            (new_thread_id, time.time(), context_chars, session_id, old_thread_id),
+        )
+        return cursor.rowcount == 1
+
+    def pop_expired_threads(self, max_age):
+        cutoff = time.time() - max_age
+        with self._transaction() as conn:
+            expired = conn.execute(
+                'SELECT session_id, thread_id FROM threads WHERE last_used < ? AND thread_id IS NOT NULL', (cutoff,)
+            ).fetchall()
+            conn.execute('DELETE FROM threads WHERE last_used < ? AND thread_id IS NOT NULL', (cutoff,))
+            conn.execute(
+                'DELETE FROM history WHERE session_id IN (SELECT session_id FROM sessions WHERE last_activity < ?)',
+                (cutoff,),
+            )
+            conn.execute('DELETE FROM sessions WHERE last_activity < ?', (cutoff,))
+        return expired
+
+    def pop_session(self, session_id):
+        with self._transaction() as conn:
+            row = conn.execute('SELECT thread_id FROM threads WHERE session_id = ?', (session_id,)).fetchone()
+            conn.execute('DELETE FROM threads WHERE session_id = ?', (session_id,))
+            conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+            conn.execute('DELETE FROM history WHERE session_id = ?', (session_id,))
+        return row[0] if row else None
+
+    def append_history(self, session_id, prompt, plantuml):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT INTO history (session_id, prompt, plantuml, created_at) VALUES (?, ?, ?, ?)',
+                (session_id, prompt, plantuml, now),
+            )
+            conn.execute(
+                'DELETE FROM history WHERE session_id = ? AND id NOT IN '
+                '(SELECT id FROM history WHERE session_id = ? ORDER BY id DESC LIMIT ?)',
+                (session_id, session_id, self.session_max_entries),
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (session_id, last_activity, notified) VALUES (?, ?, 0)',
+                (session_id, now),
+            )
+
+    def history(self, session_id):
+        rows = self._connection().execute(
+            'SELECT prompt, plantuml, created_at FROM history WHERE session_id = ? ORDER BY id', (session_id,)
+        ).fetchall()
+        return [HistoryEntry(prompt, plantuml, datetime.fromtimestamp(created_at)) for prompt, plantuml, created_at in rows]
+
+    def latest_history(self, session_id):
+        row = self._connection().execute(
+            'SELECT prompt, plantuml, created_at FROM history WHERE session_id = ? ORDER BY id DESC LIMIT 1',
+            (session_id,),
+        ).fetchone()
+        return HistoryEntry(row[0], row[1], datetime.fromtimestamp(row[2])) if row else None
+
+    def claim_inactivity(self, session_id, timeout):
+        with self._transaction() as conn:
+            claimed = conn.execute(
+                'UPDATE sessions SET notified = 1 WHERE session_id = ? AND notified = 0 AND last_activity <= ?',
+                (session_id, time.time() - timeout + 1),
+            ).rowcount
+        return claimed == 1
+
+    def memory_report(self):
+        conn = self._connection()
+        entries, history_bytes = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(LENGTH(prompt) + LENGTH(plantuml)), 0) FROM history'
+        ).fetchone()
+        return {
+            'sessions': conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0],
+            'entries': entries,
+            'history_bytes': history_bytes,
+            'threads': conn.execute('SELECT COUNT(*) FROM threads').fetchone()[0],
+        }
+
+def create_state_store(name=STATE_STORE):
+    """Állapottároló létrehozása név alapján"""
+    if name == 'memory':
+        return MemoryStateStore()
+    if name == 'sqlite':
+        return SQLiteStateStore(STATE_STORE_PATH, session_max_entries=HISTORY_SESSION_MAX_ENTRIES)
+    raise ValueError(f"Ismeretlen állapottároló: {name}")
+
+state_store = create_state_store()
+
+def render_plantuml_svg(plantuml_code):
+    """PlantUML kód renderelése SVG-be; ismételt diagramnál a cache-ből dolgozik"""
+    svg_bytes = render_cache.get(plantuml_code, 'svg')
+    if svg_bytes is not None:
+        logger.debug("SVG a render cache-ből")
+        return svg_bytes.decode('utf-8')
+
+    with renderer_breaker, timed_stage('plantuml_fetch'):
+        svg_text = diagram_renderer.render_svg(plantuml_code)
+    if svg_text is None:
+        return None
+
+    render_cache.put(plantuml_code, svg_text.encode('utf-8'), 'svg')
+    return svg_text
+
+def raster_variant(output_format, dpi=RASTER_DEFAULT_DPI):
+    """A raszteres kimenet cache-változatának neve"""
+    if output_format == 'thumbnail':
+        return f'thumbnail@{THUMBNAIL_WIDTH}'
+    return 'png' if dpi == RASTER_DEFAULT_DPI else f'png@{dpi}'
+
+def render_plantuml_png(plantuml_code, output_format='png', dpi=RASTER_DEFAULT_DPI):
+    """PlantUML kód renderelése PNG-be vagy bélyegképpé; a raszterizálás külön folyamatban fut"""
+    variant = raster_variant(output_format, dpi)
+    png_bytes = render_cache.get(plantuml_code, variant)
+    if png_bytes is not None:
+        logger.debug("Diagram a render cache-ből")
+        return png_bytes
+
+    svg_text = render_plantuml_svg(plantuml_code)
+    if svg_text is None:
+        return None
+
+    width = THUMBNAIL_WIDTH if output_format == 'thumbnail' else None
+    with timed_stage('svg_to_png'):
+        png_bytes = run_in_image_pool(rasterize_svg, svg_text, dpi, width)
+    render_cache.put(plantuml_code, png_bytes, variant)
+    return png_bytes
+
+def rasterize_svg(svg_text, dpi=RASTER_DEFAULT_DPI, output_width=None):
+    """SVG konvertálása PNG-vé; output_width megadásakor arányosan kicsinyített bélyegkép"""
+    png_data = BytesIO()
+    if output_width:
+        cairosvg.svg2png(
+            bytestring=svg_text.encode('utf-8'),
+            write_to=png_data,
+            output_width=output_width,
+            background_color='white'
+        )
+    else:
+        cairosvg.svg2png(
+            bytestring=svg_text.encode('utf-8'),
+            write_to=png_data,
+            dpi=dpi,
+            scale=2,
+            background_color='white'
+        )
+    return png_data.getvalue()
+
+image_executor = None
+image_executor_lock = Lock()
+# Folyamatkészletenként egy sor, amelybe a workerek induláskor beírják a PID-jüket
+image_worker_pids = {}
+
+def register_image_worker(pids):
+    """A képfeldolgozó folyamat inicializálója: a PID-jét jelenti, hogy beragadáskor leállítható legyen"""
+    pids.put(os.getpid())
+
+def get_image_executor():
+    """CPU-igényes képfeldolgozás folyamatkészlete (lustán indul, hogy a GIL ne lassítsa a kéréseket)"""
+    global image_executor
+    with image_executor_lock:
+        if image_executor is None:
+            # forkserver: a workerek nem a (többszálú) fő folyamat pillanatképéből indulnak, így nem
+            # örökölhetnek más szál által éppen fogott zárat (pl. egy folyamatban lévő lusta import alatt)
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            context = multiprocessing.get_context(method)
+            pids = context.SimpleQueue()
+            image_executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=context,
+                                                 initializer=register_image_worker, initargs=(pids,))
+            image_worker_pids[image_executor] = pids
+        return image_executor
+
+def reset_image_executor(broken, kill=False):
+    """Összeomlott vagy beragadt folyamatkészlet eldobása; a következő hívás újat indít"""
+    global image_executor
+    with image_executor_lock:
+        if image_executor is broken:
+            image_executor = None
+        pids = image_worker_pids.pop(broken, None)
+    # A beragadt workereket a shutdown nem állítja le, ezért le is lőjük őket
+    if kill and pids is not None:
+        while not pids.empty():
+            try:
+                os.kill(pids.get(), getattr(signal, 'SIGKILL', signal.SIGTERM))
+            except OSError:
+                pass
+    broken.shutdown(wait=False, cancel_futures=True)
+    if pids is not None:
+        pids.close()
+
+def run_in_image_pool(func, *args):
+    """Függvény futtatása a képfeldolgozó folyamatkészletben (IMAGE_WORKERS=0 esetén helyben)"""
+    if IMAGE_WORKERS <= 0:
+        return func(*args)
+    executor = get_image_executor()
+    try:
+        return executor.submit(func, *args).result(timeout=PLANTUML_RENDER_TIMEOUT)
+    except BrokenProcessPool:
+        logger.error("A képfeldolgozó folyamatkészlet összeomlott, újraindítás")
+        reset_image_executor(executor)
+        raise
+    except FutureTimeoutError:
+        # Egy beragadt worker a többi kérést is feltartaná: a készletet újraindítjuk
+        logger.error("A képfeldolgozó folyamat nem válaszolt időben, újraindítás")
+        reset_image_executor(executor, kill=True)
+        raise
+
+def parse_diagram_options(values):
+    """Kért kimeneti formátum és DPI ellenőrzése; hibás értéknél ValueError"""
+    output_format = values.get('format') or DIAGRAM_DEFAULT_FORMAT
+    if output_format not in DIAGRAM_FORMATS:
+        raise ValueError(f"Ismeretlen formátum: {output_format} (lehetséges: {', '.join(DIAGRAM_FORMATS)})")
+    try:
+        dpi = int(values.get('dpi') or RASTER_DEFAULT_DPI)
+    except TypeError:
+        # Pl. lista vagy objektum a JSON-ban: ez is hibás kérés, nem szerverhiba
+        raise ValueError("A DPI értéke egész szám lehet") from None
+    if not RASTER_MIN_DPI <= dpi <= RASTER_MAX_DPI:
+        raise ValueError(f"A DPI értéke {RASTER_MIN_DPI} és {RASTER_MAX_DPI} között lehet")
+    return output_format, dpi
+
+def png_data_url(png_bytes):
+    return f"data:image/png;base64,{base64.b64encode(png_bytes).decode('utf-8')}"
+
+def diagram_payload(plantuml_code, svg_text, output_format, dpi):
+    """A kliensnek visszaadott diagram mezők a kért formátumban; PNG csak kérésre készül"""
+    if output_format == 'svg':
+        return {'svg': svg_text, 'format': 'svg', 'diagram_id': diagram_id(plantuml_code)}
+    png_bytes = render_plantuml_png(plantuml_code, output_format, dpi)
+    return {'image': png_data_url(png_bytes), 'format': output_format, 'diagram_id': diagram_id(plantuml_code)}
+
+def diagram_id(plantuml_code):
+    """A diagram tartalom alapú azonosítója, amellyel a kliens később hivatkozhat rá"""
+    return hashlib.sha256(plantuml_code.strip().encode('utf-8')).hexdigest()
+
+def resolve_diagram_reference(session_id, values):
+    """A session egy diagramjának forrása hivatkozás alapján ('diagram_id' vagy 'entry' index, alapból az utolsó)
+
+    Csak a kérő session saját történetében keres; ha nincs ilyen diagram, None. Hibás indexnél ValueError.
+    """
+    history = state_store.history(session_id)
+    wanted_id = values.get('diagram_id')
+    if wanted_id:
+        return next((entry.plantuml for entry in reversed(history) if diagram_id(entry.plantuml) == wanted_id), None)
     try:
-        website_font = ImageFont.truetype('Montserrat-Bold.ttf', size=website_font_size)
-    except:
-        website_font = ImageFont.load_default()
+        index = int(values.get('entry', -1))
+    except TypeError:
+        # Pl. lista vagy objektum a JSON-ban: ez is hibás kérés, nem szerverhiba
+        raise ValueError("Az entry értéke egész szám lehet") from None
+    try:
+        return history[index].plantuml
+    except IndexError:
+        return None
 
-    website_bbox = draw.textbbox((0, 0), website_text, font=website_font)
-    website_width = website_bbox[2] - website_bbox[0]
-    website_x = A4_WIDTH - website_width - margin
-    website_y = A4_HEIGHT - website_bbox[3] - margin
+def accepts_gzip(accept_encoding):
+    return 'gzip' in (accept_encoding or '').lower()
 
-    draw.text((website_x, website_y), website_text, font=website_font, fill='black')
+def gzip_response(response):
+    """Szöveges (SVG/JSON) válasz tömörítése, ha a kliens elfogadja és megéri"""
+    if not accepts_gzip(request.headers.get('Accept-Encoding')) or response.direct_passthrough:
+        return response
+    body = response.get_data()
+    if len(body) < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(body, compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+class A4Composer:
+    """A4-es melléklet összeállítása; a betűtípusokat, a kicsinyített logót és a feliratokat egyszer készíti el
+
+    Folyamatonként egy példány él (lásd get_a4_composer), hívásonként csak a háttér másolása,
+    a diagram kicsinyítése és a JPEG kódolás történik.
+    """
+
+    def __init__(self):
+        self.margin = int(A4_WIDTH * 0.02)
+        self.background = Image.new('RGB', (A4_WIDTH, A4_HEIGHT), 'white')
+        draw = ImageDraw.Draw(self.background)
+
+        # Cím hozzáadása
+        font = self._load_font(int(A4_WIDTH * 0.02))
+        title = "A Te xFLOWer folyamatod"
+        title_bbox = draw.textbbox((0, 0), title, font=font)
+        title_width = title_bbox[2] - title_bbox[0]
+        title_height = title_bbox[3] - title_bbox[1]
+        title_y = self.margin
+        draw.text(((A4_WIDTH - title_width) // 2, title_y), title, font=font, fill='black')
+
+        # Logo betöltése és méretezése
+        logo = Image.open('logo2.png')
+        if logo.mode != 'RGBA':
+            logo = logo.convert('RGBA')
+        logo_width = int(A4_WIDTH * 0.15)
+        logo_height = int(logo.height * (logo_width / logo.width))
+        logo = logo.resize((logo_width, logo_height), Image.Resampling.LANCZOS)
+        self.background.paste(logo, (self.margin, A4_HEIGHT - logo_height - self.margin), mask=logo.split()[3])
+
+        # Weboldal cím
+        website_text = "xflower.hu"
+        website_font = self._load_font(int(logo_height * 0.5))
+        website_bbox = draw.textbbox((0, 0), website_text, font=website_font)
+        website_width = website_bbox[2] - website_bbox[0]
+        draw.text(
+            (A4_WIDTH - website_width - self.margin, A4_HEIGHT - website_bbox[3] - self.margin),
+            website_text, font=website_font, fill='black'
+        )
+
+        # A diagram számára fennmaradó terület
+        self.diagram_top = title_y + title_height + self.margin
+        self.max_diagram_width = A4_WIDTH - (self.margin * 2)
+        self.max_diagram_height = A4_HEIGHT - self.diagram_top - logo_height - (self.margin * 2)
+
+    @staticmethod
+    def _load_font(size):
+        try:
+            return ImageFont.truetype('Montserrat-Bold.ttf', size=size)
+        except Exception as e:
+            logger.warning(f"Nem sikerült a Montserrat betöltése: {e}")
+            return ImageFont.load_default()
+
+    def compose(self, image_bytes, resample=A4_RESAMPLE):
+        """Diagram elhelyezése az A4-es lapon; visszaadja a kész JPEG bájtokat és a szakaszok idejét"""
+        started = time.perf_counter()
+        image = Image.open(BytesIO(image_bytes))
+
+        # Diagram méretezése és pozicionálása
+        diagram_ratio = min(
+            self.max_diagram_width / image.width,
+            self.max_diagram_height / image.height
+        )
+        new_width = int(image.width * diagram_ratio)
+        new_height = int(image.height * diagram_ratio)
+        fast = resample == 'fast' or (resample == 'auto' and image.width * image.height > A4_FAST_RESAMPLE_PIXELS)
+        # reducing_gap: nagy képnél előbb gyors egész szorzós kicsinyítés, csak a maradékra megy a LANCZOS
+        image = image.resize((new_width, new_height), Image.Resampling.LANCZOS, reducing_gap=2.0 if fast else None)
+
+        a4_image = self.background.copy()
+        diagram_x = (A4_WIDTH - new_width) // 2
+        diagram_y = self.diagram_top + ((self.max_diagram_height - new_height) // 2)
+        a4_image.paste(image, (diagram_x, diagram_y))
+        composed = time.perf_counter()
 
-    return a4_image
+        output = BytesIO()
+        a4_image.save(output, format='JPEG', quality=95, dpi=(300, 300))
+        return output.getvalue(), {'a4_compose': composed - started, 'jpeg_encode': time.perf_counter() - composed}
+
+a4_composer = None
+
+def get_a4_composer():
+    """Folyamatonként egyszer létrehozott A4Composer (a képfeldolgozó folyamatokban is)"""
+    global a4_composer
+    if a4_composer is None:
+        a4_composer = A4Composer()
+    return a4_composer
+
+def compose_a4_jpeg(image_bytes, resample=A4_RESAMPLE):
+    return get_a4_composer().compose(image_bytes, resample)
+
+def create_a4_image(image_bytes):
+    """A4-es JPEG melléklet készítése a diagram PNG-ből a képfeldolgozó folyamatkészletben"""
+    # A szakaszidőket a munkafolyamat méri, itt rögzítjük őket
+    jpeg_bytes, timings = run_in_image_pool(compose_a4_jpeg, image_bytes, A4_RESAMPLE)
+    for stage, seconds in timings.items():
+        record_stage(stage, seconds)
+    return jpeg_bytes
+
+def warm_image_worker():
+    """Képfeldolgozó folyamat előmelegítése: cairo és PIL betöltése, A4 háttér (betűtípus, logó) elkészítése"""
+    cairosvg.resolve()
+    get_a4_composer()
+    return os.getpid()
+
+def prepare_report_image(image_bytes, width_mm):
+    """Diagram lekicsinyítése nyomtatási felbontásra, hogy a PDF ne a 300 DPI-s, 2x-es PNG-t ágyazza be"""
+    image = Image.open(BytesIO(image_bytes))
+    max_width = int(width_mm / 25.4 * REPORT_IMAGE_DPI)
+    if image.width > max_width:
+        # reducing_gap: előbb gyors egész szorzós kicsinyítés, csak a maradékra megy a LANCZOS
+        image.thumbnail((max_width, image.height), Image.Resampling.LANCZOS, reducing_gap=1.0)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    return image
 
 def create_pdf_report(session_id):
     """PDF jelentés készítése a beszélgetés történetéből"""
     pdf = FPDF()
+    # A betűtípust dokumentumonként egyszer regisztráljuk, nem oldalanként
+    try:
+        pdf.add_font('Montserrat', '', 'Montserrat-Regular.ttf')
+        font_family = 'Montserrat'
+    except Exception as e:
+        logger.warning(f"Nem sikerült a Montserrat betöltése: {e}")
+        font_family = 'Helvetica'  # Fallback font
+    
+    # Másolaton dolgozunk, hogy a párhuzamos /chat kérések ne módosítsák a bejárt listát
+    history = state_store.history(session_id)
+    generated_at = datetime.now().strftime("%Y-%m-%d %H:%M")
     
-    if session_id in conversation_history:
-        history = conversation_history[session_id]
+    for idx, entry in enumerate(history, 1):
+        pdf.add_page()
+        pdf.set_font(font_family, size=12)
         
-        for idx, entry in enumerate(history, 1):
-            pdf.add_page()
+        # Fejléc
+        pdf.cell(0, 10, f'Folyamat {idx} - {generated_at}', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.ln(5)
+        
+        # Prompt
+        pdf.cell(0, 10, 'Felhasználói kérés:', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.multi_cell(0, 10, str(entry.prompt))
+        pdf.ln(5)
+        
+        # Diagram kép a render cache-ből (szükség esetén újrarenderelve), ideiglenes fájl nélkül
+        if entry.plantuml:
             try:
-                pdf.add_font('Montserrat', '', 'Montserrat-Regular.ttf', uni=True)
-                pdf.set_font('Montserrat', size=12)
-            except:
-                pdf.set_font('Arial', size=12)  # Fallback font
-            
-            # Fejléc
-            pdf.cell(0, 10, f'Folyamat {idx} - {datetime.now().strftime("%Y-%m-%d %H:%M")}', ln=True)
-            pdf.ln(5)
-            
-            # Prompt
-            pdf.cell(0, 10, 'Felhasználói kérés:', ln=True)
-            pdf.multi_cell(0, 10, str(entry['prompt']))
-            pdf.ln(5)
-            
-            # Diagram kép
-            if 'image' in entry:
+                image_bytes = render_plantuml_png(entry.plantuml)
+                if image_bytes is None:
+                    raise RuntimeError("A diagram újrarenderelése nem sikerült")
+                page_width = pdf.w - 20  # Margók
+                pdf.image(prepare_report_image(image_bytes, page_width), x=10, y=pdf.get_y(), w=page_width)
+            except Exception as e:
+                logger.error(f"Hiba a kép PDF-be illesztésekor: {str(e)}")
+                pdf.multi_cell(0, 10, "Hiba történt a diagram betöltésekor")
+        
+        pdf.ln(10)
+    
+    return bytes(pdf.output())
+
+class MailQueue:
+    """Kimenő levelek háttérsora újrahasznosított, hitelesített SMTP kapcsolatokkal
+
+    Minden küldő szál saját kapcsolatot tart nyitva; ha az túl régóta tétlen, NOOP-pal
+    ellenőrzi, és szükség esetén újracsatlakozik. A sorban összegyűlt leveleket egy
+    kapcsolaton, kötegben küldi el, hiba esetén exponenciális visszalépéssel újrapróbál.
+    Amíg az SMTP megszakító nyitva van, a leveleket próbálkozás elhasználása nélkül
+    halasztja a megszakító helyreállásáig, így egy leállás alatt nem vesznek el.
+    """
+
+    def __init__(self, workers=2, batch_size=20, max_retries=5, idle_check=60):
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.idle_check = idle_check
+        self._queue = queue.Queue()
+        self._workers = workers
+        self._threads = []
+        self._start_lock = Lock()
+        self._retry_seq = itertools.count()
+        self._stats_lock = Lock()
+        self.stats = {'queued': 0, 'sent': 0, 'retried': 0, 'deferred': 0, 'dropped': 0, 'connections': 0}
+
+    def _ensure_running(self):
+        with self._start_lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self._workers:
+                thread = threading.Thread(target=self._run, name=f'smtp-sender-{len(self._threads)}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, msg, attempt=0):
+        """Levél sorba állítása; a hívó nem vár a küldésre"""
+        self._ensure_running()
+        self._count('queued')
+        self._queue.put((msg, attempt))
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _count(self, event):
+        # Több küldő szál is írja
+        with self._stats_lock:
+            self.stats[event] += 1
+
+    def snapshot(self):
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def drain(self, timeout):
+        """Várakozás, amíg a sorban lévő levelek elmennek (legfeljebb timeout másodpercig)
+
+        Leálláskor fut: a küldő szálak démon szálak, a folyamat végén a sorban maradt
+        levelek elvesznének. A később esedékes újrapróbálkozásokat nem várja meg.
+        """
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"Leállás: {self._queue.unfinished_tasks} e-mail nem ment el {timeout:.0f} s alatt")
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    @staticmethod
+    def _connect():
+        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if SMTP_STARTTLS:
+            server.starttls()
+        if SMTP_USER and SMTP_PASS:
+            server.login(SMTP_USER, SMTP_PASS)
+        return server
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _is_alive(self, server, last_used):
+        if time.monotonic() - last_used < self.idle_check:
+            return True
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _retry_later(self, msg, attempt, error):
+        if attempt >= self.max_retries:
+            self._count('dropped')
+            logger.error(f"E-mail végleg sikertelen ({msg['To']}): {error}")
+            return
+        delay = min(2 ** attempt, 300) * random.uniform(0.5, 1.0)
+        self._count('retried')
+        logger.warning(f"E-mail küldése sikertelen ({msg['To']}), újrapróbálkozás {delay:.1f} s múlva: {error}")
+        session_scheduler.schedule(('mail-retry', next(self._retry_seq)), delay, self.enqueue, msg, attempt + 1)
+
+    def _defer(self, msg, attempt, retry_after):
+        """Nyitott megszakítónál újrasorolás a helyreállás utánra, a próbálkozások száma nem nő"""
+        delay = max(retry_after, 1.0) * random.uniform(1.0, 1.5)
+        self._count('deferred')
+        logger.info(f"SMTP megszakító nyitva, e-mail ({msg['To']}) halasztva {delay:.1f} s-ig")
+        session_scheduler.schedule(('mail-retry', next(self._retry_seq)), delay, self.enqueue, msg, attempt)
+
+    def _run(self):
+        server, last_used = None, 0.0
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.idle_check)]
+            except queue.Empty:
+                # Tétlen kapcsolatot nem tartunk nyitva a végtelenségig
+                if server is not None:
+                    self._close(server)
+                    server = None
+                continue
+            while len(batch) < self.batch_size:
                 try:
-                    # Base64 kép dekódolása
-                    image_data = entry['image'].split('base64,')[1]
-                    image_bytes = base64.b64decode(image_data)
-                    
-                    # Ideiglenes fájl létrehozása a képnek
-                    temp_image_path = f'temp_diagram_{idx}.png'
-                    with open(temp_image_path, 'wb') as f:
-                        f.write(image_bytes)
-                    
-                    # Kép hozzáadása a PDF-hez
-                    page_width = pdf.w - 20  # Margók
-                    pdf.image(temp_image_path, x=10, y=pdf.get_y(), w=page_width)
-                    
-                    # Ideiglenes fájl törlése
-                    os.remove(temp_image_path)
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for msg, attempt in batch:
+                try:
+                    with smtp_breaker:
+                        if server is not None and not self._is_alive(server, last_used):
+                            self._close(server)
+                            server = None
+                        if server is None:
+                            server = self._connect()
+                            self._count('connections')
+                        with timed_stage('smtp_send'):
+                            server.send_message(msg)
+                    last_used = time.monotonic()
+                    self._count('sent')
+                except CircuitOpenError as e:
+                    self._defer(msg, attempt, e.retry_after)
+                except smtplib.SMTPRecipientsRefused as e:
+                    # A címzett hibája, nem a kapcsolaté: nincs értelme újrapróbálni
+                    self._count('dropped')
+                    logger.error(f"Elutasított címzett ({msg['To']}): {str(e)}")
                 except Exception as e:
-                    logger.error(f"Hiba a kép PDF-be illesztésekor: {str(e)}")
-                    pdf.multi_cell(0, 10, "Hiba történt a diagram betöltésekor")
-            
-            pdf.ln(10)
-    
-    return pdf.output(dest='S').encode('latin-1')
+                    if server is not None:
+                        self._close(server)
+                        server = None
+                    self._retry_later(msg, attempt, str(e))
+                finally:
+                    self._queue.task_done()
+
+mail_queue = MailQueue(
+    workers=SMTP_POOL_SIZE,
+    batch_size=SMTP_BATCH_SIZE,
+    max_retries=SMTP_MAX_RETRIES,
+)
+# Leálláskor a sorban lévő levelek még elmennek (korlátos várakozással)
+atexit.register(mail_queue.drain, SMTP_DRAIN_TIMEOUT)
 
 def send_inactivity_email(session_id):
     """E-mail küldése inaktivitás esetén"""
+    # Több worker esetén más folyamat is kaphatott azóta üzenetet, vagy már értesített
+    if not state_store.claim_inactivity(session_id, INACTIVITY_TIMEOUT):
+        return
     try:
         pdf_content = create_pdf_report(session_id)
         
@@ -383,26 +2767,99 @@ def send_inactivity_email(session_id):
         pdf_attachment.add_header('Content-Disposition', 'attachment', filename=f'conversation_{session_id}.pdf')
         msg.attach(pdf_attachment)
         
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASS)
-            server.send_message(msg)
-            
-        logger.info(f"Inaktivitási e-mail elküldve: {session_id}")
+        mail_queue.enqueue(msg)
+        logger.info(f"Inaktivitási e-mail sorba állítva: {session_id}")
         
     except Exception as e:
         logger.error(f"Hiba az inaktivitási e-mail küldésekor: {str(e)}")
 
+class SessionScheduler:
+    """Egyetlen ütemező szál az összes session határidejéhez (heap, lusta törléssel)
+
+    Az átütemezés O(log n), a törlés O(1): a heap-ben maradt elavult bejegyzéseket
+    a szál egyszerűen átugorja. A lejárt feladatok egy kis, korlátos szálkészleten futnak.
+    """
+
+    def __init__(self, workers=2):
+        self._heap = []
+        self._entries = {}  # kulcs -> (határidő, sorszám, függvény, argumentumok)
+        self._seq = itertools.count()
+        self._cond = Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='session-expiry')
+        self._thread = None
+
+    def _ensure_running(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='session-scheduler', daemon=True)
+            self._thread.start()
+
+    def schedule(self, key, delay, func, *args):
+        """Feladat (újra)ütemezése a kulcshoz; a korábbi határidő érvényét veszti"""
+        deadline = time.monotonic() + delay
+        with self._cond:
+            seq = next(self._seq)
+            self._entries[key] = (deadline, seq, func, args)
+            heapq.heappush(self._heap, (deadline, seq, key))
+            # Sok elavult bejegyzés esetén a heap újraépítése, hogy a memória ne nőjön korlát nélkül
+            if len(self._heap) > 2 * len(self._entries) + 64:
+                self._heap = [(d, s, k) for k, (d, s, _, _) in self._entries.items()]
+                heapq.heapify(self._heap)
+            self._ensure_running()
+            if self._heap[0][1] == seq:
+                self._cond.notify()
+
+    def cancel(self, key):
+        with self._cond:
+            return self._entries.pop(key, None) is not None
+
+    def __contains__(self, key):
+        with self._cond:
+            return key in self._entries
+
+    def __len__(self):
+        with self._cond:
+            return len(self._entries)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    deadline, seq, key = self._heap[0]
+                    entry = self._entries.get(key)
+                    if entry is None or entry[1] != seq:
+                        heapq.heappop(self._heap)
+                        continue
+                    remaining = deadline - time.monotonic()
+                    if remaining > 0:
+                        self._cond.wait(remaining)
+                        continue
+                    heapq.heappop(self._heap)
+                    del self._entries[key]
+                    _, _, func, args = entry
+                    break
+            self._executor.submit(self._dispatch, func, args)
+
+    @staticmethod
+    def _dispatch(func, args):
+        try:
+            func(*args)
+        except Exception as e:
+            logger.error(f"Hiba az ütemezett feladat futtatásakor: {str(e)}")
+
+session_scheduler = SessionScheduler(workers=SESSION_EXPIRY_WORKERS)
+
+thread_reaper = ThreadReaper(
+    interval=THREAD_CLEANUP_INTERVAL,
+    batch_size=THREAD_DELETE_BATCH,
+    rate_per_second=THREAD_DELETE_RATE,
+)
+
 def reset_inactivity_timer(session_id):
     """Időzítő újraindítása vagy létrehozása"""
-    # Előző időzítő törlése, ha létezik
-    if session_id in conversation_timers:
-        conversation_timers[session_id].cancel()
-    
-    # Új időzítő létrehozása
-    timer = Timer(INACTIVITY_TIMEOUT, send_inactivity_email, args=[session_id])
-    timer.start()
-    conversation_timers[session_id] = timer
+    session_scheduler.schedule(session_id, INACTIVITY_TIMEOUT, send_inactivity_email, session_id)
 
 def send_error_email(error_message, endpoint=None, session_id=None):
     """Hibaüzenet küldése e-mailben"""
@@ -427,15 +2884,439 @@ def send_error_email(error_message, endpoint=None, session_id=None):
 
         msg.attach(MIMEText(html, 'html'))
 
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASS)
-            server.send_message(msg)
-            
-        logger.info("Hibaértesítő e-mail elküldve")
+        mail_queue.enqueue(msg)
+        logger.info("Hibaértesítő e-mail sorba állítva")
     except Exception as e:
         logger.error(f"Hiba a hibaértesítő e-mail küldésekor: {str(e)}")
 
+def record_chat_result(session_id, user_message, plantuml_code):
+    """Sikeres generálás eredményének mentése a beszélgetés történetbe"""
+    # Beszélgetés történet frissítése; a kép a render cache-ben marad
+    with timed_stage('history_append'):
+        state_store.append_history(session_id, user_message, plantuml_code)
+    
+    # Időzítő újraindítása
+    reset_inactivity_timer(session_id)
+
+class DiagramPreview:
+    """Streamelt asszisztens válaszból készülő előnézetek
+
+    A beérkező szöveget gyűjti; ha új, szintaktikailag teljes előtag áll össze (a blokkok zártak,
+    nincs félbehagyott note vagy tevékenység), azt lezárja és háttérszálon SVG-be rendereli.
+    Egyszerre legfeljebb egy előnézet készül, legfeljebb min_interval másodpercenként.
+    """
+
+    # Előtagnál elfogadható hiányosság: a folyamat még nem ért véget
+    TOLERATED_ERRORS = ("missing 'stop' or 'end'",)
+
+    def __init__(self, on_text, on_preview, min_interval=CHAT_PREVIEW_INTERVAL):
+        self.on_text = on_text  # on_text(kísérlet sorszáma, eddigi szöveg)
+        self.on_preview = on_preview  # on_preview(svg szöveg)
+        self.min_interval = min_interval
+        self.attempt = -1
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """Új asszisztens futás (újrapróbálkozás) kezdete: az eddigi szöveg eldobása"""
+        with self._lock:
+            self.attempt += 1
+            self.text = ''
+            self.rendered_lines = 0
+            self.last_render = 0.0
+            self.in_flight = False
+
+    def close(self):
+        """A futás véget ért: a még készülő előnézet eldobódik, a végleges render lép a helyére"""
+        with self._lock:
+            self.attempt += 1
+
+    def feed(self, chunk):
+        with self._lock:
+            self.text += chunk
+            attempt, text = self.attempt, self.text
+            ready = not self.in_flight and time.monotonic() - self.last_render >= self.min_interval
+        self.on_text(attempt, text)
+        if not ready:
+            return
+
+        complete = text[:text.rfind('\n') + 1]
+        line_count = complete.count('\n')
+        if line_count <= self.rendered_lines or '@startuml' not in complete:
+            return
+        candidate = complete if '@enduml' in complete else complete + '@enduml'
+        plantuml_code, errors = plantuml_normalizer.normalize(candidate)
+        if any(error['message'] not in self.TOLERATED_ERRORS for error in errors):
+            return
+
+        with self._lock:
+            if self.in_flight or attempt != self.attempt:
+                return
+            self.in_flight = True
+            self.rendered_lines = line_count
+            self.last_render = time.monotonic()
+        preview_executor.submit(self._render, attempt, plantuml_code)
+
+    def _render(self, attempt, plantuml_code):
+        try:
+            with preview_breaker, timed_stage('preview_render'):
+                svg_text = diagram_renderer.render_svg(plantuml_code)
+            if svg_text is not None and attempt == self.attempt:
+                self.on_preview(svg_text)
+        except Exception as e:
+            logger.debug("Előnézet renderelése sikertelen: %s", e)
+        finally:
+            with self._lock:
+                if attempt == self.attempt:
+                    self.in_flight = False
+
+def run_chat_pipeline(session_id, user_message, on_stage=None, output_format=DIAGRAM_DEFAULT_FORMAT, dpi=RASTER_DEFAULT_DPI,
+                      preview=None, use_cache=True):
+    """Generálás és renderelés közös újrapróbálkozási kerettel; siker esetén (thread_id, diagram mezők), különben (None, None)
+
+    A generálás és a renderelés ugyanabból a keretből fogyaszt, így egy kérés legfeljebb
+    CHAT_MAX_ATTEMPTS asszisztens futást indít, és CHAT_DEADLINE másodpercen belül véget ér.
+    """
+    budget = RetryBudget()
+
+    while True:
+        if on_stage:
+            on_stage('assistant-running')
+        thread_id, plantuml_code, cache_key = generate_plantuml_cached(user_message, session_id, budget, preview, use_cache)
+        if not plantuml_code:
+            return None, None
+        
+        try:
+            if on_stage:
+                on_stage('rendering')
+            svg_text = render_plantuml_svg(plantuml_code)
+            if svg_text is None:
+                # Nem renderelhető eredmény nem maradhat a cache-ben; az újrapróbálkozás friss futás
+                if cache_key:
+                    generation_cache.invalidate(cache_key)
+                use_cache = False
+                continue
+            
+            payload = diagram_payload(plantuml_code, svg_text, output_format, dpi)
+            record_chat_result(session_id, user_message, plantuml_code)
+            return thread_id, payload
+
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Hiba az SVG feldolgozása során: {str(e)}")
+            if cache_key:
+                generation_cache.invalidate(cache_key)
+            use_cache = False
+            continue
+
+def update_chat_job(job_id, stage, **fields):
+    """Job állapotának frissítése és a szakasz időtartamának rögzítése"""
+    with chat_jobs_cond:
+        job = chat_jobs[job_id]
+        if stage == job['stage'] and not fields:
+            return
+        now = time.monotonic()
+        previous = job['stage']
+        elapsed = now - job['stage_started']
+        job['stage_times'][previous] = job['stage_times'].get(previous, 0.0) + elapsed
+        stats = chat_job_stats['stage_totals'].setdefault(previous, {'count': 0, 'total': 0.0})
+        stats['count'] += 1
+        stats['total'] += elapsed
+        job['stage'] = stage
+        job['stage_started'] = now
+        job['version'] += 1
+        job['stage_version'] += 1
+        job.update(fields)
+        if stage in ('done', 'failed'):
+            job['finished_at'] = now
+            chat_job_stats[stage] += 1
+        chat_jobs_cond.notify_all()
+
+def publish_chat_job_output(job_id, **fields):
+    """Streamelt részeredmény (szöveg, előnézet) közzététele a job SSE csatornáján, szakaszváltás nélkül"""
+    with chat_jobs_cond:
+        job = chat_jobs[job_id]
+        if 'preview' in fields:
+            job['preview_seq'] += 1
+        job.update(fields)
+        job['version'] += 1
+        chat_jobs_cond.notify_all()
+
+def run_chat_job(job_id):
+    """Háttérben futó job: a /chat logikáját hajtja végre szakaszonként jelentve"""
+    job = chat_jobs[job_id]
+    trace = start_trace(job['trace_id'])
+    preview = None
+    if CHAT_PREVIEWS:
+        preview = DiagramPreview(
+            on_text=lambda attempt, text: publish_chat_job_output(job_id, partial=(attempt, text)),
+            on_preview=lambda svg_text: publish_chat_job_output(job_id, preview=svg_text),
+        )
+    try:
+        # A jobok sora és a workerek száma már korlátos, ezért itt a teljes határidőig várhatunk helyre
+        with chat_gate.slot(timeout=CHAT_DEADLINE, bounded=False):
+            thread_id, payload = run_chat_pipeline(
+                job['session_id'],
+                job['message'],
+                on_stage=lambda stage: update_chat_job(job_id, stage),
+                output_format=job['format'],
+                dpi=job['dpi'],
+                preview=preview,
+                use_cache=job['use_cache'],
+            )
+        if payload:
+            update_chat_job(job_id, 'done', thread_id=thread_id, **payload)
+        else:
+            update_chat_job(job_id, 'failed', error=CHAT_FAILED_MESSAGE)
+    except (AdmissionRejectedError, CircuitOpenError) as e:
+        update_chat_job(job_id, 'failed', error=str(e))
+    except Exception as e:
+        error_msg = str(e)
+        logger.error(f"Hiba a job futtatásakor ({job_id}): {error_msg}")
+        send_error_email(error_msg, endpoint='/chat/jobs', session_id=job['session_id'])
+        update_chat_job(job_id, 'failed', error=error_msg)
+    finally:
+        request_latency.observe('chat_job', time.perf_counter() - trace['started'])
+        finish_trace(trace, job_id=job_id, stage=job['stage'])
+
+def cleanup_chat_jobs():
+    """Lejárt, befejezett jobok eltávolítása"""
+    now = time.monotonic()
+    with chat_jobs_cond:
+        for job_id in list(chat_jobs.keys()):
+            finished_at = chat_jobs[job_id].get('finished_at')
+            if finished_at is not None and now - finished_at > CHAT_JOB_TTL:
+                del chat_jobs[job_id]
+
+def chat_job_view(job):
+    """Job kliensnek visszaadott nézete"""
+    view = {
+        'job_id': job['job_id'],
+        'stage': job['stage'],
+        'stage_times': {stage: round(seconds, 3) for stage, seconds in job['stage_times'].items()},
+    }
+    for field in ('image', 'svg', 'format', 'diagram_id', 'thread_id', 'error'):
+        if field in job:
+            view[field] = job[field]
+    return view
+
+def get_session_chat_job(job_id):
+    """Job lekérése a kérő session ellenőrzésével (EventSource miatt query paraméterből is)"""
+    session_id = request.headers.get('X-Session-ID') or request.args.get('session_id')
+    with chat_jobs_cond:
+        job = chat_jobs.get(job_id)
+        if job is None or job['session_id'] != session_id:
+            return None
+        return job
+
+@app.before_request
+def begin_request_trace():
+    start_trace(request.headers.get('X-Request-ID'))
+
+@app.after_request
+def end_request_trace(response):
+    trace = request_trace.get()
+    if trace is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_latency.observe(endpoint, time.perf_counter() - trace['started'])
+        response.headers['X-Trace-ID'] = trace['trace_id']
+        finish_trace(trace, method=request.method, path=request.path, status=response.status_code)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus szöveges formátumú metrikák"""
+    lines = stage_latency.render() + request_latency.render()
+    lines.append('# TYPE xflower_render_cache_events_total counter')
+    for event, count in render_cache.stats.items():
+        lines.append(f'xflower_render_cache_events_total{{event="{event}"}} {count}')
+    lines.append('# TYPE xflower_generation_cache_events_total counter')
+    for event, count in generation_cache.stats.items():
+        lines.append(f'xflower_generation_cache_events_total{{event="{event}"}} {count}')
+    lines.append('# TYPE xflower_generation_cache_hit_ratio gauge')
+    lines.append(f'xflower_generation_cache_hit_ratio {generation_cache.hit_rate():.4f}')
+    with context_stats_lock:
+        context_snapshot = dict(context_stats)
+    lines.append('# TYPE xflower_assistant_context_total counter')
+    for field, value in context_snapshot.items():
+        lines.append(f'xflower_assistant_context_total{{field="{field}"}} {value}')
+    lines.append('# TYPE xflower_mail_events_total counter')
+    for event, count in mail_queue.snapshot().items():
+        lines.append(f'xflower_mail_events_total{{event="{event}"}} {count}')
+    with run_wait_lock:
+        run_snapshot = dict(run_wait_stats, by_status=dict(run_wait_stats['by_status']))
+    lines.append('# TYPE xflower_assistant_runs_total counter')
+    for status, count in run_snapshot['by_status'].items():
+        lines.append(f'xflower_assistant_runs_total{{status="{status}"}} {count}')
+    lines.append('# TYPE xflower_assistant_run_wait_seconds_total counter')
+    lines.append(f"xflower_assistant_run_wait_seconds_total {run_snapshot['total_wait']:.6f}")
+    lines.append('# TYPE xflower_assistant_run_wait_seconds_max gauge')
+    lines.append(f"xflower_assistant_run_wait_seconds_max {run_snapshot['max_wait']:.6f}")
+    lines.append('# TYPE xflower_admission_events_total counter')
+    for limiter in admission_limiters:
+        for event, count in limiter.stats.items():
+            lines.append(f'xflower_admission_events_total{{limiter="{limiter.name}",event="{event}"}} {count}')
+    lines.append('# TYPE xflower_admission_in_flight gauge')
+    for gate in (chat_gate, render_gate):
+        lines.append(f'xflower_admission_in_flight{{gate="{gate.name}"}} {gate.in_flight}')
+    lines.append('# TYPE xflower_admission_waiting gauge')
+    for gate in (chat_gate, render_gate):
+        lines.append(f'xflower_admission_waiting{{gate="{gate.name}"}} {gate.waiting}')
+    lines.append('# TYPE xflower_circuit_open gauge')
+    for name, breaker in circuit_breakers.items():
+        lines.append(f'xflower_circuit_open{{circuit="{name}"}} {int(breaker.state == "open")}')
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+@app.route('/chat/jobs', methods=['POST', 'OPTIONS'])
+def submit_chat_job():
+    """Diagram kérés sorba állítása: 202 és job azonosító; tele sornál 429 Retry-After fejléccel"""
+    if request.method == "OPTIONS":
+        return make_response()
+
+    session_id = request.headers.get('X-Session-ID')
+    if not session_id:
+        return jsonify({'error': 'Hiányzó session ID'}), 401
+
+    try:
+        client_ip = request_client_ip()
+        check_rate_limits(session_id, client_ip)
+        data = request.get_json()
+        user_message = data['message']
+        try:
+            output_format, dpi = parse_diagram_options(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        cleanup_chat_jobs()
+        with chat_jobs_cond:
+            pending = sum(1 for job in chat_jobs.values() if job['stage'] not in ('done', 'failed'))
+            if pending >= CHAT_JOB_WORKERS + CHAT_JOB_MAX_QUEUE:
+                chat_job_stats['rejected'] += 1
+                refund_rate_limits(session_id, client_ip)
+                raise AdmissionRejectedError('job_queue_full', ADMISSION_RETRY_AFTER)
+            job_id = secrets.token_urlsafe(16)
+            chat_jobs[job_id] = {
+                'job_id': job_id,
+                'session_id': session_id,
+                'message': user_message,
+                'format': output_format,
+                'dpi': dpi,
+                'use_cache': wants_generation_cache(data, request.headers.get('Cache-Control')),
+                'trace_id': request_trace.get()['trace_id'],
+                'stage': 'queued',
+                'stage_started': time.monotonic(),
+                'stage_times': {},
+                'version': 0,
+                'stage_version': 0,
+                'partial': None,
+                'preview': None,
+                'preview_seq': 0,
+            }
+            chat_job_stats['submitted'] += 1
+        chat_job_executor.submit(run_chat_job, job_id)
+
+        return jsonify({'job_id': job_id, 'stage': 'queued'}), 202
+
+    except AdmissionRejectedError as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = str(int(e.retry_after) + 1)
+        return response, 429
+
+    except Exception as e:
+        error_msg = str(e)
+        logger.error(f"Hiba történt: {error_msg}")
+        send_error_email(error_msg, endpoint='/chat/jobs', session_id=session_id)
+        return jsonify({'error': error_msg}), 500
+
+@app.route('/chat/jobs/stats', methods=['GET'])
+def chat_job_statistics():
+    with chat_jobs_cond:
+        stages = {}
+        for job in chat_jobs.values():
+            stages[job['stage']] = stages.get(job['stage'], 0) + 1
+        return jsonify({
+            'queue_depth': stages.get('queued', 0),
+            'jobs_by_stage': stages,
+            'submitted': chat_job_stats['submitted'],
+            'rejected': chat_job_stats['rejected'],
+            'done': chat_job_stats['done'],
+            'failed': chat_job_stats['failed'],
+            'avg_stage_seconds': {
+                stage: round(totals['total'] / totals['count'], 3)
+                for stage, totals in chat_job_stats['stage_totals'].items() if totals['count']
+            },
+        })
+
+@app.route('/stats/memory', methods=['GET'])
+def memory_statistics():
+    report = state_store.memory_report()
+    report['render_cache_entries'] = len(render_cache._entries)
+    report['render_cache_bytes'] = render_cache.bytes_held
+    return jsonify(report)
+
+@app.route('/stats/circuits', methods=['GET'])
+def circuit_statistics():
+    return jsonify({name: breaker.snapshot() for name, breaker in circuit_breakers.items()})
+
+@app.route('/stats/admission', methods=['GET'])
+def admission_statistics():
+    report = {limiter.name: dict(limiter.stats) for limiter in admission_limiters}
+    for gate in (chat_gate, render_gate):
+        report[gate.name].update(in_flight=gate.in_flight, waiting=gate.waiting, limit=gate.limit)
+    return jsonify(report)
+
+@app.route('/chat/jobs/<job_id>', methods=['GET'])
+def get_chat_job(job_id):
+    job = get_session_chat_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Ismeretlen job'}), 404
+    with chat_jobs_cond:
+        return jsonify(chat_job_view(job))
+
+@app.route('/chat/jobs/<job_id>/events', methods=['GET'])
+def stream_chat_job(job_id):
+    job = get_session_chat_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Ismeretlen job'}), 404
+
+    def events():
+        # Eseménytípusok: 'token' (a válasz szövege darabonként), 'preview' (részleges diagram SVG-ben),
+        # 'stage' (szakaszváltás; a 'done' esemény végleges képe felváltja az előnézeteket)
+        seen_version = seen_stage_version = -1
+        seen_preview_seq = 0
+        sent_attempt, sent_chars = None, 0
+        while True:
+            messages = []
+            with chat_jobs_cond:
+                if job['version'] == seen_version:
+                    chat_jobs_cond.wait(timeout=CHAT_JOB_SSE_KEEPALIVE)
+                if job['version'] != seen_version:
+                    seen_version = job['version']
+                    if job['partial'] is not None:
+                        attempt, text = job['partial']
+                        if attempt != sent_attempt:
+                            # Újrapróbálkozás: a kliens eldobja az eddigi szöveget
+                            messages.append(('token', {'attempt': attempt, 'reset': True, 'text': text}))
+                        elif len(text) > sent_chars:
+                            messages.append(('token', {'attempt': attempt, 'text': text[sent_chars:]}))
+                        sent_attempt, sent_chars = attempt, len(text)
+                    if job['preview_seq'] != seen_preview_seq:
+                        seen_preview_seq = job['preview_seq']
+                        messages.append(('preview', {'seq': seen_preview_seq, 'svg': job['preview']}))
+                    if job['stage_version'] != seen_stage_version:
+                        seen_stage_version = job['stage_version']
+                        messages.append(('stage', chat_job_view(job)))
+            if not messages:
+                yield ': keepalive\n\n'
+                continue
+            for event, payload in messages:
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+                if event == 'stage' and payload['stage'] in ('done', 'failed'):
+                    return
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/init-session', methods=['POST', 'OPTIONS'])
 def init_session():
     if request.method == "OPTIONS":
@@ -462,92 +3343,135 @@ def chat():
         return jsonify({'error': 'Hiányzó session ID'}), 401
     
     try:
+        client_ip = request_client_ip()
+        check_rate_limits(session_id, client_ip)
         data = request.get_json()
         user_message = data['message']
+        try:
+            output_format, dpi = parse_diagram_options(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Beszélgetés történet inicializálása, ha még nem létezik
-        if session_id not in conversation_history:
-            conversation_history[session_id] = []
-        
-        max_attempts = 3
-        attempt = 0
+        use_cache = wants_generation_cache(data, request.headers.get('Cache-Control'))
+        try:
+            chat_gate.acquire()
+        except AdmissionRejectedError:
+            refund_rate_limits(session_id, client_ip)
+            raise
+        try:
+            thread_id, payload = run_chat_pipeline(
+                session_id, user_message, output_format=output_format, dpi=dpi, use_cache=use_cache
+            )
+        finally:
+            chat_gate.release()
+        if payload:
+            payload['thread_id'] = thread_id
+            # A base64 PNG/JPEG alig tömöríthető, csak az SVG válasz éri meg (mint az ASGI úton)
+            if output_format == 'svg':
+                return gzip_response(jsonify(payload))
+            return jsonify(payload)
+
+        return jsonify({'error': CHAT_FAILED_MESSAGE}), 500
+
+    except AdmissionRejectedError as e:
+        # Túlterhelés: gyors elutasítás, mielőtt asszisztens futás indulna
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = str(int(e.retry_after) + 1)
+        return response, 429
+
+    except CircuitOpenError as e:
+        # Ismert kiesés: gyors elutasítás, hibaértesítő e-mail nélkül
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = str(int(e.retry_after) + 1)
+        return response, 503
 
-        while attempt < max_attempts:
-            thread_id, plantuml_code = generate_plantuml_with_assistant(user_message, session_id)
-            if not plantuml_code:
-                attempt += 1
-                continue
-            
-            encoded_uml = compress_and_encode_plantuml(plantuml_code)
-            plantuml_url = f"http://www.plantuml.com/plantuml/svg/~1{encoded_uml}"
-            
-            response = requests.get(plantuml_url)
-            if response.status_code != 200:
-                attempt += 1
-                continue
+    except Exception as e:
+        error_msg = str(e)
+        logger.error(f"Hiba történt: {error_msg}")
+        send_error_email(error_msg, endpoint='/chat', session_id=session_id)
+        return jsonify({'error': error_msg}), 500
 
-            try:
-                # SVG konvertálása PNG-vé
-                png_data = BytesIO()
-                cairosvg.svg2png(
-                    bytestring=response.text.encode('utf-8'),
-                    write_to=png_data,
-                    dpi=300,
-                    scale=2,
-                    background_color='white'
-                )
-                png_data.seek(0)
-                
-                # Base64 kódolás
-                jpg_base64 = base64.b64encode(png_data.getvalue()).decode('utf-8')
-                image_data = f'data:image/jpeg;base64,{jpg_base64}'
-                
-                # Beszélgetés történet frissítése a képpel együtt
-                conversation_history[session_id].append({
-                    'prompt': user_message,
-                    'plantuml': plantuml_code,
-                    'image': image_data  # Kép mentése base64 formátumban
-                })
-                
-                # Időzítő újraindítása
-                reset_inactivity_timer(session_id)
-                
-                return jsonify({
-                    'image': image_data,
-                    'thread_id': thread_id
-                })
+@app.route('/diagram', methods=['GET'])
+def get_diagram():
+    """A session egy korábbi diagramja nyers formában (SVG, PNG adott DPI-vel vagy bélyegkép)"""
+    session_id = request.headers.get('X-Session-ID') or request.args.get('session_id')
+    if not session_id:
+        return jsonify({'error': 'Hiányzó session ID'}), 401
 
-            except Exception as e:
-                logger.error(f"Hiba az SVG feldolgozása során: {str(e)}")
-                attempt += 1
-                continue
+    try:
+        output_format, dpi = parse_diagram_options(request.args)
+        plantuml_code = resolve_diagram_reference(session_id, request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if plantuml_code is None:
+        return jsonify({'error': 'Nincs ilyen diagram'}), 404
 
-        return jsonify({'error': 'Nem sikerült érvényes diagramot generálni többszöri próbálkozás után sem.'}), 500
+    try:
+        with render_gate.slot():
+            if output_format == 'svg':
+                svg_text = render_plantuml_svg(plantuml_code)
+                if svg_text is None:
+                    return jsonify({'error': 'A diagram nem renderelhető'}), 502
+                return gzip_response(Response(svg_text, mimetype='image/svg+xml'))
+            png_bytes = render_plantuml_png(plantuml_code, output_format, dpi)
+        if png_bytes is None:
+            return jsonify({'error': 'A diagram nem renderelhető'}), 502
+        return Response(png_bytes, mimetype='image/png')
+
+    except AdmissionRejectedError as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = str(int(e.retry_after) + 1)
+        return response, 429
+
+    except CircuitOpenError as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = str(int(e.retry_after) + 1)
+        return response, 503
 
     except Exception as e:
         error_msg = str(e)
-        logger.error(f"Hiba történt: {error_msg}")
-        send_error_email(error_msg, endpoint='/chat', session_id=session_id)
+        logger.error(f"Hiba a diagram lekérésekor: {error_msg}")
+        send_error_email(error_msg, endpoint='/diagram', session_id=session_id)
         return jsonify({'error': error_msg}), 500
 
 @app.route('/send-email', methods=['POST'])
 def send_email():
     try:
-        data = request.get_json()
+        image_bytes = None
+        if request.mimetype == 'multipart/form-data':
+            # Bináris feltöltés: a fájlrész ideiglenes fájlban érkezik, base64 nélkül
+            data = request.form
+            upload = request.files.get('image')
+            if upload is not None:
+                if upload.mimetype not in SEND_EMAIL_UPLOAD_TYPES:
+                    return jsonify({'error': 'Csak PNG vagy JPEG kép tölthető fel'}), 400
+                image_bytes = upload.read()
+        else:
+            data = request.get_json()
+            image_data = data.get('image')
+            if image_data:
+                # Régi kliensek: a teljes data URL visszaküldése
+                image_bytes = base64.b64decode(image_data.split('base64,')[1])
         recipient_name = data.get('name')
         recipient_email = data.get('email')
-        image_data = data.get('image')
+
+        # Hivatkozás a szerveren már meglévő diagramra (diagram_id vagy entry, alapból az utolsó)
+        session_id = request.headers.get('X-Session-ID')
+        if image_bytes is None and session_id:
+            try:
+                plantuml_code = resolve_diagram_reference(session_id, data)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if plantuml_code is not None:
+                image_bytes = render_plantuml_png(plantuml_code)
+            elif data.get('diagram_id') or data.get('entry') is not None:
+                return jsonify({'error': 'Nincs ilyen diagram'}), 404
         
-        if not all([recipient_name, recipient_email, image_data]):
+        if not all([recipient_name, recipient_email, image_bytes]):
             return jsonify({'error': 'Hiányzó adatok'}), 400
 
         # A4-es kép létrehozása
-        a4_image = create_a4_image(image_data, recipient_name)
-        
-        # Kép mentése BytesIO objektumba
-        output = BytesIO()
-        a4_image.save(output, format='JPEG', quality=95, dpi=(300, 300))
-        output.seek(0)
+        a4_jpeg = create_a4_image(image_bytes)
 
         msg = MIMEMultipart('alternative')
         msg['From'] = SMTP_USER
@@ -628,17 +3552,22 @@ https://xflower.hu
         msg.attach(part2)
 
         # Folyamatábra csatolása
-        image_attachment = MIMEImage(output.getvalue())
+        image_attachment = MIMEImage(a4_jpeg)
         image_attachment.add_header('Content-Disposition', 'attachment', filename='xflower_folyamatabra.jpg')
         msg.attach(image_attachment)
 
-        # E-mail küldése
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASS)
-            server.send_message(msg)
+        # E-mail sorba állítása, a küldés a háttérben történik
+        mail_queue.enqueue(msg)
+
+        return jsonify({'success': True, 'message': 'E-mail sorba állítva, hamarosan kiküldjük'})
 
-        return jsonify({'success': True, 'message': 'E-mail sikeresen elküldve'})
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'Túl nagy kérés (legfeljebb {REQUEST_MAX_BYTES} bájt)'}), 413
+
+    except CircuitOpenError as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = str(int(e.retry_after) + 1)
+        return response, 503
 
     except Exception as e:
         error_msg = str(e)
@@ -685,21 +3614,12 @@ def end_session():
             return jsonify({'error': 'Hiányzó session ID'}), 401
             
         # Időzítő leállítása és törlése
-        if session_id in conversation_timers:
-            conversation_timers[session_id].cancel()
-            del conversation_timers[session_id]
+        session_scheduler.cancel(session_id)
             
-        # Beszélgetés történet törlése
-        if session_id in conversation_history:
-            del conversation_history[session_id]
-            
-        # Thread törlése
-        if session_id in user_threads:
-            try:
-                openai.beta.threads.delete(user_threads[session_id]['thread_id'])
-            except Exception as e:
-                logger.error(f"Hiba a thread törlésekor: {str(e)}")
-            del user_threads[session_id]
+        # Beszélgetés történet törlése, a thread törlése a háttérben
+        thread_id = state_store.pop_session(session_id)
+        if thread_id:
+            thread_reaper.enqueue(thread_id, session_id)
             
         # Session törlése
         session.clear()
@@ -712,5 +3632,405 @@ def end_session():
         send_error_email(error_msg, endpoint='/end-session', session_id=session_id)
         return jsonify({'error': error_msg}), 500
 
+# Aszinkron feldolgozás (ASGI mód)
+# Indítás: uvicorn app:asgi_app --host 0.0.0.0 --port $PORT
+# A /chat kérések egyetlen event loop-on várnak az asszisztensre és a renderelésre,
+# a többi végpontot változatlanul a Flask alkalmazás szolgálja ki.
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", 100))
+ASYNC_MAX_BODY_BYTES = 64 * 1024
+
+async_clients = {}
+
+def get_async_openai():
+    """Megosztott aszinkron OpenAI kliens (az első használatkor jön létre)"""
+    if 'openai' not in async_clients:
+        async_clients['openai'] = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+    return async_clients['openai']
+
+def get_async_http():
+    """Megosztott aszinkron HTTP kliens kapcsolat-újrahasznosítással"""
+    if 'http' not in async_clients:
+        import httpx
+        async_clients['http'] = httpx.AsyncClient(
+            timeout=PLANTUML_RENDER_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+            ),
+        )
+    return async_clients['http']
+
+async def run_assistant_async(client, thread_id, timeout=RUN_WAIT_TIMEOUT):
+    """A run_assistant aszinkron párja: adaptív visszalépéses várakozás az event loop blokkolása nélkül"""
+    started = time.monotonic()
+    deadline = started + min(timeout, RUN_WAIT_TIMEOUT)
+    run = await client.beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=ASSISTANT_ID,
+    )
+    status = run.status
+    delay = RUN_POLL_INITIAL_DELAY
+    while status not in RUN_TERMINAL_STATUSES:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning(f"Lejárt a várakozási határidő (run: {run.id}), futás megszakítása")
+            try:
+                await client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
+            except Exception as e:
+                logger.error(f"Hiba a futás megszakításakor: {str(e)}")
+            status = "timeout"
+            break
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * RUN_POLL_BACKOFF, RUN_POLL_MAX_DELAY)
+        run = await client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+        status = run.status
+    if status == 'requires_action':
+        # Magától nem lép tovább, és amíg aktív, az újrapróbálkozás sem írhat a thread-be
+        logger.warning(f"A futás eszközhívásra vár (run: {run.id}), megszakítás")
+        try:
+            await client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
+        except Exception as e:
+            logger.error(f"Hiba a futás megszakításakor: {str(e)}")
+    record_run_wait(run.id, status, time.monotonic() - started)
+    return run.id, status
+
+async def generate_plantuml_with_assistant_async(user_message, session_id, budget=None):
+    """A generate_plantuml_with_assistant aszinkron párja"""
+    logger.debug("PlantUML generálás indítása (async): %s, session: %s", user_message, session_id)
+    budget = budget or RetryBudget()
+    with timed_stage('thread_lookup'):
+        thread_id = await asyncio.to_thread(get_or_create_thread, session_id)
+        if thread_id:
+            thread_id = await asyncio.to_thread(compact_thread_if_needed, session_id, thread_id)
+    if not thread_id:
+        return None, None
+    # Az SQLite tároló lemezt ér: minden tároló hívás szálon fut, nem az event loop-on
+    followup = await asyncio.to_thread(state_store.thread_context_chars, session_id) > 0
+
+    client = get_async_openai()
+
+    errors = None
+    while await budget.next_attempt_async():
+        try:
+            with openai_breaker:
+                prompt = build_correction_prompt(errors) if errors else build_user_prompt(user_message, followup)
+                with timed_stage('message_create'):
+                    await client.beta.threads.messages.create(
+                        thread_id=thread_id,
+                        role="user",
+                        content=prompt
+                    )
+
+                run_started = time.monotonic()
+                with timed_stage('run_wait'):
+                    run_id, status = await run_assistant_async(client, thread_id, timeout=budget.remaining())
+                run_seconds = time.monotonic() - run_started
+                if status != "completed":
+                    await asyncio.to_thread(record_context_usage, session_id, len(prompt), 0, run_seconds)
+                    raise RunFailedError(f"A futás nem fejeződött be sikeresen (run: {run_id}, státusz: {status})")
+
+                with timed_stage('message_list'):
+                    response = await client.beta.threads.messages.list(thread_id=thread_id)
+            if not response.data:
+                logger.error("Nem sikerült asszisztens válaszát lekérni.")
+                continue
+
+            assistant_response = response.data[0].content[0].text.value
+            await asyncio.to_thread(record_context_usage, session_id, len(prompt), len(assistant_response), run_seconds)
+            with timed_stage('normalize'):
+                cleaned_response, errors = process_assistant_response(assistant_response)
+            if cleaned_response is None:
+                continue
+
+            return thread_id, cleaned_response
+
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Hiba történt a PlantUML generálás során: {str(e)}")
+
+    return None, None
+
+async def render_plantuml_svg_async(plantuml_code):
+    """A render_plantuml_svg aszinkron párja; a távoli szervert a megosztott HTTP kliensen éri el"""
+    # RENDER_CACHE_DIR mellett a cache lemezt ér (olvasás, írás, takarítás): szálon fut, nem az event loop-on
+    svg_bytes = await asyncio.to_thread(render_cache.get, plantuml_code, 'svg')
+    if svg_bytes is not None:
+        return svg_bytes.decode('utf-8')
+
+    with renderer_breaker, timed_stage('plantuml_fetch'):
+        if type(diagram_renderer) is RemoteRenderer:
+            encoded_uml = compress_and_encode_plantuml(plantuml_code)
+            response = await get_async_http().get(f"{diagram_renderer.base_url}/svg/~1{encoded_uml}")
+            if response.status_code >= 500:
+                response.raise_for_status()
+            svg_text = response.text if response.status_code == 200 else None
+        else:
+            svg_text = await asyncio.to_thread(diagram_renderer.render_svg, plantuml_code)
+    if svg_text is None:
+        return None
+
+    await asyncio.to_thread(render_cache.put, plantuml_code, svg_text.encode('utf-8'), 'svg')
+    return svg_text
+
+async def diagram_payload_async(plantuml_code, svg_text, output_format, dpi):
+    """A diagram_payload aszinkron párja; a raszterizálás a folyamatkészletben fut, nem blokkolja a loop-ot"""
+    if output_format == 'svg':
+        return {'svg': svg_text, 'format': 'svg', 'diagram_id': diagram_id(plantuml_code)}
+    return await asyncio.to_thread(diagram_payload, plantuml_code, svg_text, output_format, dpi)
+
+async def generate_plantuml_cached_async(user_message, session_id, budget, use_cache=True):
+    """A generate_plantuml_cached aszinkron párja; a szinkron ágakkal közös cache-t és összevonást használ"""
+    if not use_cache or GENERATION_CACHE_SIZE <= 0:
+        thread_id, plantuml_code = await generate_plantuml_with_assistant_async(user_message, session_id, budget)
+        return thread_id, plantuml_code, None
+
+    latest = await asyncio.to_thread(state_store.latest_history, session_id)
+    key = generation_cache.key_for(user_message, latest.plantuml if latest else '')
+    plantuml_code = generation_cache.lookup(key)
+    if plantuml_code is None:
+        future, leader = generation_cache.begin(key)
+        if leader:
+            try:
+                thread_id, plantuml_code = await generate_plantuml_with_assistant_async(user_message, session_id, budget)
+            except BaseException as e:
+                generation_cache.fail(key, future, e)
+                raise
+            generation_cache.finish(key, future, plantuml_code)
+            return thread_id, plantuml_code, key
+        try:
+            plantuml_code = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=budget.remaining())
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.warning(f"Az összevont generálás sikertelen, saját futás indul: {str(e)}")
+        if not plantuml_code:
+            thread_id, plantuml_code = await generate_plantuml_with_assistant_async(user_message, session_id, budget)
+            return thread_id, plantuml_code, None
+
+    logger.info("Generálás a cache-ből, asszisztens futás nélkül")
+    thread_id = await asyncio.to_thread(get_or_create_thread, session_id)
+    if not thread_id:
+        return None, None, None
+    await asyncio.to_thread(append_cached_exchange, session_id, thread_id, user_message, plantuml_code)
+    return thread_id, plantuml_code, key
+
+async def chat_async(session_id, user_message, output_format=DIAGRAM_DEFAULT_FORMAT, dpi=RASTER_DEFAULT_DPI, use_cache=True):
+    """A /chat végpont logikája aszinkron módban; (HTTP státusz, JSON válasz) párt ad vissza"""
+    budget = RetryBudget()
+
+    while True:
+        thread_id, plantuml_code, cache_key = await generate_plantuml_cached_async(user_message, session_id, budget, use_cache)
+        if not plantuml_code:
+            return 500, {'error': CHAT_FAILED_MESSAGE}
+
+        try:
+            svg_text = await render_plantuml_svg_async(plantuml_code)
+            if svg_text is None:
+                if cache_key:
+                    generation_cache.invalidate(cache_key)
+                use_cache = False
+                continue
+
+            payload = await diagram_payload_async(plantuml_code, svg_text, output_format, dpi)
+            await asyncio.to_thread(record_chat_result, session_id, user_message, plantuml_code)
+            payload['thread_id'] = thread_id
+            return 200, payload
+
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Hiba az SVG feldolgozása során: {str(e)}")
+            if cache_key:
+                generation_cache.invalidate(cache_key)
+            use_cache = False
+            continue
+
+class AsyncChatApp:
+    """ASGI belépési pont: a /chat natívan aszinkron, minden más a Flask alkalmazáshoz kerül"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self._wsgi = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == '/chat':
+            await self.handle_chat(scope, receive, send)
+            return
+        if self._wsgi is None:
+            from asgiref.wsgi import WsgiToAsgi
+            self._wsgi = WsgiToAsgi(self.flask_app)
+        await self._wsgi(scope, receive, send)
+
+    @staticmethod
+    def _cors_headers(origin):
+        if origin not in CORS_ORIGINS:
+            return []
+        return [
+            (b'access-control-allow-origin', origin.encode('latin-1')),
+            (b'access-control-allow-credentials', b'true'),
+            (b'vary', b'Origin'),
+        ]
+
+    @staticmethod
+    async def _send_json(send, status, payload, headers, compress=False):
+        body = json.dumps(payload).encode('utf-8')
+        if compress and len(body) >= GZIP_MIN_BYTES:
+            body = gzip.compress(body, compresslevel=6)
+            headers = headers + [(b'content-encoding', b'gzip'), (b'vary', b'Accept-Encoding')]
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': headers + [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode('latin-1')),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    @staticmethod
+    async def _read_body(receive, limit):
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if len(body) > limit:
+                return None
+            if not message.get('more_body', False):
+                return body
+
+    async def handle_chat(self, scope, receive, send):
+        headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        trace = start_trace(headers.get('x-request-id'))
+        try:
+            await self._handle_chat(scope, receive, send, headers)
+        finally:
+            request_latency.observe('/chat', time.perf_counter() - trace['started'])
+            finish_trace(trace, method=scope['method'], path='/chat', mode='asgi')
+
+    async def _handle_chat(self, scope, receive, send, headers):
+        cors = self._cors_headers(headers.get('origin'))
+        cors.append((b'x-trace-id', request_trace.get()['trace_id'].encode('latin-1')))
+
+        if scope['method'] == 'OPTIONS':
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': cors + [
+                    (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+                    (b'access-control-allow-headers', b'Content-Type, X-Session-ID'),
+                    (b'content-length', b'0'),
+                ],
+            })
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        if scope['method'] != 'POST':
+            await self._send_json(send, 405, {'error': 'Nem támogatott metódus'}, cors)
+            return
+
+        session_id = headers.get('x-session-id')
+        if not session_id:
+            await self._send_json(send, 401, {'error': 'Hiányzó session ID'}, cors)
+            return
+
+        try:
+            client = scope.get('client')
+            client_ip = forwarded_client_ip(headers.get('x-forwarded-for'), client[0] if client else None)
+            check_rate_limits(session_id, client_ip)
+            body = await self._read_body(receive, ASYNC_MAX_BODY_BYTES)
+            if body is None:
+                await self._send_json(send, 413, {'error': 'Túl nagy kérés'}, cors)
+                return
+            data = json.loads(body)
+            user_message = data['message']
+            try:
+                output_format, dpi = parse_diagram_options(data)
+            except ValueError as e:
+                await self._send_json(send, 400, {'error': str(e)}, cors)
+                return
+            use_cache = wants_generation_cache(data, headers.get('cache-control'))
+            try:
+                await chat_gate.acquire_async()
+            except AdmissionRejectedError:
+                refund_rate_limits(session_id, client_ip)
+                raise
+            try:
+                status, payload = await chat_async(session_id, user_message, output_format, dpi, use_cache)
+            finally:
+                chat_gate.release()
+            compress = output_format == 'svg' and accepts_gzip(headers.get('accept-encoding'))
+            await self._send_json(send, status, payload, cors, compress=compress)
+        except AdmissionRejectedError as e:
+            retry_after = str(int(e.retry_after) + 1).encode('latin-1')
+            await self._send_json(send, 429, {'error': str(e)}, cors + [(b'retry-after', retry_after)])
+        except CircuitOpenError as e:
+            retry_after = str(int(e.retry_after) + 1).encode('latin-1')
+            await self._send_json(send, 503, {'error': str(e)}, cors + [(b'retry-after', retry_after)])
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f"Hiba történt: {error_msg}")
+            await asyncio.to_thread(send_error_email, error_msg, '/chat', session_id)
+            await self._send_json(send, 500, {'error': error_msg}, cors)
+
+asgi_app = AsyncChatApp(app)
+
+def warm_report_font():
+    """Az fpdf/fontTools betűtípus-kezelésének betöltése egy eldobott egyoldalas PDF-fel"""
+    pdf = FPDF()
+    pdf.add_font('Montserrat', '', 'Montserrat-Regular.ttf')
+    pdf.add_page()
+    pdf.set_font('Montserrat', size=12)
+    pdf.cell(0, 10, 'A Te xFLOWer folyamatod')
+    pdf.output()
+
+def warm_openai_client():
+    """Az OpenAI kliens létrehozása és az asszisztens API erőforrás-moduljainak betöltése (hálózati hívás nélkül)"""
+    openai.beta.threads.runs
+    openai.beta.threads.messages
+
+def warm_image_pool():
+    """A képfeldolgozó folyamatok elindítása és előmelegítése (IMAGE_WORKERS=0 esetén helyben)"""
+    if IMAGE_WORKERS <= 0:
+        warm_image_worker()
+        return
+    executor = get_image_executor()
+    futures = [executor.submit(warm_image_worker) for _ in range(IMAGE_WORKERS)]
+    for future in futures:
+        future.result(timeout=PLANTUML_RENDER_TIMEOUT)
+
+def warm_up():
+    """Hidegindítás utáni előmelegítés: nehéz importok, betűtípusok, logó, folyamatok és HTTP kapcsolatok
+
+    Minden lépés önálló; a hibát csak naplózzuk, a kiszolgálás ettől független.
+    """
+    started = time.perf_counter()
+    steps = (
+        ('imports', lambda: [module.resolve() for module in lazy_imports]),
+        ('openai_client', warm_openai_client),
+        ('report_font', warm_report_font),
+        ('image_pool', warm_image_pool),
+        ('renderer', diagram_renderer.warm_up),
+        ('openai', lambda: openai.models.list()),
+    )
+    for name, step in steps:
+        step_started = time.perf_counter()
+        try:
+            step()
+            logger.info("Előmelegítés: %s (%.0f ms)", name, (time.perf_counter() - step_started) * 1000)
+        except Exception as e:
+            logger.warning("Előmelegítés sikertelen (%s): %s", name, e)
+    logger.info("Előmelegítés kész (%.0f ms)", (time.perf_counter() - started) * 1000)
+
+def schedule_warm_up(delay=STARTUP_WARMUP_DELAY):
+    """Előmelegítés háttérszálon, késleltetve, hogy a szerver addigra megnyissa a portot"""
+    timer = threading.Timer(delay, warm_up)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+# Csak a fő folyamatban; a képfeldolgozó folyamatok a saját részüket a warm_image_worker-rel kapják meg
+if STARTUP_WARMUP and multiprocessing.parent_process() is None:
+    schedule_warm_up()
+
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
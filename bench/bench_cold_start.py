@@ -0,0 +1,63 @@
+"""Hidegindítás: `import app` ideje és az első, OpenAI klienst igénylő kérés többletideje
+
+Minden változat friss interpreterben fut. Az "első kérés" a /init-session válaszideje, plusz
+az OpenAI kliens első elérése, amit egy valódi /chat is megfizet (hálózati hívás nélkül mérve).
+Teljes (nem lusta) import esetén működő libcairo és fpdf2 kell.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import benchutil
+
+PROBE = r'''
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+if WARM:
+    for module in app.lazy_imports:
+        module.resolve()
+    app.warm_openai_client()
+client = app.app.test_client()
+request_started = time.perf_counter()
+client.post('/init-session')
+app.openai.beta.threads.runs
+app.openai.beta.threads.messages
+print(json.dumps({'import': imported - started, 'first_request': time.perf_counter() - request_started}))
+'''
+
+VARIANTS = (
+    ('teljes import', {'LAZY_IMPORTS': '0'}, False),
+    ('lusta import', {'LAZY_IMPORTS': '1'}, False),
+    ('lusta + előmelegítés', {'LAZY_IMPORTS': '1'}, True),
+)
+
+
+def measure(env, warm, runs=3):
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, '-c', f'WARM = {warm}\n' + PROBE],
+            cwd=benchutil.ROOT, env=env, capture_output=True, text=True, check=True,
+        )
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {key: min(sample[key] for sample in samples) for key in samples[0]}
+
+
+def main():
+    benchutil.setup()
+    print(f"{'változat':<24} {'import app':>12} {'első kérés':>12}")
+    for name, overrides, warm in VARIANTS:
+        try:
+            timings = measure(dict(os.environ, **overrides), warm)
+        except subprocess.CalledProcessError as e:
+            print(f"{name:<24} nem futtatható: {e.stderr.strip().splitlines()[-1]}")
+            continue
+        print(f"{name:<24} {benchutil.fmt_seconds(timings['import']):>12} "
+              f"{benchutil.fmt_seconds(timings['first_request']):>12}")
+
+
+if __name__ == '__main__':
+    main()
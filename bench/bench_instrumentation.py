@@ -0,0 +1,135 @@
+"""A szakaszidő-mérés és nyomkövetés többletköltsége a /chat úton (cél: a kérésidő 1%-a alatt)
+
+1) Mikro: egy timed_stage blokk és a kérésenkénti nyomkövetés (indítás, log sor, hisztogram) ára.
+   Becslés: kérésenkénti szakaszszám x szakaszár + a kérésenkénti fix rész.
+2) Teljes kérés: az ASGI /chat folyamaton belül, nulla késleltetésű csonk OpenAI/PlantUML
+   szerverrel (a legrosszabb eset: nincs hálózati várakozás, ami elfedné a mérést),
+   váltakozó körökben be- és kikapcsolt mérőkóddal; a körök mediánja a zajt csillapítja.
+Alapból INFO szintű logolással (a kérésenkénti 'Kérés vége' sor is mérődik), a kimenet /dev/null-ba megy;
+LOG_LEVEL=WARNING esetén csak a hisztogramok és a szakaszidők költsége marad. Egymagos gépen az A/B
+különbséget a háttérben formázó log szál ütemezése zajossá teszi, ott a becslés a megbízhatóbb.
+
+Futtatás: python bench/bench_instrumentation.py [--requests 50] [--rounds 20] [--run-seconds 2.0]
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import itertools
+import json
+import os
+import statistics
+import time
+
+import benchutil
+
+benchutil.setup(LOG_LEVEL='INFO', LOG_FORMAT='json', ADMISSION_SESSION_RATE=0, ADMISSION_IP_RATE=0,
+                ADMISSION_MAX_INFLIGHT=0, GENERATION_CACHE_SIZE=0)
+
+import app
+import httpx
+import stub_servers
+
+INSTRUMENTED = {name: getattr(app, name) for name in ('timed_stage', 'record_stage', 'start_trace', 'finish_trace')}
+INSTRUMENTED['request_latency_observe'] = app.request_latency.observe
+
+
+def set_instrumentation(enabled):
+    if enabled:
+        for name in ('timed_stage', 'record_stage', 'start_trace', 'finish_trace'):
+            setattr(app, name, INSTRUMENTED[name])
+        app.request_latency.observe = INSTRUMENTED['request_latency_observe']
+        return
+
+    def start_trace(trace_id=None):
+        # A trace id a válasz fejlécéhez kell, a mérés nélkül is
+        trace = {'trace_id': trace_id or 'off', 'started': 0.0, 'stages': {}}
+        app.request_trace.set(trace)
+        return trace
+
+    app.timed_stage = lambda stage: contextlib.nullcontext()
+    app.record_stage = lambda stage, seconds: None
+    app.start_trace = start_trace
+    app.finish_trace = lambda trace, **fields: app.request_trace.set(None)
+    app.request_latency.observe = lambda label, seconds: None
+
+
+async def chat_batch(client, count, batch):
+    for index in range(count):
+        body = json.dumps({'message': f'Folyamat {batch}/{index}', 'format': 'svg', 'cache': False})
+        response = await client.post('/chat', content=body, headers={'X-Session-ID': f'bench-{batch}-{index}'})
+        assert response.status_code == 200, response.text
+
+
+def stage_cost(count=10000):
+    def loop():
+        for _ in range(count):
+            with app.timed_stage('bench'):
+                pass
+    return benchutil.best_of(loop) / count
+
+
+def trace_cost(count=10000):
+    """Kérésenkénti fix rész: nyomkövetés indítása, lezárása (log sor) és a kérés hisztogram"""
+    def loop():
+        for _ in range(count):
+            trace = app.start_trace()
+            app.request_latency.observe('/bench', 0.001)
+            app.finish_trace(trace, method='POST', path='/bench', mode='asgi')
+    return benchutil.best_of(loop) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=50, help='kérések száma körönként')
+    parser.add_argument('--rounds', type=int, default=20, help='váltakozó be/ki körök száma')
+    parser.add_argument('--run-seconds', type=float, default=2.0, help='tipikus asszisztens futásidő a %%-os becsléshez')
+    args = parser.parse_args()
+
+    app.log_listener.handlers[0].setStream(open(os.devnull, 'w'))
+    app.RUN_POLL_INITIAL_DELAY = 0.0
+    backend = stub_servers.StubBackend(run_latency=0.0, render_latency=0.0)
+    stub_servers.install(app, backend)
+    batches = itertools.count()
+
+    async def run(enabled):
+        set_instrumentation(enabled)
+        transport = httpx.ASGITransport(app=app.asgi_app, client=('127.0.0.1', 5000))
+        async with httpx.AsyncClient(transport=transport, base_url='http://app') as client:
+            await chat_batch(client, args.requests, next(batches))
+
+    # Hány szakasz mérődik egy kérésben
+    stages_before = sum(int(line.rsplit(' ', 1)[1]) for line in app.stage_latency.render() if '_count{' in line)
+    asyncio.run(run(True))
+    stages = (sum(int(line.rsplit(' ', 1)[1]) for line in app.stage_latency.render() if '_count{' in line)
+              - stages_before) / args.requests
+
+    app.start_trace()
+    per_stage = stage_cost()
+    app.request_trace.set(None)
+    per_request = trace_cost()
+    estimate = stages * per_stage + per_request
+
+    timings = {True: [], False: []}
+    for round_index in range(args.rounds):
+        # Váltakozó sorrend, hogy a tároló növekedése ne egyik oldalt terhelje
+        for enabled in ((False, True) if round_index % 2 == 0 else (True, False)):
+            gc.collect()
+            started = time.process_time()
+            asyncio.run(run(enabled))
+            timings[enabled].append((time.process_time() - started) / args.requests)
+    set_instrumentation(True)
+    off = statistics.median(timings[False])
+    measured = statistics.median(timings[True]) - off
+
+    print(f"timed_stage: {benchutil.fmt_seconds(per_stage)}, nyomkövetés + log sor + kérés hisztogram: "
+          f"{benchutil.fmt_seconds(per_request)}, {stages:.1f} szakasz / kérés")
+    print(f"/chat csonkkal (0 s futás, {args.rounds}x{args.requests} kérés): {benchutil.fmt_seconds(off)} / kérés mérés nélkül")
+    print(f"{'':>12} {'többlet':>10} {'0 s futás':>10} {f'{args.run_seconds:.1f} s futás':>12}")
+    for name, delta in (('becslés', estimate), ('A/B medián', measured)):
+        print(f"{name:>12} {benchutil.fmt_seconds(delta):>10} {delta / off * 100:>9.2f}% "
+              f"{delta / (args.run_seconds + off) * 100:>11.4f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Logolás költsége a /chat úton: régi basicConfig(DEBUG) vs. háttérszálas sor, szintek és mintavétel
+
+A szinkron (Flask) /chat utat méri a Flask test clienttel, csonk OpenAI/PlantUML szerverrel
+(bench/stub_servers.py, külön folyamatban). Ez az út írta az éles naplóba a teljes OpenAI
+válaszokat DEBUG szinten.
+ - legacy: a user-023 előtti beállítás: root DEBUG, szinkron StreamHandler szöveges formátummal,
+   minden alrendszer (httpx, httpcore, openai, urllib3) DEBUG szinten
+ - current: configure_logging() alapértékekkel (INFO, JSON, háttérszál, alrendszer szintek, mintavétel)
+Mért értékek: kérésenkénti CPU idő (minden szálé, a háttérszálas kiírással együtt),
+a kérés medián ideje, a kiírt bájtok és sorok száma; váltakozó körök mediánja.
+
+Futtatás: python bench/bench_logging.py [--requests 50] [--rounds 10]
+"""
+import argparse
+import gc
+import io
+import itertools
+import logging
+import os
+import statistics
+import sys
+import time
+
+import benchutil
+from load_async_chat import free_port, start
+
+
+class CountingSink(io.TextIOBase):
+    def __init__(self):
+        self.bytes = 0
+        self.lines = 0
+
+    def write(self, text):
+        self.bytes += len(text.encode('utf-8'))
+        self.lines += text.count('\n')
+        return len(text)
+
+
+def use_legacy_logging(app, sink, subsystems):
+    """A korábbi logging.basicConfig(level=DEBUG, format=...) és TraceIdFilter megfelelője"""
+    app.log_listener.stop()
+    root = logging.getLogger()
+    saved = (list(root.handlers), root.level, {name: logging.getLogger(name).level for name in subsystems})
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s'))
+    handler.addFilter(app.TraceIdFilter())
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+    for name in subsystems:
+        logging.getLogger(name).setLevel(logging.NOTSET)
+    return saved
+
+
+def restore_logging(app, saved):
+    root = logging.getLogger()
+    handlers, level, levels = saved
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+    for name, subsystem_level in levels.items():
+        logging.getLogger(name).setLevel(subsystem_level)
+    app.log_listener.start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=50, help='kérések száma körönként')
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    stub_port = free_port()
+    stub = start([sys.executable, os.path.join('bench', 'stub_servers.py'), '--port', str(stub_port),
+                  '--run-latency', '0', '--render-latency', '0'], stub_port)
+    stub_url = f'http://127.0.0.1:{stub_port}'
+    try:
+        benchutil.setup(
+            LOG_LEVEL='INFO', LOG_FORMAT='json', OPENAI_BASE_URL=f'{stub_url}/v1', ASSISTANT_ID='asst_bench',
+            PLANTUML_SERVER_URL=f'{stub_url}/plantuml', PLANTUML_RENDERER='remote', RUN_WAIT_MODE='poll',
+            ADMISSION_SESSION_RATE=0, ADMISSION_IP_RATE=0, ADMISSION_MAX_INFLIGHT=0,
+            GENERATION_CACHE_SIZE=0,
+        )
+        import app
+        app.RUN_POLL_INITIAL_DELAY = 0.0
+        run(app, args.requests, args.rounds)
+    finally:
+        stub.terminate()
+        stub.wait(timeout=10)
+
+
+def run(app, requests_count, rounds):
+    subsystems = [pair.split('=', 1)[0].strip() for pair in app.LOG_LEVELS.split(',') if '=' in pair]
+    client = app.app.test_client()
+    batches = itertools.count()
+    request_wall = []
+
+    def chat(count):
+        batch = next(batches)
+        for index in range(count):
+            started = time.perf_counter()
+            response = client.post('/chat', json={'message': f'Folyamat {batch}/{index}', 'format': 'svg', 'cache': False},
+                                   headers={'X-Session-ID': f'bench-{batch}-{index}'})
+            request_wall.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.get_json()
+
+    def flush_listener():
+        # A háttérszál kiírja a sorban maradt rekordokat, ez is a költség része
+        app.log_listener.stop()
+        app.log_listener.start()
+
+    def measure(variant, sink):
+        sink.bytes = sink.lines = 0
+        request_wall.clear()
+        gc.collect()
+        if variant == 'legacy':
+            saved = use_legacy_logging(app, sink, subsystems)
+        else:
+            app.log_listener.handlers[0].setStream(sink)
+        started = time.process_time()
+        try:
+            chat(requests_count)
+            if variant == 'current':
+                flush_listener()
+        finally:
+            if variant == 'legacy':
+                restore_logging(app, saved)
+        return (time.process_time() - started) / requests_count, statistics.median(request_wall), sink.bytes, sink.lines
+
+    chat(10)  # bemelegítés
+    results = {'legacy': [], 'current': []}
+    for round_index in range(rounds):
+        # Váltakozó sorrend, hogy a tároló növekedése ne egyik oldalt terhelje
+        for variant in (('legacy', 'current') if round_index % 2 == 0 else ('current', 'legacy')):
+            results[variant].append(measure(variant, CountingSink()))
+
+    print(f"{rounds}x{requests_count} kérés változatonként, szinkron /chat, csonk szerverrel (körök mediánja)")
+    print(f"{'változat':>8} {'CPU/kérés':>10} {'p50 kérés':>10} {'kimenet':>11} {'sor/kérés':>9}")
+    for variant, samples in results.items():
+        cpu, wall, output_bytes, lines = (statistics.median(values) for values in zip(*samples))
+        print(f"{variant:>8} {benchutil.fmt_seconds(cpu):>10} {benchutil.fmt_seconds(wall):>10} "
+              f"{output_bytes / requests_count:>10.0f}B {lines / requests_count:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
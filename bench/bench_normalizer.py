@@ -0,0 +1,47 @@
+"""Asszisztens kimenet normalizálása: régi több menetes feldolgozás vs. PlantUMLNormalizer, valódi kimeneteken
+
+A minták a repóban lévő éles naplóból származnak (benchutil.assistant_outputs), a nagy
+minta ezek törzsét fűzi egyetlen blokkba. Ellenőrzi azt is, hogy a két kimenet azonos.
+
+Futtatás: python bench/bench_normalizer.py [--repeat 20]
+"""
+import argparse
+
+import benchutil
+
+benchutil.setup()
+
+import app
+from tests.test_plantuml_normalizer import THEME_DIRECTIVES, legacy_normalize
+
+
+def diagram_body(assistant_response):
+    lines = assistant_response.split('\n')
+    start = next(i for i, line in enumerate(lines) if line.strip() == 'start')
+    stop = max(i for i, line in enumerate(lines) if line.strip() == 'stop')
+    return lines[start + 1:stop]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20, help='a nagy minta ennyiszer fűzi össze a törzseket')
+    args = parser.parse_args()
+
+    outputs = benchutil.assistant_outputs()
+    body = [line for output in outputs for line in diagram_body(output)] * args.repeat
+    samples = [(f'napló #{index}', output) for index, output in enumerate(outputs, 1)]
+    samples.append((f'nagy ({len(body)} sor)', '```plantuml\n@startuml\nstart\n' + '\n'.join(body) + '\nstop\n@enduml\n```'))
+
+    normalizer = app.PlantUMLNormalizer(theme_directives=THEME_DIRECTIVES)
+    print(f"{'minta':>16} {'méret':>8} {'régi':>10} {'új':>10} {'gyorsulás':>10} {'azonos':>7}")
+    for name, sample in samples:
+        number = max(1, 20000 // len(sample))
+        legacy = benchutil.best_of(lambda: legacy_normalize(sample), number=number)
+        current = benchutil.best_of(lambda: normalizer.normalize(sample), number=number)
+        same = normalizer.normalize(sample) == legacy_normalize(sample)
+        print(f"{name:>16} {len(sample):>7}B {benchutil.fmt_seconds(legacy):>10} {benchutil.fmt_seconds(current):>10} "
+              f"{legacy / current:>9.2f}x {'igen' if same else 'NEM':>7}")
+
+
+if __name__ == '__main__':
+    main()
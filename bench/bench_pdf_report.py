@@ -0,0 +1,105 @@
+"""PDF jelentés 50 bejegyzéses történetből: régi (ideiglenes fájl, oldalankénti betűtípus, teljes felbontás) vs. create_pdf_report
+
+A diagramokat a PIL rajzolja (a render_plantuml_png helyett), így a mérés cairo és
+PlantUML szerver nélkül is fut. Mért értékek: idő, tracemalloc csúcs, PDF méret.
+
+Futtatás: python bench/bench_pdf_report.py [--entries 50] [--width 4000] [--height 6000]
+"""
+import argparse
+import os
+import time
+import tracemalloc
+import warnings
+from io import BytesIO
+
+import benchutil
+
+benchutil.setup()
+
+import app
+from PIL import Image, ImageDraw
+
+SESSION_ID = 'bench-pdf'
+
+
+def diagram_png(index, width, height):
+    """Diagramszerű kép: dobozok és nyilak fehér alapon (a valódi diagramokhoz hasonlóan jól tömöríthető)"""
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    box_height = height // 12
+    for row in range(10):
+        top = box_height // 2 + row * box_height + (index % 7) * 3
+        draw.rounded_rectangle((width // 4, top, 3 * width // 4, top + box_height // 2), radius=20,
+                               outline='black', width=6, fill=(255, 250, 220))
+        draw.line((width // 2, top + box_height // 2, width // 2, top + box_height), fill='black', width=6)
+    output = BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+
+def legacy_pdf_report(history, images):
+    """A user-009 előtti create_pdf_report fpdf2 API-ra átírva: betűtípus oldalanként, kép ideiglenes fájlból"""
+    pdf = app.FPDF()
+    for idx, entry in enumerate(history, 1):
+        pdf.add_page()
+        try:
+            with warnings.catch_warnings():
+                # Az fpdf2 figyelmeztet a már regisztrált betűtípusra; a régi kód mégis oldalanként hívta
+                warnings.simplefilter('ignore')
+                pdf.add_font('Montserrat', '', 'Montserrat-Regular.ttf')
+            pdf.set_font('Montserrat', size=12)
+        except Exception:
+            pdf.set_font('Helvetica', size=12)
+        pdf.cell(0, 10, f'Folyamat {idx} - {app.datetime.now().strftime("%Y-%m-%d %H:%M")}',
+                 new_x=app.XPos.LMARGIN, new_y=app.YPos.NEXT)
+        pdf.ln(5)
+        pdf.cell(0, 10, 'Felhasználói kérés:', new_x=app.XPos.LMARGIN, new_y=app.YPos.NEXT)
+        pdf.multi_cell(0, 10, str(entry.prompt))
+        pdf.ln(5)
+        temp_image_path = f'temp_diagram_{idx}.png'
+        with open(temp_image_path, 'wb') as f:
+            f.write(images[entry.plantuml])
+        pdf.image(temp_image_path, x=10, y=pdf.get_y(), w=pdf.w - 20)
+        os.remove(temp_image_path)
+        pdf.ln(10)
+    return bytes(pdf.output())
+
+
+def measure(func):
+    tracemalloc.start()
+    started = time.perf_counter()
+    pdf_bytes = func()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, len(pdf_bytes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=50)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=6000)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    images = {}
+    for index in range(args.entries):
+        plantuml_code = f'@startuml\ntitle Folyamat {index}\n:lépés;\n@enduml'
+        images[plantuml_code] = diagram_png(index, args.width, args.height)
+        app.state_store.append_history(SESSION_ID, f'Folyamat {index}: rendelés, ellenőrzés, kiszállítás', plantuml_code)
+    app.render_plantuml_png = lambda plantuml_code, *args, **kwargs: images[plantuml_code]
+    history = app.state_store.history(SESSION_ID)
+    print(f"{len(history)} bejegyzés, {args.width}x{args.height} PNG, "
+          f"átlag {sum(map(len, images.values())) / len(images) / 1024:.0f} KB "
+          f"(előkészítés: {time.perf_counter() - started:.1f} s)")
+
+    print(f"{'változat':>10} {'idő':>10} {'mem. csúcs':>11} {'PDF':>10}")
+    for name, func in (('legacy', lambda: legacy_pdf_report(history, images)),
+                       ('current', lambda: app.create_pdf_report(SESSION_ID))):
+        elapsed, peak, size = measure(func)
+        print(f"{name:>10} {benchutil.fmt_seconds(elapsed):>10} {peak / 2**20:>9.1f}MB {size / 2**20:>8.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+"""PlantUML URL kódolás: a korábbi bájtonkénti ciklus és a bytes.translate alapú kódoló 1 KB - 1 MB bemeneten"""
+import os
+
+import benchutil
+
+benchutil.setup()
+
+import app  # noqa: E402
+from tests.test_plantuml_encoding import legacy_encode64_for_ascii  # noqa: E402
+
+SIZES = (1024, 10 * 1024, 100 * 1024, 1024 * 1024)
+
+
+def main():
+    print(f"{'méret':>10} {'régi':>12} {'új':>12} {'gyorsulás':>10}")
+    for size in SIZES:
+        data = os.urandom(size)
+        assert app.encode64_for_ascii(data) == legacy_encode64_for_ascii(data)
+        repeat = 1 if size >= 1024 * 1024 else 3
+        legacy = benchutil.best_of(lambda: legacy_encode64_for_ascii(data), repeat=repeat)
+        current = benchutil.best_of(lambda: app.encode64_for_ascii(data), repeat=5, number=10)
+        print(f"{size // 1024:>7} KB {benchutil.fmt_seconds(legacy):>12} {benchutil.fmt_seconds(current):>12} "
+              f"{legacy / current:>9.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""/send-email kérés mérete és feldolgozása: régi base64 data URL vs. diagram hivatkozás vs. multipart feltöltés
+
+A levél összeállításáig mér (Flask test client); az A4 komponálás és az SMTP küldés
+ki van kapcsolva, mert az mindhárom változatban azonos. Külön a puszta törzs-értelmezés
+(JSON + base64) ideje is látszik.
+
+Futtatás: python bench/bench_send_email_payload.py [--width 2400] [--height 6000]
+"""
+import argparse
+import base64
+import json
+from io import BytesIO
+
+import benchutil
+
+benchutil.setup()
+
+import app
+from bench_pdf_report import diagram_png
+from PIL import Image
+
+SESSION_ID = 'bench-email'
+RECIPIENT = {'name': 'Teszt Elek', 'email': 'teszt@example.com'}
+
+
+def multipart_body(fields, image_bytes, boundary='xflowerbenchboundary'):
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+             for name, value in fields.items()]
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="diagram.png"\r\n'
+                 f'Content-Type: image/png\r\n\r\n'.encode() + image_bytes + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--width', type=int, default=2400)
+    parser.add_argument('--height', type=int, default=6000)
+    args = parser.parse_args()
+
+    png_bytes = diagram_png(0, args.width, args.height)
+    plantuml_code = '@startuml\nstart\n:Rendelés;\nstop\n@enduml'
+    app.state_store.append_history(SESSION_ID, 'Rendelés', plantuml_code)
+    # A render cache találatát szimulálja: a diagram már elkészült a /chat válaszhoz
+    app.render_plantuml_png = lambda code, *a, **kw: png_bytes
+    jpeg = BytesIO()
+    Image.new('RGB', (10, 10), 'white').save(jpeg, format='JPEG')
+    app.create_a4_image = lambda data: jpeg.getvalue()
+    app.mail_queue.enqueue = lambda msg: None
+
+    data_url = app.png_data_url(png_bytes)
+    multipart, multipart_type = multipart_body(RECIPIENT, png_bytes)
+    variants = (
+        ('data URL', json.dumps(dict(RECIPIENT, image=data_url)).encode(), 'application/json',
+         lambda body: base64.b64decode(json.loads(body)['image'].split('base64,')[1])),
+        ('hivatkozás', json.dumps(dict(RECIPIENT, diagram_id=app.diagram_id(plantuml_code))).encode(), 'application/json',
+         lambda body: json.loads(body)['diagram_id']),
+        ('multipart', multipart, multipart_type, None),
+    )
+
+    client = app.app.test_client()
+    print(f"diagram: {args.width}x{args.height} PNG, {len(png_bytes) / 1024:.0f} KB")
+    print(f"{'változat':>12} {'törzs':>10} {'értelmezés':>11} {'kérés':>10}")
+    for name, body, content_type, parse in variants:
+        def post():
+            response = client.post('/send-email', data=body, content_type=content_type,
+                                   headers={'X-Session-ID': SESSION_ID})
+            assert response.status_code == 200, response.get_json()
+        parsed = benchutil.fmt_seconds(benchutil.best_of(lambda: parse(body), number=20)) if parse else '-'
+        print(f"{name:>12} {len(body):>9}B {parsed:>11} {benchutil.fmt_seconds(benchutil.best_of(post, number=10)):>10}")
+
+
+if __name__ == '__main__':
+    main()
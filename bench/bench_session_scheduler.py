@@ -0,0 +1,131 @@
+"""Inaktivitási időzítők 10k sessionre: session-önkénti threading.Timer (régi) vs. SessionScheduler
+
+Minden változat külön folyamatban fut, hogy a szálszám és az RSS ne keveredjen.
+Mért értékek: ütemezés és átütemezés ideje, élő szálak száma, RSS növekmény,
+valamint rövid határidőkkel a lefutott visszahívások száma és a legnagyobb késés.
+
+Futtatás: python bench/bench_session_scheduler.py [--sessions 10000]
+"""
+import argparse
+import json
+import subprocess
+import sys
+import threading
+import time
+
+import benchutil
+
+
+def rss_kb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def legacy_schedule(timers, session_id, delay, func):
+    # A korábbi reset_inactivity_timer: régi Timer törlése, új Timer szál indítása
+    if session_id in timers:
+        timers[session_id].cancel()
+    timer = threading.Timer(delay, func, args=[session_id])
+    timer.start()
+    timers[session_id] = timer
+
+
+def measure(variant, sessions, delay=600.0):
+    benchutil.setup()
+    import app
+
+    fired = []
+    lateness = []
+
+    def expire(session_id, deadline=None):
+        fired.append(session_id)
+        if deadline is not None:
+            lateness.append(time.monotonic() - deadline)
+
+    baseline_threads = threading.active_count()
+    baseline_rss = rss_kb()
+    result = {'variant': variant, 'sessions': sessions}
+
+    if variant == 'legacy':
+        timers = {}
+        schedule = lambda session_id: legacy_schedule(timers, session_id, delay, expire)
+        cancel = lambda session_id: timers.pop(session_id).cancel()
+    else:
+        scheduler = app.SessionScheduler(workers=app.SESSION_EXPIRY_WORKERS)
+        schedule = lambda session_id: scheduler.schedule(session_id, delay, expire, session_id)
+        cancel = scheduler.cancel
+
+    started = time.perf_counter()
+    try:
+        for index in range(sessions):
+            schedule(f'session-{index}')
+    except RuntimeError as e:
+        # Szálkorlát: a régi változat ennyi sessionnél elfogyaszthatja a rendelkezésre álló szálakat
+        result['error'] = f'{e} ({threading.active_count() - baseline_threads} szál után)'
+        return result
+    result['schedule_seconds'] = time.perf_counter() - started
+    result['threads'] = threading.active_count() - baseline_threads
+    result['rss_kb'] = rss_kb() - baseline_rss
+
+    started = time.perf_counter()
+    for index in range(sessions):
+        schedule(f'session-{index}')
+    result['reschedule_seconds'] = time.perf_counter() - started
+    result['threads_after_reschedule'] = threading.active_count() - baseline_threads
+
+    for index in range(sessions):
+        cancel(f'session-{index}')
+
+    # Rövid határidők: mindegyiknek le kell futnia, a késés a kiszolgálás pontosságát mutatja
+    short = min(sessions, 2000)
+    if variant == 'legacy':
+        deadlines = {}
+        for index in range(short):
+            deadlines[f'short-{index}'] = time.monotonic() + 0.5
+            legacy_schedule(timers, f'short-{index}', 0.5, lambda s: expire(s, deadlines[s]))
+    else:
+        for index in range(short):
+            scheduler.schedule(f'short-{index}', 0.5, expire, f'short-{index}', time.monotonic() + 0.5)
+    deadline = time.monotonic() + 30
+    while len(fired) < short and time.monotonic() < deadline:
+        time.sleep(0.05)
+    result['short_fired'] = f'{len(fired)}/{short}'
+    result['max_lateness'] = max(lateness) if lateness else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=10000)
+    parser.add_argument('--variant', choices=('legacy', 'scheduler'))
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(measure(args.variant, args.sessions)))
+        return
+
+    print(f"{args.sessions} session, 600 s határidő")
+    print(f"{'változat':>10} {'ütemezés':>10} {'átütemezés':>11} {'szál':>6} {'RSS':>9} {'lefutott':>10} {'max késés':>10}")
+    for variant in ('legacy', 'scheduler'):
+        output = subprocess.run(
+            [sys.executable, __file__, '--variant', variant, '--sessions', str(args.sessions)],
+            capture_output=True, text=True, timeout=600,
+        )
+        if output.returncode != 0:
+            print(f"{variant:>10} hiba: {output.stderr.strip().splitlines()[-1]}")
+            continue
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        if 'error' in result:
+            print(f"{variant:>10} {result['error']}")
+            continue
+        late = benchutil.fmt_seconds(result['max_lateness']) if result['max_lateness'] is not None else '-'
+        print(f"{variant:>10} {benchutil.fmt_seconds(result['schedule_seconds']):>10} "
+              f"{benchutil.fmt_seconds(result['reschedule_seconds']):>11} {result['threads']:>6} "
+              f"{result['rss_kb'] / 1024:>7.1f}MB {result['short_fired']:>10} {late:>10}")
+
+
+if __name__ == '__main__':
+    main()
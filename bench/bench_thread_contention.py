@@ -0,0 +1,125 @@
+"""Thread keresés/létrehozás 64 szállal: régi (zár alatti létrehozás) vs. MemoryStateStore vs. SQLiteStateStore
+
+A) 32 szál egyszerre küldi ugyanazon session első kérését, közben 32 szál meglévő
+   session-öket keres: hány létrehozás történt, és mennyit vártak a keresések.
+B) 64 szál 64 új session-t nyit egyszerre: mennyi ideig tart, amíg mind megkapja a thread-jét.
+Az OpenAI thread létrehozását egy --create-latency ideig alvó csonk helyettesíti.
+
+Futtatás: python bench/bench_thread_contention.py [--threads 64] [--create-latency 0.2]
+"""
+import argparse
+import itertools
+import os
+import tempfile
+import threading
+import time
+
+import benchutil
+
+benchutil.setup()
+
+import app
+
+
+class LegacyMemoryStateStore(app.MemoryStateStore):
+    """A user-012 előtti get_or_create_thread: a hálózati hívás a globális zár alatt fut"""
+
+    def get_or_create_thread(self, session_id, create_thread):
+        with self._lock:
+            thread_data = self._threads.get(session_id)
+            if thread_data is None:
+                thread_data = {'thread_id': create_thread(), 'last_used': time.time()}
+                self._threads[session_id] = thread_data
+            thread_data['last_used'] = time.time()
+            return thread_data['thread_id']
+
+
+class SlowCreate:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            thread_id = f'thread_{next(self._ids)}'
+        time.sleep(self.latency)
+        return thread_id
+
+
+def run_threads(count, target):
+    barrier = threading.Barrier(count)
+
+    def worker(index):
+        barrier.wait()
+        target(index)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def hot_session(store, threads, latency):
+    create = SlowCreate(latency)
+    half = threads // 2
+    for index in range(half):
+        store.get_or_create_thread(f'existing-{index}', create)
+    create.calls = 0
+    results, lookups = [], []
+
+    def target(index):
+        if index < half:
+            results.append(store.get_or_create_thread('hot', create))
+        else:
+            started = time.perf_counter()
+            store.get_or_create_thread(f'existing-{index - half}', create)
+            lookups.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    run_threads(threads, target)
+    return {
+        'elapsed': time.perf_counter() - started,
+        'creates': create.calls,
+        'distinct': len(set(results)),
+        'lookup_max': max(lookups),
+        'lookup_p50': sorted(lookups)[len(lookups) // 2],
+    }
+
+
+def new_sessions(store, threads, latency):
+    create = SlowCreate(latency)
+    started = time.perf_counter()
+    run_threads(threads, lambda index: store.get_or_create_thread(f'new-{index}', create))
+    return time.perf_counter() - started, create.calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=64)
+    parser.add_argument('--create-latency', type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = (
+            ('legacy', LegacyMemoryStateStore),
+            ('memory', app.MemoryStateStore),
+            ('sqlite', lambda: app.SQLiteStateStore(os.path.join(tmp, f'state-{time.monotonic_ns()}.db'),
+                                                    app.HISTORY_SESSION_MAX_ENTRIES)),
+        )
+        print(f"{args.threads} szál, thread létrehozás: {args.create_latency}s")
+        print(f"{'tároló':>8} | {'A: idő':>9} {'létrehozás':>10} {'thread':>6} {'keresés p50':>12} {'keresés max':>12} "
+              f"| {'B: idő':>9} {'létrehozás':>10}")
+        for name, factory in stores:
+            hot = hot_session(factory(), args.threads, args.create_latency)
+            elapsed, creates = new_sessions(factory(), args.threads, args.create_latency)
+            print(f"{name:>8} | {benchutil.fmt_seconds(hot['elapsed']):>9} {hot['creates']:>10} {hot['distinct']:>6} "
+                  f"{benchutil.fmt_seconds(hot['lookup_p50']):>12} {benchutil.fmt_seconds(hot['lookup_max']):>12} "
+                  f"| {benchutil.fmt_seconds(elapsed):>9} {creates:>10}")
+
+
+if __name__ == '__main__':
+    main()
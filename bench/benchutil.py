@@ -0,0 +1,63 @@
+"""Közös segédfüggvények a bench/ alatti mérésekhez (futtatás: python bench/<szkript>.py a repó gyökeréből)"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup(**env):
+    """Az app.py importálása előtt: elérési út, munkakönyvtár és tesztbarát környezeti alapértékek"""
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    defaults = {
+        'OPENAI_API_KEY': 'bench',
+        'IMAGE_WORKERS': '0',
+        'STATE_STORE': 'memory',
+        'LOG_LEVEL': 'WARNING',
+        'LOG_FORMAT': 'text',
+    }
+    defaults.update(env)
+    for key, value in defaults.items():
+        os.environ.setdefault(key, str(value))
+
+
+def best_of(func, repeat=5, number=1):
+    """A legjobb futásidő másodpercben, number hívásra átlagolva"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best
+
+
+def fmt_seconds(seconds):
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} us"
+
+
+PRODUCTION_LOG = os.path.join(ROOT, 'tory-dorree-xflowerai_2025-11-07T08_53_52.670Z.txt')
+
+
+def assistant_outputs():
+    """Valódi asszisztens válaszok (nyers, kódblokkos szöveg) a repóban lévő éles naplóból"""
+    import ast
+    import re
+
+    pattern = re.compile(r"role='assistant'")
+    value_pattern = re.compile(r"TextContentBlock\(text=Text\(annotations=\[\], value=('(?:[^'\\]|\\.)*')\)")
+    outputs = []
+    with open(PRODUCTION_LOG, encoding='utf-8') as log:
+        for line in log:
+            if 'OpenAI válasz' not in line or not pattern.search(line):
+                continue
+            # Az üzenetlista első eleme a legfrissebb asszisztens válasz
+            match = value_pattern.search(line)
+            if match:
+                outputs.append(ast.literal_eval(match.group(1)))
+    return list(dict.fromkeys(outputs))
@@ -0,0 +1,40 @@
+"""Csonk `plantuml -pipe` folyamat a helyi jar renderelő méréseihez és tesztjeihez (Java nélkül)
+
+A valódihoz hasonlóan soronként olvassa a bemenetet, és minden @enduml után kiír egy SVG-t,
+majd a -pipedelimitor utáni elválasztót. A kimenet blokkolóan íródik, így a teli pipe
+ugyanúgy feltartja, mint a PlantUML-t.
+
+Használat: python bench/fake_plantuml_pipe.py -pipedelimitor ELVÁLASZTÓ [--svg-bytes 2000] [--hang]
+"""
+import argparse
+import sys
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-pipedelimitor', dest='delimiter', required=True)
+    parser.add_argument('--svg-bytes', type=int, default=2000, help='egy SVG kimenet hozzávetőleges mérete')
+    parser.add_argument('--hang', action='store_true', help='soha nem válaszol (határidő teszthez)')
+    args, _ = parser.parse_known_args()
+
+    count = 0
+    lines = []
+    for line in sys.stdin.buffer:
+        lines.append(line)
+        if not line.strip().startswith(b'@enduml'):
+            continue
+        if args.hang:
+            time.sleep(3600)
+        count += 1
+        title = next((l.strip()[6:].decode('utf-8') for l in lines if l.strip().startswith(b'title ')), str(count))
+        lines = []
+        padding = '<!--' + 'x' * max(0, args.svg_bytes - 120) + '-->'
+        svg = (f'<svg xmlns="http://www.w3.org/2000/svg" width="400" height="300">'
+               f'<text x="10" y="20">{title}</text>{padding}</svg>\n')
+        sys.stdout.buffer.write(svg.encode('utf-8') + args.delimiter.encode('utf-8') + b'\n')
+        sys.stdout.buffer.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""/chat terheléses mérés csonk OpenAI és PlantUML szerverrel, 10/100/500 párhuzamos sessionnel
+
+A csonk (bench/stub_servers.py) és a mért szerver külön folyamatban fut, így a mérő kliens
+nem versenyez velük a GIL-ért. Alapértelmezés szerint az ASGI változatot (uvicorn app:asgi_app)
+méri, --target wsgi esetén a szálas Flask fejlesztői szervert, összehasonlításként.
+Egymagos gépen a három folyamat egy CPU-n osztozik, ott a kérés/s a CPU plafonját mutatja.
+
+Futtatás: python bench/load_async_chat.py [--sessions 10 100 500] [--requests 2] [--target asgi|wsgi]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import benchutil
+
+import httpx
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"A folyamat kilépett ({process.returncode}): {' '.join(process.args)}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"A {port} port nem nyílt meg {timeout} s alatt")
+
+
+def start(args, port, env=None):
+    process = subprocess.Popen(args, cwd=benchutil.ROOT, env=env)
+    try:
+        wait_for_port(port, process)
+    except Exception:
+        process.kill()
+        raise
+    return process
+
+
+def target_env(stub_url, sessions):
+    env = dict(os.environ)
+    env.update({
+        'OPENAI_API_KEY': 'bench',
+        'OPENAI_BASE_URL': f'{stub_url}/v1',
+        'ASSISTANT_ID': 'asst_bench',
+        'PLANTUML_SERVER_URL': f'{stub_url}/plantuml',
+        'PLANTUML_RENDERER': 'remote',
+        'RUN_WAIT_MODE': 'poll',
+        'STATE_STORE': 'memory',
+        'IMAGE_WORKERS': '0',
+        'LOG_LEVEL': 'WARNING',
+        'LOG_FORMAT': 'text',
+        # A mérés a feldolgozást terheli, nem a beengedést
+        'ADMISSION_SESSION_RATE': '0',
+        'ADMISSION_IP_RATE': '0',
+        'ADMISSION_MAX_INFLIGHT': '0',
+        'GENERATION_CACHE_SIZE': '0',
+        'ASYNC_HTTP_MAX_CONNECTIONS': str(max(100, sessions)),
+    })
+    return env
+
+
+def target_command(target, port):
+    if target == 'asgi':
+        return [sys.executable, '-m', 'uvicorn', 'app:asgi_app', '--host', '127.0.0.1', '--port', str(port),
+                '--log-level', 'warning', '--backlog', '4096']
+    return [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--host', '127.0.0.1', '--port', str(port),
+            '--with-threads']
+
+
+async def run_session(client, url, session_index, requests_per_session, latencies, errors):
+    headers = {'X-Session-ID': f'bench-{session_index}-{time.monotonic_ns()}'}
+    for request_index in range(requests_per_session):
+        message = f'Folyamat #{session_index}/{request_index}: rendelés felvétele, ellenőrzés, kiszállítás'
+        started = time.perf_counter()
+        try:
+            response = await client.post(url, json={'message': message, 'format': 'svg'}, headers=headers)
+            if response.status_code != 200 or 'svg' not in response.json():
+                errors.append(f'{response.status_code}: {response.text[:120]}')
+                continue
+        except httpx.HTTPError as e:
+            errors.append(f'{type(e).__name__}: {e}')
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_level(base_url, sessions, requests_per_session, timeout):
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=sessions, max_keepalive_connections=sessions)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            run_session(client, f'{base_url}/chat', index, requests_per_session, latencies, errors)
+            for index in range(sessions)
+        ))
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--requests', type=int, default=2, help='kérések száma sessionönként (egymás után)')
+    parser.add_argument('--target', choices=('asgi', 'wsgi'), default='asgi')
+    parser.add_argument('--run-latency', type=float, default=0.5, help='a csonk asszisztens futásideje (s)')
+    parser.add_argument('--render-latency', type=float, default=0.05, help='a csonk PlantUML szerver válaszideje (s)')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    args = parser.parse_args()
+
+    stub_port = free_port()
+    stub = start([sys.executable, os.path.join('bench', 'stub_servers.py'), '--port', str(stub_port),
+                  '--run-latency', str(args.run_latency), '--render-latency', str(args.render_latency)], stub_port)
+    stub_url = f'http://127.0.0.1:{stub_port}'
+    try:
+        print(f"{args.target}, csonk run: {args.run_latency}s, render: {args.render_latency}s, "
+              f"{args.requests} kérés/session")
+        print(f"{'session':>8} {'kérés':>7} {'hiba':>6} {'idő':>9} {'kérés/s':>9} {'p50':>10} {'p95':>10} {'p99':>10}")
+        for sessions in args.sessions:
+            port = free_port()
+            server = start(target_command(args.target, port), port, target_env(stub_url, sessions))
+            try:
+                latencies, errors, elapsed = asyncio.run(
+                    run_level(f'http://127.0.0.1:{port}', sessions, args.requests, args.timeout))
+            finally:
+                server.terminate()
+                server.wait(timeout=10)
+            if latencies:
+                p50, p95, p99 = (benchutil.fmt_seconds(percentile(latencies, q)) for q in (0.5, 0.95, 0.99))
+            else:
+                p50 = p95 = p99 = '-'
+            print(f"{sessions:>8} {len(latencies) + len(errors):>7} {len(errors):>6} {elapsed:>8.2f}s "
+                  f"{len(latencies) / elapsed:>9.1f} {p50:>10} {p95:>10} {p99:>10}")
+            for error in sorted(set(errors))[:3]:
+                print(f"         {error}")
+        print(f"csonk: {httpx.get(f'{stub_url}/stats').json()}")
+    finally:
+        stub.terminate()
+        stub.wait(timeout=10)
+
+
+if __name__ == '__main__':
+    main()
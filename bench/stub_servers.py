@@ -0,0 +1,168 @@
+"""Csonk OpenAI (Assistants v2) és PlantUML szerver a terheléses mérésekhez
+
+Egyetlen ASGI alkalmazás szolgálja ki mindkettőt:
+  /v1/...              threads, messages, runs (poll mód: a run a megadott késleltetés után 'completed')
+  /plantuml/svg/~1...  SVG a megadott renderelési késleltetés után
+
+Az asszisztens válaszai a repóban lévő éles napló valódi kimenetei, a kérés szövegével
+címként, hogy a render cache ne takarja el a renderelést.
+
+Önálló futtatás: python bench/stub_servers.py --port 8765 --run-latency 0.5 --render-latency 0.05
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+import benchutil
+
+
+class StubBackend:
+    def __init__(self, run_latency=0.5, render_latency=0.05, outputs=None):
+        self.run_latency = run_latency
+        self.render_latency = render_latency
+        self.outputs = outputs or benchutil.assistant_outputs()
+        self._ids = itertools.count(1)
+        self._threads = {}
+        self._runs = {}
+        self.stats = {'threads': 0, 'runs': 0, 'retrieves': 0, 'renders': 0}
+
+    def _id(self, prefix):
+        return f"{prefix}_{next(self._ids)}"
+
+    def _message(self, thread_id, role, text):
+        return {
+            'id': self._id('msg'), 'object': 'thread.message', 'created_at': int(time.time()),
+            'thread_id': thread_id, 'role': role, 'status': 'completed',
+            'content': [{'type': 'text', 'text': {'value': text, 'annotations': []}}],
+            'assistant_id': None, 'run_id': None, 'attachments': [], 'metadata': {},
+        }
+
+    def _run(self, run_id):
+        run = self._runs[run_id]
+        status = 'completed' if time.monotonic() - run['created'] >= self.run_latency else 'in_progress'
+        if status == 'completed' and not run['replied']:
+            self._reply(run['thread_id'])
+            run['replied'] = True
+        return {
+            'id': run_id, 'object': 'thread.run', 'created_at': int(time.time()),
+            'thread_id': run['thread_id'], 'assistant_id': run['assistant_id'], 'status': status,
+            'instructions': '', 'model': 'stub', 'tools': [], 'metadata': {},
+        }
+
+    def _reply(self, thread_id):
+        messages = self._threads[thread_id]
+        prompt = next((m['content'][0]['text']['value'] for m in reversed(messages) if m['role'] == 'user'), '')
+        title = prompt.strip().splitlines()[-1][:60] if prompt.strip() else 'diagram'
+        output = self.outputs[len(messages) % len(self.outputs)]
+        messages.append(self._message(thread_id, 'assistant', output.replace('@startuml', f'@startuml\ntitle {title}', 1)))
+
+    def openai(self, method, path, body):
+        parts = path.strip('/').split('/')[1:]  # 'v1' elhagyva
+        if parts == ['threads'] and method == 'POST':
+            thread_id = self._id('thread')
+            self._threads[thread_id] = [self._message(thread_id, m['role'], m['content']) for m in body.get('messages', [])]
+            self.stats['threads'] += 1
+            return 200, {'id': thread_id, 'object': 'thread', 'created_at': int(time.time()), 'metadata': {}}
+        thread_id = parts[1]
+        if thread_id not in self._threads:
+            return 404, {'error': {'message': f'No thread found with id {thread_id}', 'type': 'invalid_request_error'}}
+        if len(parts) == 2 and method == 'DELETE':
+            del self._threads[thread_id]
+            return 200, {'id': thread_id, 'object': 'thread.deleted', 'deleted': True}
+        if parts[2] == 'messages':
+            if method == 'POST':
+                message = self._message(thread_id, body['role'], body['content'])
+                self._threads[thread_id].append(message)
+                return 200, message
+            data = list(reversed(self._threads[thread_id]))
+            return 200, {'object': 'list', 'data': data, 'first_id': data[0]['id'] if data else None,
+                         'last_id': data[-1]['id'] if data else None, 'has_more': False}
+        if parts[2] == 'runs':
+            if len(parts) == 3:
+                run_id = self._id('run')
+                self._runs[run_id] = {'thread_id': thread_id, 'assistant_id': body.get('assistant_id'),
+                                      'created': time.monotonic(), 'replied': False}
+                self.stats['runs'] += 1
+                return 200, dict(self._run(run_id), status='queued')
+            run_id = parts[3]
+            if len(parts) == 5 and parts[4] == 'cancel':
+                self._runs.pop(run_id, None)
+                return 200, {'id': run_id, 'object': 'thread.run', 'thread_id': thread_id, 'status': 'cancelled',
+                             'assistant_id': None, 'created_at': int(time.time()), 'instructions': '',
+                             'model': 'stub', 'tools': [], 'metadata': {}}
+            if run_id not in self._runs:
+                return 404, {'error': {'message': f'No run found with id {run_id}', 'type': 'invalid_request_error'}}
+            self.stats['retrieves'] += 1
+            return 200, self._run(run_id)
+        return 404, {'error': {'message': f'Unknown path {path}'}}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                await send({'type': message['type'].replace('.startup', '.startup.complete').replace('.shutdown', '.shutdown.complete')})
+                if message['type'] == 'lifespan.shutdown':
+                    return
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body', False):
+                break
+
+        path = scope['path']
+        if path.startswith('/plantuml/'):
+            await asyncio.sleep(self.render_latency)
+            self.stats['renders'] += 1
+            encoded = path.rsplit('/', 1)[-1]
+            payload = (f'<svg xmlns="http://www.w3.org/2000/svg" width="400" height="300">'
+                       f'<text x="10" y="20">{len(encoded)}</text></svg>').encode()
+            await self._respond(send, 200, payload, b'image/svg+xml')
+            return
+        if path == '/stats':
+            await self._respond(send, 200, json.dumps(self.stats).encode(), b'application/json')
+            return
+        if path.startswith('/v1/'):
+            status, payload = self.openai(scope['method'], path, json.loads(body) if body else {})
+            await self._respond(send, status, json.dumps(payload).encode(), b'application/json')
+            return
+        await self._respond(send, 404, b'{}', b'application/json')
+
+    @staticmethod
+    async def _respond(send, status, body, content_type):
+        await send({'type': 'http.response.start', 'status': status, 'headers': [
+            (b'content-type', content_type), (b'content-length', str(len(body)).encode()),
+        ]})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def install(app, backend):
+    """Az app.py aszinkron /chat útjának bekötése a csonkra, folyamaton belül (hálózat nélkül)"""
+    import httpx
+
+    transport = httpx.ASGITransport(app=backend)
+    app.async_clients.clear()
+    app.async_clients['openai'] = app.openai.AsyncOpenAI(api_key='bench', base_url='http://stub/v1',
+                                                         http_client=httpx.AsyncClient(transport=transport))
+    app.async_clients['http'] = httpx.AsyncClient(transport=transport)
+    app.create_openai_thread = lambda: backend.openai('POST', '/v1/threads', {})[1]['id']
+    app.diagram_renderer = app.RemoteRenderer('http://stub/plantuml')
+    app.ASSISTANT_ID = 'asst_bench'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--run-latency', type=float, default=0.5)
+    parser.add_argument('--render-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    import uvicorn
+    backend = StubBackend(args.run_latency, args.render_latency)
+    uvicorn.run(backend, host='127.0.0.1', port=args.port, log_level='warning', backlog=4096)
+
+
+if __name__ == '__main__':
+    main()
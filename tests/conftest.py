@@ -0,0 +1,15 @@
+import os
+import sys
+
+# Az app.py a munkakönyvtárhoz képest tölti be a logót és a betűtípusokat
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# A tesztek a bench/ csonkjait és mintáit is használják
+sys.path.insert(1, os.path.join(ROOT, 'bench'))
+os.chdir(ROOT)
+
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ.setdefault('IMAGE_WORKERS', '0')
+os.environ.setdefault('STATE_STORE', 'memory')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('LOG_FORMAT', 'text')
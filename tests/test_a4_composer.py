@@ -0,0 +1,105 @@
+from io import BytesIO
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+ImageChops = pytest.importorskip('PIL.ImageChops')
+
+import app
+
+# Kis SVG minta: egy kék téglalap, hogy a lapon a felirattól és a logótól elkülöníthető legyen
+SVG_FIXTURE = ('<svg xmlns="http://www.w3.org/2000/svg" width="{w}" height="{h}">'
+               '<rect width="{w}" height="{h}" fill="#0000ff"/></svg>')
+
+
+@pytest.fixture
+def composer(monkeypatch):
+    """Tiszta folyamatszintű példány, a létrehozások számlálásával"""
+    created = []
+
+    class CountingComposer(app.A4Composer):
+        def __init__(self):
+            created.append(self)
+            super().__init__()
+
+    monkeypatch.setattr(app, 'A4Composer', CountingComposer)
+    monkeypatch.setattr(app, 'a4_composer', None)
+    return created
+
+
+@pytest.fixture
+def rasterize():
+    """SVG raszterizálása cairóval; libcairo nélkül a teszt kimarad (mint a test_startup-ban)"""
+    try:
+        import cairosvg
+        cairosvg.svg2png(bytestring=SVG_FIXTURE.format(w=1, h=1).encode('utf-8'))
+    except Exception:
+        pytest.skip('az SVG raszterizáláshoz hiányzik a cairosvg vagy a libcairo')
+    return app.rasterize_svg
+
+
+def png_bytes(width, height):
+    output = BytesIO()
+    Image.new('RGB', (width, height), (0, 0, 255)).save(output, format='PNG')
+    return output.getvalue()
+
+
+def diagram_bbox(page):
+    """A kék diagram befoglaló téglalapja a kész lapon (JPEG zajjal számolva)"""
+    r, g, b = page.convert('RGB').split()
+    mask = ImageChops.multiply(
+        ImageChops.multiply(b.point(lambda v: 255 if v > 150 else 0), r.point(lambda v: 255 if v < 100 else 0)),
+        g.point(lambda v: 255 if v < 100 else 0),
+    )
+    return mask.getbbox()
+
+
+def assert_placed(jpeg_bytes, composer, limit):
+    page = Image.open(BytesIO(jpeg_bytes))
+    assert page.format == 'JPEG'
+    assert page.size == (app.A4_WIDTH, app.A4_HEIGHT)
+    assert page.width > page.height  # fekvő A4
+    assert page.info['dpi'] == pytest.approx((300, 300), abs=1)
+
+    left, top, right, bottom = diagram_bbox(page)
+    assert left >= composer.margin and right <= app.A4_WIDTH - composer.margin
+    assert top >= composer.diagram_top and bottom <= composer.diagram_top + composer.max_diagram_height
+    # Vízszintesen középre kerül
+    assert abs(left - (app.A4_WIDTH - right)) <= 2
+    # A szűkebb irányban kitölti a rendelkezésre álló helyet
+    if limit == 'height':
+        assert bottom - top == pytest.approx(composer.max_diagram_height, abs=3)
+        assert right - left < composer.max_diagram_width
+    else:
+        assert right - left == pytest.approx(composer.max_diagram_width, abs=3)
+        assert bottom - top < composer.max_diagram_height
+
+
+@pytest.mark.parametrize('size, limit', [((200, 800), 'height'), ((1600, 100), 'width')])
+def test_diagram_scaled_into_landscape_page(composer, size, limit):
+    jpeg_bytes, timings = app.compose_a4_jpeg(png_bytes(*size))
+
+    assert_placed(jpeg_bytes, app.get_a4_composer(), limit)
+    assert set(timings) == {'a4_compose', 'jpeg_encode'}
+
+
+@pytest.mark.parametrize('size, limit', [((120, 400), 'height'), ((600, 40), 'width')])
+def test_svg_fixture_composed(composer, rasterize, size, limit):
+    png = rasterize(SVG_FIXTURE.format(w=size[0], h=size[1]))
+    jpeg_bytes, _ = app.compose_a4_jpeg(png)
+
+    assert_placed(jpeg_bytes, app.get_a4_composer(), limit)
+
+
+def test_background_built_once_and_left_untouched(composer):
+    first, _ = app.compose_a4_jpeg(png_bytes(200, 800))
+    background = app.get_a4_composer().background.tobytes()
+    second, _ = app.compose_a4_jpeg(png_bytes(1600, 100))
+
+    assert len(composer) == 1
+    assert app.get_a4_composer() is composer[0]
+    # A hívások a háttér másolatára dolgoznak, az előző diagram nem marad a lapon
+    assert app.get_a4_composer().background.tobytes() == background
+    assert diagram_bbox(Image.open(BytesIO(second))) != diagram_bbox(Image.open(BytesIO(first)))
+    left, top, right, bottom = diagram_bbox(Image.open(BytesIO(second)))
+    assert bottom - top < app.get_a4_composer().max_diagram_height // 2
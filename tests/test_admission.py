@@ -0,0 +1,96 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import app
+
+
+def full_gate(max_waiting=8, max_wait=5.0):
+    gate = app.ConcurrencyGate('test', 1, max_waiting=max_waiting, max_wait=max_wait)
+    gate.acquire()
+    return gate
+
+
+def test_async_waiters_do_not_hold_executor_threads():
+    gate = full_gate()
+
+    async def scenario():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+        waiters = [asyncio.ensure_future(gate.acquire_async()) for _ in range(8)]
+        await asyncio.sleep(0.05)
+        # A beengedett kérés tároló hívása akkor is lefut, ha a sor tele van várakozókkal
+        assert await asyncio.wait_for(asyncio.to_thread(lambda: 'kész'), 1) == 'kész'
+        assert gate.waiting == 8
+        for _ in waiters:
+            gate.release()
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*waiters)
+
+    asyncio.run(scenario())
+    assert gate.in_flight == 1
+    assert gate.waiting == 0
+    assert gate.stats['waited'] == 8
+
+
+def test_async_waiters_are_woken_in_order_from_other_thread():
+    gate = full_gate()
+    order = []
+
+    async def waiter(name):
+        await gate.acquire_async()
+        order.append(name)
+
+    async def scenario():
+        tasks = []
+        for name in ('a', 'b', 'c'):
+            tasks.append(asyncio.ensure_future(waiter(name)))
+            await asyncio.sleep(0.01)
+        for _ in tasks:
+            releaser = threading.Thread(target=gate.release)
+            releaser.start()
+            releaser.join()
+            await asyncio.sleep(0.02)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert order == ['a', 'b', 'c']
+
+
+def test_async_wait_timeout_and_queue_full():
+    gate = full_gate(max_waiting=1, max_wait=0.05)
+
+    async def scenario():
+        first = asyncio.ensure_future(gate.acquire_async())
+        await asyncio.sleep(0)
+        with pytest.raises(app.AdmissionRejectedError) as rejected:
+            await gate.acquire_async()
+        assert rejected.value.reason == 'queue_full'
+        with pytest.raises(app.AdmissionRejectedError) as timed_out:
+            await first
+        assert timed_out.value.reason == 'wait_timeout'
+
+    asyncio.run(scenario())
+    assert gate.waiting == 0
+    assert gate.in_flight == 1
+    assert not gate._async_waiters
+
+
+def test_cancelled_waiter_passes_wakeup_on():
+    gate = full_gate()
+
+    async def scenario():
+        first = asyncio.ensure_future(gate.acquire_async())
+        second = asyncio.ensure_future(gate.acquire_async())
+        await asyncio.sleep(0.01)
+        # Az első megszakad, mielőtt a felé induló ébresztést feldolgozná
+        first.cancel()
+        gate.release()
+        await asyncio.wait_for(second, 1)
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    asyncio.run(scenario())
+    assert gate.in_flight == 1
+    assert gate.waiting == 0
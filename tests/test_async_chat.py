@@ -0,0 +1,142 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+httpx = pytest.importorskip('httpx')
+
+import app
+from stub_servers import StubBackend
+
+
+class ThreadRecordingStore(app.MemoryStateStore):
+    """Feljegyzi, melyik szálon hívták a tároló metódusait"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def _record(name):
+        def method(self, *args, **kwargs):
+            self.calls.append((name, threading.current_thread() is threading.main_thread()))
+            return getattr(app.MemoryStateStore, name)(self, *args, **kwargs)
+        return method
+
+    get_or_create_thread = _record('get_or_create_thread')
+    thread_context_chars = _record('thread_context_chars')
+    add_thread_context = _record('add_thread_context')
+    append_history = _record('append_history')
+    latest_history = _record('latest_history')
+    history = _record('history')
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """Az ASGI /chat csonk OpenAI és PlantUML szerverre kötve, hálózat nélkül"""
+    backend = StubBackend(run_latency=0.0, render_latency=0.0)
+    transport = httpx.ASGITransport(app=backend)
+    monkeypatch.setattr(app, 'async_clients', {
+        'openai': app.openai.AsyncOpenAI(api_key='test', base_url='http://stub/v1',
+                                         http_client=httpx.AsyncClient(transport=transport)),
+        'http': httpx.AsyncClient(transport=transport),
+    })
+    monkeypatch.setattr(app, 'create_openai_thread', lambda: backend.openai('POST', '/v1/threads', {})[1]['id'])
+    monkeypatch.setattr(app, 'diagram_renderer', app.RemoteRenderer('http://stub/plantuml'))
+    monkeypatch.setattr(app, 'ASSISTANT_ID', 'asst_test')
+    monkeypatch.setattr(app, 'RUN_POLL_INITIAL_DELAY', 0.01)
+    monkeypatch.setattr(app, 'state_store', ThreadRecordingStore())
+    monkeypatch.setattr(app, 'render_cache', app.RenderCache(max_entries=16))
+    # Saját tokenvödrök, hogy a korábbi tesztek kérései ne számítsanak bele
+    monkeypatch.setattr(app, 'session_limiter', app.TokenBucketLimiter('session', app.ADMISSION_SESSION_RATE, app.ADMISSION_SESSION_BURST))
+    monkeypatch.setattr(app, 'ip_limiter', app.TokenBucketLimiter('ip', app.ADMISSION_IP_RATE, app.ADMISSION_IP_BURST))
+    return backend
+
+
+def post_chat(body, session_id='asgi-smoke', headers=None):
+    async def call():
+        transport = httpx.ASGITransport(app=app.asgi_app, client=('127.0.0.1', 5000))
+        async with httpx.AsyncClient(transport=transport, base_url='http://app') as client:
+            request_headers = {'X-Session-ID': session_id} if session_id else {}
+            request_headers.update(headers or {})
+            return await client.post('/chat', content=json.dumps(body), headers=request_headers)
+    return asyncio.run(call())
+
+
+def test_chat_returns_svg_and_keeps_thread(stub):
+    first = post_chat({'message': 'Rendelés feldolgozása', 'format': 'svg', 'cache': False})
+    second = post_chat({'message': 'Legyen benne számlázás is', 'format': 'svg', 'cache': False})
+
+    assert first.status_code == 200, first.text
+    assert second.status_code == 200, second.text
+    assert first.json()['svg'].startswith('<svg')
+    assert first.json()['thread_id'] == second.json()['thread_id']
+    assert stub.stats == {'threads': 1, 'runs': 2, 'retrieves': 2, 'renders': 2}
+    history = app.state_store.history('asgi-smoke')
+    assert [entry.prompt for entry in history] == ['Rendelés feldolgozása', 'Legyen benne számlázás is']
+    assert history[-1].plantuml.startswith('@startuml')
+
+
+def test_state_store_not_called_on_event_loop(stub):
+    response = post_chat({'message': 'Rendelés feldolgozása', 'format': 'svg'})
+
+    assert response.status_code == 200, response.text
+    called = {name for name, _ in app.state_store.calls}
+    assert {'thread_context_chars', 'add_thread_context', 'append_history'} <= called
+    # Az event loop a fő szálon fut (asyncio.run), a tároló hívások munkaszálakon
+    assert [name for name, on_loop in app.state_store.calls if on_loop] == []
+
+
+def test_render_cache_not_called_on_event_loop(stub, monkeypatch, tmp_path):
+    calls = []
+
+    class RecordingRenderCache(app.RenderCache):
+        def get(self, *args, **kwargs):
+            calls.append(('get', threading.current_thread() is threading.main_thread()))
+            return super().get(*args, **kwargs)
+
+        def put(self, *args, **kwargs):
+            calls.append(('put', threading.current_thread() is threading.main_thread()))
+            return super().put(*args, **kwargs)
+
+    monkeypatch.setattr(app, 'render_cache', RecordingRenderCache(max_entries=16, disk_dir=str(tmp_path)))
+    response = post_chat({'message': 'Rendelés feldolgozása', 'format': 'svg', 'cache': False})
+
+    assert response.status_code == 200, response.text
+    assert {name for name, _ in calls} == {'get', 'put'}
+    assert [name for name, on_loop in calls if on_loop] == []
+
+
+def test_chat_requires_session(stub):
+    response = post_chat({'message': 'x', 'format': 'svg'}, session_id=None)
+    assert response.status_code == 401
+    assert stub.stats['runs'] == 0
+
+
+def test_chat_rejects_unknown_format(stub):
+    response = post_chat({'message': 'x', 'format': 'gif'}, session_id='asgi-format')
+    assert response.status_code == 400
+    assert 'gif' in response.json()['error']
+    assert stub.stats['runs'] == 0
+
+
+def test_chat_rejects_non_scalar_dpi(stub):
+    response = post_chat({'message': 'x', 'format': 'png', 'dpi': [300]}, session_id='asgi-dpi')
+    assert response.status_code == 400
+    assert stub.stats['runs'] == 0
+
+
+def test_gate_rejection_refunds_rate_tokens(stub, monkeypatch):
+    gate = app.ConcurrencyGate('chat', 1, max_waiting=0)
+    monkeypatch.setattr(app, 'chat_gate', gate)
+    gate.in_flight = 1
+
+    for _ in range(app.ADMISSION_SESSION_BURST + 1):
+        response = post_chat({'message': 'x', 'format': 'svg'}, session_id='asgi-gate')
+        assert response.status_code == 429
+    assert gate.stats['queue_full'] == app.ADMISSION_SESSION_BURST + 1
+
+    gate.in_flight = 0
+    response = post_chat({'message': 'Rendelés feldolgozása', 'format': 'svg'}, session_id='asgi-gate')
+    assert response.status_code == 200, response.text
+    assert app.session_limiter.stats['admitted'] == 1
@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    """A job API a Flask test clienttel; a pipeline csonk szakaszokat jelent és kérésre blokkol"""
+    state = {'release': threading.Event(), 'calls': []}
+    state['release'].set()
+
+    def run_chat_pipeline(session_id, user_message, on_stage=None, output_format='png', dpi=300, preview=None,
+                          use_cache=True):
+        state['calls'].append((session_id, user_message, output_format))
+        on_stage('assistant-running')
+        assert state['release'].wait(5)
+        on_stage('rendering')
+        return 'thread_1', {'svg': '<svg/>', 'format': output_format, 'diagram_id': 'abc'}
+
+    monkeypatch.setattr(app, 'run_chat_pipeline', run_chat_pipeline)
+    monkeypatch.setattr(app, 'chat_jobs', {})
+    monkeypatch.setattr(app, 'chat_job_stats', {'submitted': 0, 'rejected': 0, 'done': 0, 'failed': 0, 'stage_totals': {}})
+    monkeypatch.setattr(app, 'chat_job_executor', ThreadPoolExecutor(max_workers=2))
+    monkeypatch.setattr(app, 'CHAT_PREVIEWS', False)
+    monkeypatch.setattr(app, 'session_limiter', app.TokenBucketLimiter('session', app.ADMISSION_SESSION_RATE, app.ADMISSION_SESSION_BURST))
+    monkeypatch.setattr(app, 'ip_limiter', app.TokenBucketLimiter('ip', app.ADMISSION_IP_RATE, app.ADMISSION_IP_BURST))
+    state['client'] = app.app.test_client()
+    yield state
+    state['release'].set()
+    app.chat_job_executor.shutdown(wait=True)
+
+
+def submit(jobs, session_id='s1', **body):
+    return jobs['client'].post('/chat/jobs', json=dict({'message': 'Rendelés', 'format': 'svg'}, **body),
+                               headers={'X-Session-ID': session_id})
+
+
+def wait_for_stage(jobs, job_id, stages, session_id='s1'):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        view = jobs['client'].get(f'/chat/jobs/{job_id}', headers={'X-Session-ID': session_id}).get_json()
+        if view['stage'] in stages:
+            return view
+        time.sleep(0.01)
+    raise AssertionError(f'a job nem érte el: {stages}')
+
+
+def test_submit_and_poll_until_done(jobs):
+    response = submit(jobs)
+
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+    view = wait_for_stage(jobs, job_id, ('done',))
+    assert view['svg'] == '<svg/>'
+    assert view['thread_id'] == 'thread_1'
+    assert {'queued', 'assistant-running', 'rendering'} <= set(view['stage_times'])
+    assert jobs['calls'] == [('s1', 'Rendelés', 'svg')]
+
+    stats = jobs['client'].get('/chat/jobs/stats').get_json()
+    assert stats['submitted'] == 1 and stats['done'] == 1
+    assert set(stats['avg_stage_seconds']) == {'queued', 'assistant-running', 'rendering'}
+
+
+def test_job_is_private_to_session(jobs):
+    job_id = submit(jobs).get_json()['job_id']
+
+    assert jobs['client'].get(f'/chat/jobs/{job_id}', headers={'X-Session-ID': 'masik'}).status_code == 404
+    assert jobs['client'].get(f'/chat/jobs/{job_id}/events?session_id=masik').status_code == 404
+    assert jobs['client'].get('/chat/jobs/ismeretlen', headers={'X-Session-ID': 's1'}).status_code == 404
+
+
+def test_invalid_requests(jobs):
+    assert jobs['client'].post('/chat/jobs', json={'message': 'x'}).status_code == 401
+    assert submit(jobs, format='gif').status_code == 400
+    assert jobs['calls'] == []
+
+
+def test_event_stream_reports_stages(jobs):
+    jobs['release'].clear()
+    job_id = submit(jobs).get_json()['job_id']
+    wait_for_stage(jobs, job_id, ('assistant-running',))
+    jobs['release'].set()
+
+    response = jobs['client'].get(f'/chat/jobs/{job_id}/events?session_id=s1')
+    events = []
+    for chunk in response.response:
+        text = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if text.startswith('event: '):
+            event, data = text.strip().split('\n')
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+
+    assert response.mimetype == 'text/event-stream'
+    assert all(event == 'stage' for event, _ in events)
+    assert events[-1][1]['stage'] == 'done'
+    assert events[-1][1]['svg'] == '<svg/>'
+
+
+def test_full_queue_is_rejected_with_429(jobs, monkeypatch):
+    monkeypatch.setattr(app, 'CHAT_JOB_WORKERS', 1)
+    monkeypatch.setattr(app, 'CHAT_JOB_MAX_QUEUE', 1)
+    jobs['release'].clear()
+    accepted = [submit(jobs, session_id=f's{index}') for index in range(2)]
+
+    rejected = submit(jobs, session_id='s9')
+
+    assert [response.status_code for response in accepted] == [202, 202]
+    assert rejected.status_code == 429
+    assert int(rejected.headers['Retry-After']) >= 1
+    assert app.chat_job_stats['rejected'] == 1
+    # A tele sor miatti elutasítás nem fogyasztja a kliens keretét
+    assert app.session_limiter.stats['admitted'] == 2
+
+    jobs['release'].set()
+    for index, response in enumerate(accepted):
+        wait_for_stage(jobs, response.get_json()['job_id'], ('done',), session_id=f's{index}')
+    assert submit(jobs, session_id='s9').status_code == 202
+
+
+def test_finished_jobs_expire_after_ttl(jobs, monkeypatch):
+    job_id = submit(jobs).get_json()['job_id']
+    wait_for_stage(jobs, job_id, ('done',))
+    monkeypatch.setattr(app, 'CHAT_JOB_TTL', 60)
+
+    app.cleanup_chat_jobs()
+    assert job_id in app.chat_jobs
+    app.chat_jobs[job_id]['finished_at'] -= 61
+    app.cleanup_chat_jobs()
+
+    assert job_id not in app.chat_jobs
+    assert jobs['client'].get(f'/chat/jobs/{job_id}', headers={'X-Session-ID': 's1'}).status_code == 404
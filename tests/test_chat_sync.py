@@ -0,0 +1,62 @@
+import gzip
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """A szinkron /chat válaszformázása asszisztens és renderelés nélkül"""
+    calls = []
+
+    def run_chat_pipeline(session_id, user_message, output_format, dpi, use_cache):
+        calls.append((output_format, dpi))
+        if output_format == 'svg':
+            return 'thread_1', {'svg': '<svg>' + '<g/>' * 2000 + '</svg>', 'format': 'svg'}
+        return 'thread_1', {'image': 'data:image/png;base64,' + 'iVBORw0KGgo' * 500, 'format': output_format}
+
+    monkeypatch.setattr(app, 'run_chat_pipeline', run_chat_pipeline)
+    # Saját tokenvödrök, hogy a korábbi tesztek kérései ne számítsanak bele
+    monkeypatch.setattr(app, 'session_limiter', app.TokenBucketLimiter('session', app.ADMISSION_SESSION_RATE, app.ADMISSION_SESSION_BURST))
+    monkeypatch.setattr(app, 'ip_limiter', app.TokenBucketLimiter('ip', app.ADMISSION_IP_RATE, app.ADMISSION_IP_BURST))
+    return calls
+
+
+def post_chat(body, session_id):
+    return app.app.test_client().post('/chat', json=body,
+                                      headers={'X-Session-ID': session_id, 'Accept-Encoding': 'gzip'})
+
+
+@pytest.mark.parametrize('dpi', [[300], {'value': 300}])
+def test_non_scalar_dpi_is_bad_request(pipeline, dpi):
+    response = post_chat({'message': 'x', 'format': 'png', 'dpi': dpi}, session_id=f'sync-dpi-{type(dpi).__name__}')
+
+    assert response.status_code == 400
+    assert 'DPI' in response.get_json()['error']
+    assert pipeline == []
+
+
+def test_only_svg_response_is_gzipped(pipeline):
+    svg = post_chat({'message': 'x', 'format': 'svg'}, session_id='sync-svg')
+    png = post_chat({'message': 'x', 'format': 'png'}, session_id='sync-png')
+
+    assert svg.headers.get('Content-Encoding') == 'gzip'
+    assert b'<svg>' in gzip.decompress(svg.get_data())
+    assert 'Content-Encoding' not in png.headers
+    assert png.get_json()['format'] == 'png'
+
+
+def test_gate_rejection_refunds_rate_tokens(pipeline, monkeypatch):
+    gate = app.ConcurrencyGate('chat', 1, max_waiting=0)
+    monkeypatch.setattr(app, 'chat_gate', gate)
+    gate.in_flight = 1
+
+    for _ in range(app.ADMISSION_SESSION_BURST + 1):
+        assert post_chat({'message': 'x', 'format': 'svg'}, session_id='sync-gate').status_code == 429
+    assert gate.stats['queue_full'] == app.ADMISSION_SESSION_BURST + 1
+
+    gate.in_flight = 0
+    assert post_chat({'message': 'x', 'format': 'svg'}, session_id='sync-gate').status_code == 200
+    assert gate.in_flight == 0
+    assert app.session_limiter.stats['admitted'] == 1
@@ -0,0 +1,73 @@
+import app
+
+DIAGRAM = '@startuml\nstart\n:Lépés;\nstop\n@enduml'
+
+
+def entry_size(index=0):
+    return app.HistoryEntry(f'kérés {index}', DIAGRAM).size
+
+
+def prompts(history, session_id):
+    return [entry.prompt for entry in history.entries(session_id)]
+
+
+def test_session_entry_limit_keeps_newest():
+    history = app.ConversationHistory(session_max_entries=3, session_max_bytes=10 ** 6, max_bytes=10 ** 7)
+    for index in range(5):
+        history.append('s1', f'kérés {index}', DIAGRAM)
+
+    assert prompts(history, 's1') == ['kérés 2', 'kérés 3', 'kérés 4']
+    assert history.latest('s1').prompt == 'kérés 4'
+    assert history.evictions == 2
+    assert history.bytes_held == 3 * entry_size()
+
+
+def test_session_byte_limit_keeps_newest():
+    history = app.ConversationHistory(session_max_entries=100, session_max_bytes=2 * entry_size() + 1,
+                                      max_bytes=10 ** 7)
+    for index in range(4):
+        history.append('s1', f'kérés {index}', DIAGRAM)
+    # Egyetlen, a keretnél nagyobb lépés is megmarad: az aktuális diagram nem veszhet el
+    history.append('s2', 'óriás', DIAGRAM * 1000)
+
+    assert prompts(history, 's1') == ['kérés 2', 'kérés 3']
+    assert prompts(history, 's2') == ['óriás']
+
+
+def test_global_budget_evicts_least_recently_active_session_first():
+    history = app.ConversationHistory(session_max_entries=100, session_max_bytes=10 ** 6,
+                                      max_bytes=5 * entry_size() + 1)
+    history.append('régi', 'kérés 0', DIAGRAM)
+    history.append('régi', 'kérés 1', DIAGRAM)
+    history.append('aktív', 'kérés 2', DIAGRAM)
+    history.append('aktív', 'kérés 3', DIAGRAM)
+    history.append('régi', 'kérés 4', DIAGRAM)  # a 'régi' újra aktív lett
+    history.append('új', 'kérés 5', DIAGRAM)
+    history.append('új', 'kérés 6', DIAGRAM)
+
+    # Az 'aktív' a legrégebben használt: a legrégebbi lépései esnek ki először
+    assert 'aktív' not in history
+    assert prompts(history, 'régi') == ['kérés 0', 'kérés 1', 'kérés 4']
+    assert prompts(history, 'új') == ['kérés 5', 'kérés 6']
+    assert history.bytes_held == 5 * entry_size()
+    assert history.memory_report() == {'sessions': 2, 'entries': 5, 'history_bytes': 5 * entry_size(),
+                                       'history_evictions': 2}
+
+
+def test_global_budget_keeps_last_session():
+    history = app.ConversationHistory(session_max_entries=100, session_max_bytes=10 ** 6, max_bytes=1)
+    history.append('s1', 'kérés 0', DIAGRAM)
+    history.append('s2', 'kérés 1', DIAGRAM)
+
+    assert 's1' not in history
+    assert prompts(history, 's2') == ['kérés 1']
+
+
+def test_pop_releases_bytes():
+    history = app.ConversationHistory(session_max_entries=10, session_max_bytes=10 ** 6, max_bytes=10 ** 7)
+    history.append('s1', 'kérés 0', DIAGRAM)
+    history.append('s2', 'kérés 1', DIAGRAM)
+
+    assert [entry.prompt for entry in history.pop('s1')] == ['kérés 0']
+    assert history.pop('s1') is None
+    assert history.bytes_held == entry_size()
@@ -0,0 +1,105 @@
+import pytest
+
+import app
+
+DIAGRAM = '@startuml\nstart\n:Rendelés;\nstop\n@enduml'
+
+
+class FakeRenderer:
+    name = 'fake'
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    def render_svg(self, plantuml_code):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return '<svg xmlns="http://www.w3.org/2000/svg"><text>Rendelés</text></svg>'
+
+
+@pytest.fixture
+def diagram(monkeypatch):
+    """/diagram kérések csonk rendererrel; a raszterizálás csak feljegyzi a paramétereit"""
+    rasterized = []
+    store = app.MemoryStateStore()
+    store.append_history('s1', 'Rendelés', DIAGRAM)
+    renderer = FakeRenderer()
+
+    def run_in_image_pool(func, svg_text, dpi, width):
+        rasterized.append((dpi, width))
+        return b'\x89PNG' + f'{dpi}/{width}'.encode()
+
+    monkeypatch.setattr(app, 'state_store', store)
+    monkeypatch.setattr(app, 'diagram_renderer', renderer)
+    monkeypatch.setattr(app, 'renderer_breaker', app.CircuitBreaker('plantuml'))
+    monkeypatch.setattr(app, 'render_cache', app.RenderCache(max_entries=16))
+    monkeypatch.setattr(app, 'run_in_image_pool', run_in_image_pool)
+    errors = []
+    monkeypatch.setattr(app, 'send_error_email', lambda *args, **kwargs: errors.append(kwargs))
+    return {'renderer': renderer, 'rasterized': rasterized, 'errors': errors}
+
+
+def get_diagram(query='', session_id='s1'):
+    headers = {'X-Session-ID': session_id} if session_id else {}
+    return app.app.test_client().get(f'/diagram{query}', headers=headers)
+
+
+def test_svg(diagram):
+    response = get_diagram('?format=svg')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'image/svg+xml'
+    assert b'Rendel' in response.get_data()
+    assert diagram['rasterized'] == []
+
+
+def test_png_with_dpi_and_thumbnail(diagram):
+    png = get_diagram('?format=png&dpi=150')
+    again = get_diagram('?format=png&dpi=150')
+    thumbnail = get_diagram('?format=thumbnail')
+
+    assert png.mimetype == 'image/png'
+    assert png.get_data() == again.get_data() == b'\x89PNG150/None'
+    assert thumbnail.get_data() == b'\x89PNG' + f'{app.RASTER_DEFAULT_DPI}/{app.THUMBNAIL_WIDTH}'.encode()
+    # Az ismételt kérés és a bélyegkép a cache-elt SVG-ből dolgozik
+    assert diagram['rasterized'] == [(150, None), (app.RASTER_DEFAULT_DPI, app.THUMBNAIL_WIDTH)]
+    assert diagram['renderer'].calls == 1
+
+
+@pytest.mark.parametrize('query', ['?format=gif', '?dpi=10', '?dpi=9000', '?dpi=sok', '?entry=x'])
+def test_invalid_options(diagram, query):
+    response = get_diagram(query)
+
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+    assert diagram['renderer'].calls == 0
+
+
+def test_missing_session_and_unknown_diagram(diagram):
+    assert get_diagram(session_id=None).status_code == 401
+    assert get_diagram('?entry=5').status_code == 404
+    assert get_diagram('?diagram_id=ismeretlen').status_code == 404
+    assert get_diagram(f'?format=svg&diagram_id={app.diagram_id(DIAGRAM)}').status_code == 200
+
+
+def test_renderer_error_is_json_500(diagram):
+    diagram['renderer'].error = TimeoutError('PlantUML timeout')
+
+    response = get_diagram('?format=svg')
+
+    assert response.status_code == 500
+    assert response.get_json() == {'error': 'PlantUML timeout'}
+    assert diagram['errors'] == [{'endpoint': '/diagram', 'session_id': 's1'}]
+
+
+def test_send_email_rejects_non_scalar_entry(monkeypatch):
+    monkeypatch.setattr(app, 'send_error_email', lambda *args, **kwargs: None)
+    response = app.app.test_client().post(
+        '/send-email', json={'name': 'Teszt Elek', 'email': 'teszt@example.com', 'entry': [0]},
+        headers={'X-Session-ID': 's1'},
+    )
+
+    assert response.status_code == 400
+    assert 'entry' in response.get_json()['error']
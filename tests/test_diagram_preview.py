@@ -0,0 +1,106 @@
+import pytest
+
+import app
+
+
+class ManualExecutor:
+    """A preview_executor helyett: a renderelés csak kérésre fut, így a köztes állapot vizsgálható"""
+
+    def __init__(self):
+        self.pending = []
+
+    def submit(self, func, *args):
+        self.pending.append((func, args))
+
+    def run_all(self):
+        pending, self.pending = self.pending, []
+        for func, args in pending:
+            func(*args)
+
+
+class FakeRenderer:
+    def __init__(self):
+        self.rendered = []
+        self.error = None
+
+    def render_svg(self, plantuml_code):
+        if self.error is not None:
+            raise self.error
+        self.rendered.append(plantuml_code)
+        return f'<svg>{len(self.rendered)}</svg>'
+
+
+@pytest.fixture
+def preview(monkeypatch):
+    now = [100.0]
+    executor = ManualExecutor()
+    renderer = FakeRenderer()
+    monkeypatch.setattr(app.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(app, 'preview_executor', executor)
+    monkeypatch.setattr(app, 'diagram_renderer', renderer)
+    monkeypatch.setattr(app, 'renderer_breaker', app.CircuitBreaker('plantuml', failure_threshold=2))
+    monkeypatch.setattr(app, 'preview_breaker', app.CircuitBreaker('plantuml_preview', failure_threshold=2))
+    texts, previews = [], []
+    diagram_preview = app.DiagramPreview(lambda attempt, text: texts.append((attempt, text)), previews.append,
+                                         min_interval=1.0)
+    return {'preview': diagram_preview, 'now': now, 'executor': executor, 'renderer': renderer,
+            'texts': texts, 'previews': previews}
+
+
+def test_renders_complete_prefix_once_per_interval(preview):
+    diagram_preview, executor = preview['preview'], preview['executor']
+
+    diagram_preview.feed('@startuml\nstart\n:Rendelés')
+    assert len(executor.pending) == 1
+    diagram_preview.feed(' rögzítése;\n')
+    assert len(executor.pending) == 1  # egyszerre csak egy előnézet készül
+
+    executor.run_all()
+    diagram_preview.feed(':Számlázás;\n')
+    assert executor.pending == []  # min_interval még nem telt le
+    preview['now'][0] += 1.0
+    diagram_preview.feed(':Lezárás;\n')
+    executor.run_all()
+
+    assert preview['previews'] == ['<svg>1</svg>', '<svg>2</svg>']
+    first, second = preview['renderer'].rendered
+    # A félbehagyott utolsó sor kimarad, a hiányzó @enduml pótlódik
+    assert 'Rendelés' not in first and first.rstrip().endswith('@enduml')
+    assert ':Rendelés rögzítése;' in second and ':Lezárás;' in second
+    assert preview['texts'][-1] == (0, '@startuml\nstart\n:Rendelés rögzítése;\n:Számlázás;\n:Lezárás;\n')
+
+
+def test_open_block_is_not_previewed(preview):
+    preview['preview'].feed('@startuml\nstart\nif (Raktáron?) then (igen)\n:Kiszállítás;\n')
+    assert preview['executor'].pending == []
+
+    preview['preview'].feed('endif\n')
+    assert len(preview['executor'].pending) == 1
+
+
+def test_reset_and_close_drop_stale_previews(preview):
+    diagram_preview, executor = preview['preview'], preview['executor']
+    diagram_preview.feed('@startuml\nstart\n:Első próbálkozás;\n')
+    diagram_preview.reset()
+    executor.run_all()
+    assert preview['previews'] == []
+
+    # Az új kísérlet elölről kezdi, a régi render nem tartja foglaltan
+    diagram_preview.feed('@startuml\nstart\n:Második próbálkozás;\n')
+    assert preview['texts'][-1][0] == 1
+    diagram_preview.close()
+    executor.run_all()
+    assert preview['previews'] == []
+
+
+def test_preview_failures_do_not_open_render_breaker(preview):
+    diagram_preview, executor = preview['preview'], preview['executor']
+    preview['renderer'].error = TimeoutError('lassú')
+    for index in range(3):
+        preview['now'][0] += 1.0
+        diagram_preview.feed(f':Lépés {index};\n' if index else '@startuml\nstart\n:Lépés 0;\n')
+        executor.run_all()
+
+    assert preview['previews'] == []
+    assert app.preview_breaker.state == 'open'
+    assert app.renderer_breaker.state == 'closed'
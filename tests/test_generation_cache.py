@@ -0,0 +1,125 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+DIAGRAM = '@startuml\nstart\n:Rendelés;\nstop\n@enduml'
+
+
+@pytest.fixture
+def generation(monkeypatch):
+    """generate_plantuml_cached csonk asszisztenssel; a leader addig vár, amíg a többiek be nem sorolnak"""
+    cache = app.GenerationCache(max_entries=8, ttl=60)
+    state = {'calls': [], 'release': threading.Event(), 'error': None, 'appended': []}
+
+    def generate(user_message, session_id, budget, preview=None):
+        state['calls'].append(session_id)
+        assert state['release'].wait(5)
+        if state['error'] is not None:
+            raise state['error']
+        return f'thread-{session_id}', DIAGRAM
+
+    monkeypatch.setattr(app, 'generation_cache', cache)
+    monkeypatch.setattr(app, 'GENERATION_CACHE_SIZE', 8)
+    monkeypatch.setattr(app, 'state_store', app.MemoryStateStore())
+    monkeypatch.setattr(app, 'generate_plantuml_with_assistant', generate)
+    monkeypatch.setattr(app, 'get_or_create_thread', lambda session_id: f'thread-{session_id}')
+    monkeypatch.setattr(app, 'append_cached_exchange', lambda *args: state['appended'].append(args[0]))
+    state['cache'] = cache
+    return state
+
+
+def generate_concurrently(generation, count, message='Rendelés feldolgozása'):
+    results = [None] * count
+
+    def worker(index):
+        try:
+            results[index] = app.generate_plantuml_cached(message, f's{index}', app.RetryBudget(deadline=5))
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while generation['cache'].stats['coalesced'] < count - 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    generation['release'].set()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_concurrent_identical_requests_run_once(generation):
+    results = generate_concurrently(generation, 8)
+
+    assert len(generation['calls']) == 1
+    assert all(result[1] == DIAGRAM for result in results)
+    assert generation['cache'].stats['coalesced'] == 7
+    # A követők a saját thread-jükhöz fűzik a választ
+    assert sorted(generation['appended'] + generation['calls']) == sorted(f's{index}' for index in range(8))
+
+
+def test_leader_failure_makes_followers_run_themselves(generation):
+    generation['error'] = RuntimeError('asszisztens hiba')
+
+    results = generate_concurrently(generation, 3)
+
+    assert sum(isinstance(result, RuntimeError) for result in results) == 3
+    assert len(generation['calls']) == 3
+    assert generation['cache'].lookup(app.GenerationCache.key_for('Rendelés feldolgozása', '')) is None
+
+
+def test_leader_circuit_open_propagates_without_new_runs(generation):
+    generation['error'] = app.CircuitOpenError('openai', 10)
+
+    results = generate_concurrently(generation, 3)
+
+    assert all(isinstance(result, app.CircuitOpenError) for result in results)
+    assert len(generation['calls']) == 1
+
+
+def test_cached_result_and_ttl(generation, monkeypatch):
+    generation['release'].set()
+    now = [100.0]
+    monkeypatch.setattr(app.time, 'monotonic', lambda: now[0])
+    budget = app.RetryBudget(deadline=5)
+
+    first = app.generate_plantuml_cached('Rendelés', 's1', budget)
+    second = app.generate_plantuml_cached('  rendelés. ', 's2', budget)
+    now[0] += 61
+    third = app.generate_plantuml_cached('Rendelés', 's3', budget)
+
+    assert first == ('thread-s1', DIAGRAM, second[2])
+    assert second == ('thread-s2', DIAGRAM, first[2])
+    assert generation['calls'] == ['s1', 's3']
+    assert third[2] == first[2]
+    assert generation['cache'].stats['expired'] == 1
+
+
+def test_key_normalization_and_base_diagram():
+    key = app.GenerationCache.key_for
+
+    assert key('Beszerzési  folyamat.', '') == key('beszerzési folyamat', '')
+    assert key('Beszerzési folyamat!', DIAGRAM) == key('beszerzési folyamat', DIAGRAM + '\n')
+    assert key('Beszerzési folyamat', '') != key('Beszerzési folyamat', DIAGRAM)
+    assert key('Beszerzési folyamat', '') != key('Értékesítési folyamat', '')
+
+
+def test_lru_eviction_and_invalidate():
+    cache = app.GenerationCache(max_entries=2, ttl=60)
+    for key in ('a', 'b'):
+        future, leader = cache.begin(key)
+        assert leader
+        cache.finish(key, future, f'kód-{key}')
+    assert cache.lookup('a') == 'kód-a'
+    future, _ = cache.begin('c')
+    cache.finish('c', future, 'kód-c')
+
+    assert cache.lookup('b') is None
+    assert cache.lookup('a') == 'kód-a'
+    cache.invalidate('a')
+    assert cache.lookup('a') is None
+    assert cache.stats['evictions'] == 1
@@ -0,0 +1,53 @@
+import concurrent.futures
+import os
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def image_pool(monkeypatch):
+    monkeypatch.setattr(app, 'IMAGE_WORKERS', 1)
+    monkeypatch.setattr(app, 'PLANTUML_RENDER_TIMEOUT', 1.0)
+    monkeypatch.setattr(app, 'image_executor', None)
+    yield
+    if app.image_executor is not None:
+        app.reset_image_executor(app.image_executor, kill=True)
+
+
+def wait_until_gone(pid, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_stuck_worker_killed_and_pool_replaced(image_pool):
+    worker_pid = app.run_in_image_pool(os.getpid)
+    stuck = app.image_executor
+
+    with pytest.raises(concurrent.futures.TimeoutError):
+        app.run_in_image_pool(time.sleep, 60)
+
+    assert app.image_executor is None
+    assert stuck not in app.image_worker_pids
+    assert wait_until_gone(worker_pid)
+    # A következő hívás új készletet indít
+    assert app.run_in_image_pool(os.getpid) not in (worker_pid, os.getpid())
+
+
+def test_reset_without_kill_leaves_workers_to_shutdown(image_pool):
+    worker_pid = app.run_in_image_pool(os.getpid)
+    executor = app.image_executor
+
+    app.reset_image_executor(executor)
+
+    assert app.image_executor is None
+    assert executor not in app.image_worker_pids
+    assert wait_until_gone(worker_pid)
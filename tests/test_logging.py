@@ -0,0 +1,84 @@
+import json
+import logging
+import queue
+
+import app
+
+
+def make_record(msg='üzenet', level=logging.INFO, args=None, **extra):
+    record = logging.LogRecord('app', level, __file__, 1, msg, args, None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+
+def test_sampling_filter_limits_per_key(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(app.time, 'monotonic', lambda: now[0])
+    sampling = app.SamplingFilter(rate=1)
+
+    assert sampling.filter(make_record(sample_key='poll'))
+    assert not sampling.filter(make_record(sample_key='poll'))
+    assert not sampling.filter(make_record(sample_key='poll'))
+    assert sampling.filter(make_record(sample_key='other'))
+    now[0] += 1.5
+    passed = make_record(sample_key='poll')
+    assert sampling.filter(passed)
+    assert passed.suppressed == 2
+
+
+def test_sampling_filter_keeps_warnings_and_untagged_records():
+    sampling = app.SamplingFilter(rate=1)
+
+    assert sampling.filter(make_record(sample_key='k'))
+    assert sampling.filter(make_record(level=logging.WARNING, sample_key='k'))
+    assert sampling.filter(make_record())
+    assert sampling.filter(make_record())
+
+
+def test_truncate_replaces_base64_and_cuts_long_text():
+    data_url = 'data:image/png;base64,' + 'A' * 500
+    assert app.truncate_log_text(f'kép: {data_url}') == 'kép: data:image/png;base64,<500 karakter>'
+    assert app.truncate_log_text('x' * 30, limit=10) == 'x' * 10 + '… (+20 karakter)'
+
+
+def test_json_formatter_merges_fields():
+    record = make_record('Kérés %s', args=('vége',), trace_id='abc', fields={'duration_ms': 12.5, 'path': '/chat'},
+                         suppressed=3)
+
+    line = app.JsonLogFormatter().format(record)
+    entry = json.loads(line)
+
+    assert '\n' not in line
+    assert entry['msg'] == 'Kérés vége'
+    assert entry['trace_id'] == 'abc'
+    assert entry['level'] == 'INFO'
+    assert entry['duration_ms'] == 12.5
+    assert entry['path'] == '/chat'
+    assert entry['suppressed'] == 3
+
+
+def test_text_formatter_appends_fields():
+    record = make_record('Kérés vége', trace_id='abc', fields={'status': 200})
+
+    line = app.TextLogFormatter().format(record)
+
+    assert line.endswith('INFO [abc] app: Kérés vége {"status": 200}')
+
+
+def test_queue_handler_defers_formatting():
+    log_queue = queue.SimpleQueue()
+    handler = app.DeferredQueueHandler(log_queue)
+    record = make_record('érték: %s', args=(['nagy', 'objektum'],))
+
+    handler.emit(record)
+
+    queued = log_queue.get_nowait()
+    assert queued is record
+    assert queued.msg == 'érték: %s'
+    assert queued.args == (['nagy', 'objektum'],)
+
+
+def test_subsystem_levels_applied():
+    for name in ('httpx', 'httpcore', 'openai', 'urllib3'):
+        assert logging.getLogger(name).level == logging.WARNING
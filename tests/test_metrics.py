@@ -0,0 +1,76 @@
+import re
+
+import pytest
+
+import app
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = app.LatencyHistogram('test_seconds', 'teszt', 'stage', buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe('a', seconds)
+
+    lines = histogram.render()
+
+    assert lines[:2] == ['# HELP test_seconds teszt', '# TYPE test_seconds histogram']
+    assert lines[2:] == [
+        'test_seconds_bucket{stage="a",le="0.1"} 2',
+        'test_seconds_bucket{stage="a",le="1.0"} 3',
+        'test_seconds_bucket{stage="a",le="+Inf"} 4',
+        'test_seconds_sum{stage="a"} 2.650000',
+        'test_seconds_count{stage="a"} 4',
+    ]
+
+
+def test_timed_stage_records_trace_and_histogram_on_error(monkeypatch):
+    histogram = app.LatencyHistogram('test_seconds', 'teszt', 'stage')
+    monkeypatch.setattr(app, 'stage_latency', histogram)
+    trace = app.start_trace('trace-1')
+    try:
+        with pytest.raises(ZeroDivisionError):
+            with app.timed_stage('normalize'):
+                1 / 0
+        with app.timed_stage('normalize'):
+            pass
+    finally:
+        app.request_trace.set(None)
+
+    assert 'normalize' in trace['stages']
+    assert histogram.render()[-1] == 'test_seconds_count{stage="normalize"} 2'
+
+
+def test_timed_stage_without_trace():
+    assert app.request_trace.get() is None
+    with app.timed_stage('metrics_test_untraced'):
+        pass
+    assert any('stage="metrics_test_untraced"' in line for line in app.stage_latency.render())
+
+
+def test_trace_id_from_header_is_truncated():
+    response = app.app.test_client().get('/metrics', headers={'X-Request-ID': 'x' * 100})
+
+    assert response.headers['X-Trace-ID'] == 'x' * 64
+
+
+def test_generated_trace_ids_are_unique():
+    client = app.app.test_client()
+    trace_ids = {client.get('/metrics').headers['X-Trace-ID'] for _ in range(5)}
+
+    assert len(trace_ids) == 5
+
+
+def test_metrics_endpoint_exposes_stages_and_requests():
+    client = app.app.test_client()
+    client.get('/metrics')
+    with app.timed_stage('metrics_test_stage'):
+        pass
+
+    response = client.get('/metrics')
+    body = response.get_data(as_text=True)
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert 'xflower_stage_seconds_count{stage="metrics_test_stage"} 1' in body
+    assert re.search(r'^xflower_request_seconds_count\{endpoint="/metrics"\} \d+$', body, re.MULTILINE)
+    for name in ('xflower_circuit_open', 'xflower_admission_in_flight', 'xflower_assistant_run_wait_seconds_total'):
+        assert f'# TYPE {name} ' in body
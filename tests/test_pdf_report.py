@@ -0,0 +1,67 @@
+import os
+import re
+from io import BytesIO
+
+import pytest
+
+import app
+
+fpdf = pytest.importorskip('fpdf')
+if not hasattr(fpdf, 'XPos'):
+    pytest.skip('a jelentéshez fpdf2 kell (a régi pyfpdf 1.7 nem elég)', allow_module_level=True)
+Image = pytest.importorskip('PIL.Image')
+
+
+def png_bytes(width, height, color='white'):
+    output = BytesIO()
+    Image.new('RGB', (width, height), color).save(output, format='PNG')
+    return output.getvalue()
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = app.MemoryStateStore()
+    monkeypatch.setattr(app, 'state_store', store)
+    return store
+
+
+def page_count(pdf_bytes):
+    return len(re.findall(rb'/Type\s*/Page\b', pdf_bytes))
+
+
+def test_report_has_one_page_per_entry(store, monkeypatch, tmp_path):
+    images = {f'@startuml\n:{index};\n@enduml': png_bytes(1200, 900) for index in range(3)}
+    for index, plantuml_code in enumerate(images):
+        store.append_history('pdf', f'Kérés {index}: számla jóváhagyása', plantuml_code)
+    monkeypatch.setattr(app, 'render_plantuml_png', lambda plantuml_code, *args, **kwargs: images[plantuml_code])
+    monkeypatch.chdir(tmp_path)
+
+    pdf_bytes = app.create_pdf_report('pdf')
+
+    assert pdf_bytes.startswith(b'%PDF')
+    assert page_count(pdf_bytes) == 3
+    # A képek a memóriából kerülnek a PDF-be, ideiglenes fájl nem marad
+    assert os.listdir(tmp_path) == []
+
+
+def test_failed_render_still_produces_page(store, monkeypatch):
+    store.append_history('pdf', 'Hibás diagram', '@startuml\n:x;\n@enduml')
+    monkeypatch.setattr(app, 'render_plantuml_png', lambda *args, **kwargs: None)
+
+    pdf_bytes = app.create_pdf_report('pdf')
+
+    assert page_count(pdf_bytes) == 1
+
+
+def test_report_image_downscaled_to_print_resolution():
+    image = app.prepare_report_image(png_bytes(4000, 6000), 190)
+
+    assert image.width == int(190 / 25.4 * app.REPORT_IMAGE_DPI)
+    assert image.height == pytest.approx(image.width * 1.5, abs=1)
+    assert image.mode == 'RGB'
+
+
+def test_small_image_not_upscaled():
+    image = app.prepare_report_image(png_bytes(400, 300), 190)
+
+    assert image.size == (400, 300)
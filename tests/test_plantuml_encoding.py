@@ -0,0 +1,70 @@
+import os
+import zlib
+
+import pytest
+
+import app
+
+
+def legacy_encode64_for_ascii(bytes_data):
+    """A korábbi, bájtonkénti kódoló változatlanul (referencia a byte-azonos kimenethez)"""
+    base64_chars = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_'
+    result = ''
+    i = 0
+    while i < len(bytes_data):
+        b1 = bytes_data[i] if i < len(bytes_data) else 0
+        b2 = bytes_data[i + 1] if i + 1 < len(bytes_data) else 0
+        b3 = bytes_data[i + 2] if i + 2 < len(bytes_data) else 0
+
+        c1 = b1 >> 2
+        c2 = ((b1 & 0x3) << 4) | (b2 >> 4)
+        c3 = ((b2 & 0xF) << 2) | (b3 >> 6)
+        c4 = b3 & 0x3F
+
+        result += (base64_chars[c1] + base64_chars[c2] +
+                   (base64_chars[c3] if i + 1 < len(bytes_data) else '') +
+                   (base64_chars[c4] if i + 2 < len(bytes_data) else ''))
+        i += 3
+
+    return result
+
+
+SAMPLE_DIAGRAM = """@startuml
+start
+:Kérelem beérkezése;
+if (Jóváhagyva?) then (igen)
+  :Szerződés előkészítése;
+else (nem)
+  :Elutasító levél;
+endif
+stop
+@enduml"""
+
+
+@pytest.mark.parametrize('length', [0, 1, 2, 3, 4, 5, 63, 64, 65, 1000, 4097, 65536])
+def test_encoder_matches_legacy_loop(length):
+    data = os.urandom(length)
+    assert app.encode64_for_ascii(data) == legacy_encode64_for_ascii(data)
+
+
+def test_encoder_matches_legacy_loop_on_compressed_diagram():
+    compressed = zlib.compress(SAMPLE_DIAGRAM.encode('utf-8'))
+    assert app.compress_and_encode_plantuml(SAMPLE_DIAGRAM) == legacy_encode64_for_ascii(compressed)
+
+
+@pytest.mark.parametrize('length', [0, 1, 2, 3, 1000, 4097])
+def test_decoder_inverts_encoder(length):
+    data = os.urandom(length)
+    assert app.decode64_for_ascii(app.encode64_for_ascii(data)) == data
+
+
+def test_diagram_round_trip():
+    encoded = app.compress_and_encode_plantuml(SAMPLE_DIAGRAM)
+    assert app.decode_plantuml(encoded) == SAMPLE_DIAGRAM
+    assert app.decode_plantuml('~1' + encoded) == SAMPLE_DIAGRAM
+
+
+def test_encoding_uses_plantuml_alphabet_without_padding():
+    encoded = app.encode64_for_ascii(os.urandom(1000))
+    assert set(encoded) <= set(app.PLANTUML_BASE64_CHARS.decode('ascii'))
+    assert '=' not in encoded
@@ -0,0 +1,172 @@
+import pytest
+
+import app
+from benchutil import assistant_outputs
+
+THEME_DIRECTIVES = ['skinparam ConditionEndStyle hline', 'skinparam defaultFontName Montserrat']
+
+
+def legacy_check_plantuml(plantuml_code):
+    """A user-015 előtti check_plantuml változatlanul (referencia a kimenet egyezéséhez)"""
+    errors = []
+    lines = plantuml_code.split('\n')
+    stack = []
+    seen_start = seen_stop = False
+    start_line = end_line = None
+    in_note = in_comment = in_activity = False
+
+    for number, line in enumerate(lines, 1):
+        text = line.strip()
+        lowered = text.lower()
+
+        if start_line is None or end_line is not None:
+            if lowered.startswith('@startuml') and start_line is None:
+                start_line = number
+            elif lowered.startswith('@startuml'):
+                errors.append({'line': number, 'message': 'more than one @startuml block'})
+            continue
+        if in_comment:
+            in_comment = not lowered.endswith("'/")
+            continue
+        if in_note:
+            in_note = lowered not in ('end note', 'endnote')
+            continue
+        if in_activity:
+            in_activity = not lowered.endswith(app.PLANTUML_ACTIVITY_TERMINATORS)
+            continue
+        if not text or text.startswith("'"):
+            continue
+        if text.startswith("/'"):
+            in_comment = not lowered.endswith("'/")
+            continue
+        if lowered.startswith('@enduml'):
+            end_line = number
+            continue
+        if text.startswith(':'):
+            in_activity = not lowered.endswith(app.PLANTUML_ACTIVITY_TERMINATORS)
+            continue
+        if app._starts_with_keyword(lowered, 'note') or app._starts_with_keyword(lowered, 'floating note'):
+            lines[number - 1] = line.replace('(', '').replace(')', '')
+            in_note = ':' not in text
+            continue
+        if lowered == 'start':
+            seen_start = True
+            continue
+        if lowered in app.PLANTUML_STOP_KEYWORDS:
+            seen_stop = True
+            continue
+        closer = next((kind for keyword, kind in app.PLANTUML_BLOCK_CLOSERS if app._starts_with_keyword(lowered, keyword)), None)
+        if closer:
+            if not stack or stack[-1][0] != closer:
+                found = f"'{stack[-1][0]}' opened on line {stack[-1][1]}" if stack else 'no open block'
+                errors.append({'line': number, 'message': f"'{text}' does not close a '{closer}' block ({found})"})
+            else:
+                stack.pop()
+            continue
+        continuation = next((kind for keyword, kind in app.PLANTUML_BLOCK_CONTINUATIONS if app._starts_with_keyword(lowered, keyword)), None)
+        if continuation:
+            if not stack or stack[-1][0] != continuation:
+                errors.append({'line': number, 'message': f"'{text}' outside of a '{continuation}' block"})
+            continue
+        opener = next((keyword for keyword in app.PLANTUML_BLOCK_OPENERS if app._starts_with_keyword(lowered, keyword)), None)
+        if opener:
+            stack.append((opener, number))
+            continue
+        if lowered.startswith('partition') and lowered.endswith('{'):
+            stack.append(('partition', number))
+            continue
+        if lowered == '}':
+            if not stack or stack[-1][0] != 'partition':
+                errors.append({'line': number, 'message': "'}' does not close a partition"})
+            else:
+                stack.pop()
+
+    if start_line is None:
+        errors.append({'line': 0, 'message': 'missing @startuml'})
+    elif end_line is None:
+        errors.append({'line': len(lines), 'message': 'missing @enduml'})
+    if in_note:
+        errors.append({'line': len(lines), 'message': "multi-line note is not closed with 'end note'"})
+    for kind, number in stack:
+        errors.append({'line': number, 'message': f"'{kind}' block is never closed"})
+    if start_line is not None and not seen_start:
+        errors.append({'line': start_line, 'message': "missing 'start'"})
+    if start_line is not None and not seen_stop:
+        errors.append({'line': start_line, 'message': "missing 'stop' or 'end'"})
+
+    return '\n'.join(lines), errors
+
+
+def legacy_normalize(assistant_response):
+    """A korábbi több menetes feldolgozás: ellenőrzés, keret levágása, skinparam beszúrás replace-szel"""
+    cleaned_response, errors = legacy_check_plantuml(assistant_response)
+    cleaned_response = cleaned_response.replace("```plantuml", "").rstrip("`").strip()
+    cleaned_response = cleaned_response.replace('@startuml', '@startuml\n' + '\n'.join(THEME_DIRECTIVES))
+    return cleaned_response, errors
+
+
+REAL_OUTPUTS = assistant_outputs()
+
+
+@pytest.fixture
+def normalizer():
+    return app.PlantUMLNormalizer(theme_directives=THEME_DIRECTIVES)
+
+
+def test_log_has_real_outputs():
+    assert len(REAL_OUTPUTS) >= 3
+
+
+@pytest.mark.parametrize('assistant_response', REAL_OUTPUTS)
+def test_real_output_matches_legacy_pipeline(normalizer, assistant_response):
+    assert normalizer.normalize(assistant_response) == legacy_normalize(assistant_response)
+
+
+@pytest.mark.parametrize('assistant_response', REAL_OUTPUTS)
+def test_real_output_is_valid(normalizer, assistant_response):
+    code, errors = normalizer.normalize(assistant_response)
+    assert errors == []
+    assert code.split('\n')[:3] == ['@startuml', *THEME_DIRECTIVES]
+    assert code.endswith('@enduml')
+    assert '```' not in code
+
+
+def test_duplicate_block_keeps_first_and_injects_theme_once(normalizer):
+    block = '@startuml\nstart\n:Egy;\nstop\n@enduml'
+    code, errors = normalizer.normalize(f'```plantuml\n{block}\n```\nVagy:\n```plantuml\n{block}\n```')
+
+    assert errors == []
+    assert code.count('@startuml') == 1
+    assert code.count('skinparam defaultFontName') == 1
+
+
+def test_unfenced_output_with_explanation(normalizer):
+    code, errors = normalizer.normalize('Íme a diagram:\n@startuml\nstart\n:Lépés;\nstop\n@enduml\nRemélem segít!')
+
+    assert errors == []
+    assert code == '\n'.join(['@startuml', *THEME_DIRECTIVES, 'start', ':Lépés;', 'stop', '@enduml'])
+
+
+def test_note_parentheses_removed(normalizer):
+    code, _ = normalizer.normalize('@startuml\nstart\n:Lépés;\nnote right: (fontos) lépés\nstop\n@enduml')
+
+    assert 'note right: fontos lépés' in code
+
+
+@pytest.mark.parametrize('body, message', [
+    ('start\nif (a?) then (igen)\n:x;\nstop', "'if' block is never closed"),
+    ('start\n:x;\nendwhile\nstop', "'endwhile' does not close a 'while' block (no open block)"),
+    ('start\nelse\nstop', "'else' outside of a 'if' block"),
+    (':x;\nstop', "missing 'start'"),
+    ('start\n:x;', "missing 'stop' or 'end'"),
+    ('start\nnote right\nnyitott note\nstop', "multi-line note is not closed with 'end note'"),
+])
+def test_block_errors(normalizer, body, message):
+    _, errors = normalizer.normalize(f'@startuml\n{body}\n@enduml')
+
+    assert message in [error['message'] for error in errors]
+
+
+def test_missing_markers(normalizer):
+    assert normalizer.normalize('nincs diagram')[1] == [{'line': 0, 'message': 'missing @startuml'}]
+    assert 'missing @enduml' in [e['message'] for e in normalizer.normalize('@startuml\nstart\nstop')[1]]
@@ -0,0 +1,83 @@
+import os
+
+import app
+
+A, B, C = ('@startuml\n:a;\n@enduml', '@startuml\n:b;\n@enduml', '@startuml\n:c;\n@enduml')
+
+
+def disk_file(cache, plantuml_code, variant='png'):
+    return cache._disk_path(cache.key_for(plantuml_code, variant))
+
+
+def test_lru_order():
+    cache = app.RenderCache(max_entries=2)
+    cache.put(A, b'a')
+    cache.put(B, b'b')
+    assert cache.get(A) == b'a'
+    cache.put(C, b'c')
+
+    assert cache.get(B) is None
+    assert cache.get(A) == b'a'
+    assert cache.get(C) == b'c'
+    assert cache.stats['evictions'] == 1
+
+
+def test_byte_budget_eviction():
+    cache = app.RenderCache(max_entries=10, max_bytes=10)
+    cache.put(A, b'aaaa')
+    cache.put(B, b'bbbb')
+    cache.put(C, b'cccc')
+
+    assert cache.get(A) is None
+    assert cache.bytes_held == 8
+    # Felülírásnál a régi méret kikerül a számlálóból
+    cache.put(B, b'bb')
+    assert cache.bytes_held == 6
+    # A keretnél nagyobb egyetlen elem is bekerül, de egyedül marad
+    cache.put(A, b'x' * 20)
+    assert cache.get(A) == b'x' * 20
+    assert cache.get(B) is None and cache.get(C) is None
+    assert cache.bytes_held == 20
+
+
+def test_variant_keys():
+    cache = app.RenderCache()
+    cache.put(A, b'svg', 'svg')
+    cache.put(A, b'png')
+    cache.put(A, b'thumb', app.raster_variant('thumbnail'))
+
+    assert cache.get(A, 'svg') == b'svg'
+    assert cache.get('  ' + A + '\n') == b'png'
+    assert cache.get(A, 'thumbnail@320') == b'thumb'
+    assert cache.get(A, 'png@150') is None
+    assert app.raster_variant('png', 150) == 'png@150'
+    assert app.raster_variant('png') == 'png'
+
+
+def test_disk_read_through_and_promotion(tmp_path):
+    app.RenderCache(disk_dir=str(tmp_path)).put(A, b'a')
+    # Új folyamat (üres memória) a lemezről olvas, utána memóriából
+    cache = app.RenderCache(disk_dir=str(tmp_path))
+    os.utime(disk_file(cache, A), (1000, 1000))
+
+    assert cache.get(A) == b'a'
+    assert cache.get(A) == b'a'
+    assert cache.stats == dict(cache.stats, hits=1, disk_hits=1, misses=0)
+    assert os.stat(disk_file(cache, A)).st_mtime > 1000
+    assert cache.get(B) is None
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+def test_disk_trim_removes_least_recently_used(tmp_path):
+    cache = app.RenderCache(max_entries=1, disk_dir=str(tmp_path), disk_max_entries=2)
+    cache.put(A, b'a')
+    os.utime(disk_file(cache, A), (1000, 1000))
+    cache.put(B, b'b')
+    os.utime(disk_file(cache, B), (2000, 2000))
+    # A lemezről olvasott elem frissül, így a B lesz a legrégebbi
+    assert cache.get(A) == b'a'
+    cache.put(C, b'c')
+
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(disk_file(cache, code)) for code in (A, C))
+    assert cache.stats['disk_evictions'] == 1
+    assert cache.get(B) is None
@@ -0,0 +1,92 @@
+import os
+import sys
+import threading
+
+import pytest
+
+import app
+from load_async_chat import free_port
+
+FAKE_PIPE = os.path.join('bench', 'fake_plantuml_pipe.py')
+
+
+def diagram(title, steps=3):
+    return '@startuml\ntitle ' + title + '\nstart\n' + ':Lépés;\n' * steps + 'stop\n@enduml'
+
+
+def fake_local_renderer(pool_size=1, timeout=5.0, options=()):
+    renderer = app.LocalJarRenderer(jar_path='nincs.jar', pool_size=pool_size, timeout=timeout)
+    for worker in list(renderer._idle.queue):
+        worker.command = [sys.executable, FAKE_PIPE, '-pipedelimitor', worker.DELIMITER, *options]
+    return renderer
+
+
+def test_renderer_factory():
+    assert isinstance(app.create_renderer('remote'), app.RemoteRenderer)
+    local = app.create_renderer('local')
+    assert isinstance(local, app.LocalJarRenderer)
+    assert all(worker.process is None for worker in local._idle.queue)
+    assert isinstance(app.create_renderer('picoweb'), app.PicowebRenderer)
+    with pytest.raises(ValueError):
+        app.create_renderer('graphviz')
+
+
+def test_local_renderer_reuses_worker_process():
+    renderer = fake_local_renderer()
+    try:
+        renderer.warm_up()
+        worker = renderer._idle.queue[0]
+        pid = worker.process.pid
+
+        assert '>Rendelés<' in renderer.render_svg(diagram('Rendelés'))
+        assert [svg.split('<text x="10" y="20">')[1].split('<')[0]
+                for svg in renderer.render_many([diagram('A'), diagram('B'), diagram('C')])] == ['A', 'B', 'C']
+        assert worker.process.pid == pid
+    finally:
+        renderer.close()
+
+
+def test_large_batch_does_not_deadlock_on_full_pipes():
+    # A bemenet és a kimenet is sokszorosa a pipe puffernek
+    renderer = fake_local_renderer(timeout=20.0, options=['--svg-bytes', '100000'])
+    codes = [diagram(f'D{index}', steps=2000) for index in range(20)]
+    results = []
+    try:
+        runner = threading.Thread(target=lambda: results.append(renderer.render_many(codes)), daemon=True)
+        runner.start()
+        runner.join(30)
+        assert not runner.is_alive(), 'a köteg renderelése elakadt'
+    finally:
+        renderer.close()
+
+    assert len(results[0]) == 20
+    assert all(svg is not None and f'>D{index}<' in svg for index, svg in enumerate(results[0]))
+
+
+def test_local_renderer_deadline_restarts_worker():
+    renderer = fake_local_renderer(timeout=0.3, options=['--hang'])
+    worker = renderer._idle.queue[0]
+    try:
+        with pytest.raises(TimeoutError):
+            renderer.render_svg(diagram('Lassú'))
+        assert worker.process is None
+        # A worker visszakerül a készletbe, a következő kérés új folyamatot indít
+        assert renderer._idle.qsize() == 1
+    finally:
+        renderer.close()
+
+
+def test_picoweb_renderer_against_stub_server():
+    port = free_port()
+    renderer = app.PicowebRenderer(jar_path='nincs.jar', port=port, timeout=30)
+    renderer.command = [sys.executable, os.path.join('bench', 'stub_servers.py'), '--port', str(port),
+                        '--render-latency', '0']
+    try:
+        svg = renderer.render_svg(diagram('Picoweb'))
+        pid = renderer.process.pid
+        assert svg.startswith('<svg')
+        assert renderer.render_svg(diagram('Újra')).startswith('<svg')
+        assert renderer.process.pid == pid
+    finally:
+        renderer.close()
+    assert renderer.process is None
@@ -0,0 +1,155 @@
+import asyncio
+
+import pytest
+import requests
+
+import app
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def fail(breaker, error=RuntimeError):
+    with pytest.raises(error):
+        with breaker:
+            raise error('hiba')
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = app.CircuitBreaker('teszt', failure_threshold=3, recovery_timeout=30)
+    fail(breaker)
+    fail(breaker)
+    with breaker:
+        pass
+    # A siker nullázza a sorozatot
+    fail(breaker)
+    fail(breaker)
+    assert breaker.state == 'closed'
+    fail(breaker)
+    assert breaker.state == 'open'
+
+    clock[0] += 10
+    with pytest.raises(app.CircuitOpenError) as rejected:
+        with breaker:
+            pass
+    assert rejected.value.retry_after == pytest.approx(20)
+    assert breaker.snapshot()['rejected'] == 1
+
+
+def test_half_open_allows_single_probe(clock):
+    breaker = app.CircuitBreaker('teszt', failure_threshold=1, recovery_timeout=30)
+    fail(breaker)
+    clock[0] += 30
+
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+    clock[0] += 30
+    with breaker:
+        assert not breaker.allow()
+    assert breaker.state == 'closed'
+    assert breaker.allow()
+
+
+def test_cancelled_probe_releases_slot(clock):
+    breaker = app.CircuitBreaker('teszt', failure_threshold=1, recovery_timeout=30)
+    fail(breaker)
+    clock[0] += 30
+
+    with pytest.raises(asyncio.CancelledError):
+        with breaker:
+            raise asyncio.CancelledError()
+
+    assert breaker.state == 'half_open'
+    assert breaker.snapshot()['failures'] == 1
+    # A megszakított próba helyén új próba indulhat
+    with breaker:
+        pass
+    assert breaker.state == 'closed'
+
+
+def test_ignored_errors_count_as_success():
+    breaker = app.CircuitBreaker('teszt', failure_threshold=1, ignored=lambda: (KeyError,))
+    fail(breaker, KeyError)
+    assert breaker.state == 'closed'
+    fail(breaker, ValueError)
+    assert breaker.state == 'open'
+
+
+class FakeHttp:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def get(self, url, timeout):
+        response = requests.Response()
+        response.status_code = self.status_code
+        response.url = url
+        response._content = b'<svg xmlns="http://www.w3.org/2000/svg"/>' if self.status_code == 200 else b'hiba'
+        return response
+
+
+@pytest.mark.parametrize('status_code, expected_state', [(200, 'closed'), (400, 'closed'), (503, 'open')])
+def test_remote_renderer_status_classification(status_code, expected_state):
+    renderer = app.RemoteRenderer('http://plantuml.invalid/plantuml')
+    renderer._http = FakeHttp(status_code)
+    breaker = app.CircuitBreaker('plantuml', failure_threshold=1)
+
+    try:
+        with breaker:
+            svg_text = renderer.render_svg('@startuml\n:a;\n@enduml')
+    except requests.HTTPError:
+        svg_text = 'hiba'
+
+    assert breaker.state == expected_state
+    assert svg_text == {200: '<svg xmlns="http://www.w3.org/2000/svg"/>', 400: None, 503: 'hiba'}[status_code]
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(app.random, 'uniform', lambda low, high: high)
+    monkeypatch.setattr(app.time, 'sleep', slept.append)
+    return slept
+
+
+def test_retry_budget_attempts_and_backoff(sleeps):
+    budget = app.RetryBudget(max_attempts=5, deadline=100, base_delay=0.5, max_delay=1.5)
+
+    assert [budget.next_attempt() for _ in range(6)] == [True] * 5 + [False]
+    assert sleeps == [0.0, 0.5, 1.0, 1.5, 1.5]
+    assert budget.attempts == 5
+
+
+def test_retry_budget_stops_before_deadline(clock, sleeps):
+    budget = app.RetryBudget(max_attempts=10, deadline=3, base_delay=1.0, max_delay=8.0)
+
+    assert budget.next_attempt()
+    clock[0] += 1.5
+    # A következő várakozás (1 s) még belefér, az utána következő (2 s) már nem
+    assert budget.next_attempt()
+    clock[0] += 0.5
+    assert not budget.next_attempt()
+    assert budget.attempts == 2
+
+
+def test_retry_budget_async(monkeypatch):
+    async def no_sleep(delay):
+        slept.append(delay)
+
+    slept = []
+    monkeypatch.setattr(app.random, 'uniform', lambda low, high: high)
+    monkeypatch.setattr(app.asyncio, 'sleep', no_sleep)
+    budget = app.RetryBudget(max_attempts=2, deadline=100, base_delay=0.5)
+
+    async def scenario():
+        return [await budget.next_attempt_async() for _ in range(3)]
+
+    assert asyncio.run(scenario()) == [True, True, False]
+    assert slept == [0.0, 0.5]
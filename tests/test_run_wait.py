@@ -0,0 +1,150 @@
+import asyncio
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+
+def run_event(status, run_id='run_1'):
+    return SimpleNamespace(event=f'thread.run.{status}', data=SimpleNamespace(id=run_id, status=status))
+
+
+def delta_event(text):
+    block = SimpleNamespace(type='text', text=SimpleNamespace(value=text))
+    return SimpleNamespace(event='thread.message.delta', data=SimpleNamespace(delta=SimpleNamespace(content=[block])))
+
+
+class FakeRuns:
+    """openai.beta.threads.runs csonk: a retrieve a megadott státuszokat adja sorban (az utolsót ismételve)"""
+
+    def __init__(self, statuses=('completed',), events=(), stream_error=None):
+        self.statuses = list(statuses)
+        self.events = list(events)
+        self.stream_error = stream_error
+        self.created = []
+        self.cancelled = []
+        self.retrieved = 0
+
+    def create(self, thread_id, assistant_id):
+        self.created.append(thread_id)
+        return SimpleNamespace(id=f'run_created_{len(self.created)}', status='queued')
+
+    def retrieve(self, thread_id, run_id):
+        self.retrieved += 1
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        return SimpleNamespace(id=run_id, status=status)
+
+    def cancel(self, thread_id, run_id):
+        self.cancelled.append(run_id)
+
+    @contextmanager
+    def stream(self, thread_id, assistant_id, timeout):
+        def events():
+            yield from self.events
+            if self.stream_error is not None:
+                raise self.stream_error
+        yield events()
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    def install(**kwargs):
+        fake = FakeRuns(**kwargs)
+        monkeypatch.setattr(app, 'openai', SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(runs=fake))))
+        return fake
+    monkeypatch.setattr(app, 'RUN_POLL_INITIAL_DELAY', 0.0)
+    monkeypatch.setattr(app, 'RUN_WAIT_MODE', 'poll')
+    return install
+
+
+def test_poll_until_completed(runs):
+    fake = runs(statuses=['queued', 'in_progress', 'completed'])
+
+    assert app.run_assistant('thread_1') == ('run_created_1', 'completed')
+    assert fake.retrieved == 3
+    assert fake.cancelled == []
+
+
+def test_timeout_cancels_run(runs):
+    fake = runs(statuses=['in_progress'])
+
+    assert app.run_assistant('thread_1', timeout=0.05) == ('run_created_1', 'timeout')
+    assert fake.cancelled == ['run_created_1']
+
+
+def test_requires_action_is_cancelled(runs):
+    fake = runs(statuses=['in_progress', 'requires_action'])
+
+    assert app.run_assistant('thread_1') == ('run_created_1', 'requires_action')
+    assert fake.cancelled == ['run_created_1']
+
+
+def test_stream_forwards_deltas(runs):
+    fake = runs(events=[run_event('created'), delta_event('@start'), delta_event('uml'), run_event('completed')])
+    deltas = []
+
+    assert app.run_assistant('thread_1', on_delta=deltas.append) == ('run_1', 'completed')
+    assert deltas == ['@start', 'uml']
+    assert fake.created == []
+    assert fake.retrieved == 0
+
+
+def test_stream_ending_early_falls_back_to_polling(runs):
+    fake = runs(events=[run_event('created'), run_event('in_progress')], statuses=['completed'])
+
+    assert app.run_assistant('thread_1', on_delta=lambda text: None) == ('run_1', 'completed')
+    assert fake.retrieved == 1
+
+
+def test_interrupted_stream_resumes_existing_run(runs):
+    fake = runs(events=[run_event('created'), run_event('in_progress')], stream_error=ConnectionError('reset'),
+                statuses=['in_progress', 'completed'])
+
+    assert app.run_assistant('thread_1', on_delta=lambda text: None) == ('run_1', 'completed')
+    # Nem indul második futás a thread-en
+    assert fake.created == []
+    assert fake.retrieved == 2
+
+
+def test_stream_failing_before_run_starts_creates_run(runs):
+    fake = runs(stream_error=ConnectionError('refused'), statuses=['completed'])
+
+    assert app.run_assistant('thread_1', on_delta=lambda text: None) == ('run_created_1', 'completed')
+    assert fake.created == ['thread_1']
+
+
+def test_stream_requires_action_is_cancelled(runs):
+    fake = runs(events=[run_event('created'), run_event('requires_action')])
+
+    assert app.run_assistant('thread_1', on_delta=lambda text: None) == ('run_1', 'requires_action')
+    assert fake.cancelled == ['run_1']
+
+
+class FakeAsyncRuns:
+    def __init__(self, statuses):
+        self.sync = FakeRuns(statuses=statuses)
+
+    async def create(self, **kwargs):
+        return self.sync.create(**kwargs)
+
+    async def retrieve(self, **kwargs):
+        return self.sync.retrieve(**kwargs)
+
+    async def cancel(self, **kwargs):
+        return self.sync.cancel(**kwargs)
+
+
+@pytest.mark.parametrize('statuses, timeout, expected, cancelled', [
+    (['in_progress', 'completed'], 5, 'completed', []),
+    (['in_progress', 'requires_action'], 5, 'requires_action', ['run_created_1']),
+    (['in_progress'], 0.05, 'timeout', ['run_created_1']),
+])
+def test_async_run(monkeypatch, statuses, timeout, expected, cancelled):
+    monkeypatch.setattr(app, 'RUN_POLL_INITIAL_DELAY', 0.0)
+    runs = FakeAsyncRuns(statuses)
+    client = SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(runs=runs)))
+
+    assert asyncio.run(app.run_assistant_async(client, 'thread_1', timeout=timeout)) == ('run_created_1', expected)
+    assert runs.sync.cancelled == cancelled
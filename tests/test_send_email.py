@@ -0,0 +1,226 @@
+import base64
+import json
+import threading
+from email.message import EmailMessage
+from io import BytesIO
+
+import pytest
+
+import app
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def image_bytes(format='PNG', size=(200, 300)):
+    output = BytesIO()
+    Image.new('RGB', size, 'white').save(output, format=format)
+    return output.getvalue()
+
+
+@pytest.fixture
+def mail(monkeypatch):
+    """A /send-email levélkészítése valódi MIME-mal, de SMTP, cairo és A4 komponálás nélkül"""
+    sent = []
+    store = app.MemoryStateStore()
+    rendered = []
+
+    def render(plantuml_code, *args, **kwargs):
+        rendered.append(plantuml_code)
+        return image_bytes()
+
+    monkeypatch.setattr(app, 'state_store', store)
+    monkeypatch.setattr(app, 'render_plantuml_png', render)
+    monkeypatch.setattr(app, 'create_a4_image', lambda data: image_bytes('JPEG'))
+    monkeypatch.setattr(app.mail_queue, 'enqueue', sent.append)
+    monkeypatch.setattr(app, 'send_error_email', lambda *args, **kwargs: None)
+    return {'sent': sent, 'store': store, 'rendered': rendered}
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+RECIPIENT = {'name': 'Teszt Elek', 'email': 'teszt@example.com'}
+
+
+def test_latest_diagram_by_reference(client, mail):
+    mail['store'].append_history('s1', 'első', '@startuml\n:a;\n@enduml')
+    mail['store'].append_history('s1', 'második', '@startuml\n:b;\n@enduml')
+
+    response = client.post('/send-email', json=RECIPIENT, headers={'X-Session-ID': 's1'})
+
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['success'] is True
+    assert 'sorba állítva' in response.get_json()['message']
+    assert mail['rendered'] == ['@startuml\n:b;\n@enduml']
+    assert len(mail['sent']) == 1
+    assert mail['sent'][0]['To'] == 'teszt@example.com'
+
+
+def test_diagram_id_reference(client, mail):
+    mail['store'].append_history('s1', 'első', '@startuml\n:a;\n@enduml')
+    mail['store'].append_history('s1', 'második', '@startuml\n:b;\n@enduml')
+    wanted = app.diagram_id('@startuml\n:a;\n@enduml')
+
+    response = client.post('/send-email', json=dict(RECIPIENT, diagram_id=wanted), headers={'X-Session-ID': 's1'})
+
+    assert response.status_code == 200
+    assert mail['rendered'] == ['@startuml\n:a;\n@enduml']
+
+
+def test_unknown_diagram_id(client, mail):
+    mail['store'].append_history('s1', 'első', '@startuml\n:a;\n@enduml')
+
+    response = client.post('/send-email', json=dict(RECIPIENT, diagram_id='0' * 64), headers={'X-Session-ID': 's1'})
+
+    assert response.status_code == 404
+    assert mail['sent'] == []
+
+
+def test_other_session_diagram_not_reachable(client, mail):
+    mail['store'].append_history('s1', 'első', '@startuml\n:a;\n@enduml')
+    wanted = app.diagram_id('@startuml\n:a;\n@enduml')
+
+    response = client.post('/send-email', json=dict(RECIPIENT, diagram_id=wanted), headers={'X-Session-ID': 's2'})
+
+    assert response.status_code == 404
+
+
+def test_multipart_upload(client, mail):
+    data = dict(RECIPIENT, image=(BytesIO(image_bytes()), 'diagram.png', 'image/png'))
+
+    response = client.post('/send-email', data=data, content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    assert mail['rendered'] == []
+    assert len(mail['sent']) == 1
+
+
+def test_multipart_rejects_other_types(client, mail):
+    data = dict(RECIPIENT, image=(BytesIO(b'GIF89a'), 'diagram.gif', 'image/gif'))
+
+    response = client.post('/send-email', data=data, content_type='multipart/form-data')
+
+    assert response.status_code == 400
+    assert mail['sent'] == []
+
+
+def test_legacy_data_url(client, mail):
+    data_url = 'data:image/png;base64,' + base64.b64encode(image_bytes()).decode()
+
+    response = client.post('/send-email', json=dict(RECIPIENT, image=data_url))
+
+    assert response.status_code == 200
+    assert len(mail['sent']) == 1
+
+
+def test_missing_fields(client, mail):
+    response = client.post('/send-email', json={'name': 'x'}, headers={'X-Session-ID': 's1'})
+
+    assert response.status_code == 400
+
+
+def test_oversized_request(client, mail, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'MAX_CONTENT_LENGTH', 1024)
+
+    response = client.post('/send-email', data=json.dumps(dict(RECIPIENT, image='x' * 4096)),
+                           content_type='application/json')
+
+    assert response.status_code == 413
+
+
+class FakeSMTP:
+    def __init__(self, sent, release=None):
+        self.sent = sent
+        self.release = release
+
+    def send_message(self, msg):
+        if self.release is not None:
+            self.release.wait(5)
+        self.sent.append(msg['To'])
+
+    def noop(self):
+        return (250, b'OK')
+
+    def quit(self):
+        pass
+
+
+def queued_messages(count):
+    messages = []
+    for index in range(count):
+        msg = EmailMessage()
+        msg['To'] = f'cimzett{index}@example.com'
+        messages.append(msg)
+    return messages
+
+
+def test_mail_queue_drains_pending_messages(monkeypatch):
+    sent = []
+    mail_queue = app.MailQueue(workers=1)
+    monkeypatch.setattr(mail_queue, '_connect', lambda: FakeSMTP(sent))
+    for msg in queued_messages(3):
+        mail_queue.enqueue(msg)
+
+    assert mail_queue.drain(5) is True
+    assert sent == ['cimzett0@example.com', 'cimzett1@example.com', 'cimzett2@example.com']
+
+
+def test_mail_queue_drain_is_bounded(monkeypatch):
+    sent = []
+    release = threading.Event()
+    mail_queue = app.MailQueue(workers=1)
+    monkeypatch.setattr(mail_queue, '_connect', lambda: FakeSMTP(sent, release))
+    try:
+        mail_queue.enqueue(queued_messages(1)[0])
+
+        assert mail_queue.drain(0.1) is False
+    finally:
+        release.set()
+    assert mail_queue.drain(5) is True
+    assert sent == ['cimzett0@example.com']
+
+
+class RecordingScheduler:
+    def __init__(self):
+        self.scheduled = []
+
+    def schedule(self, key, delay, callback, *args):
+        self.scheduled.append((delay, args))
+
+
+def test_open_breaker_defers_without_spending_attempt(monkeypatch):
+    connects = []
+    scheduler = RecordingScheduler()
+    breaker = app.CircuitBreaker('smtp', failure_threshold=1, recovery_timeout=30)
+    breaker.record_failure()
+    monkeypatch.setattr(app, 'smtp_breaker', breaker)
+    monkeypatch.setattr(app, 'session_scheduler', scheduler)
+    mail_queue = app.MailQueue(workers=1, max_retries=5)
+    monkeypatch.setattr(mail_queue, '_connect', lambda: connects.append(1))
+    msg = queued_messages(1)[0]
+
+    # Az utolsó engedélyezett próbálkozás sem vész el, amíg a megszakító nyitva van
+    mail_queue.enqueue(msg, attempt=5)
+    assert mail_queue.drain(5) is True
+
+    assert connects == []
+    [(delay, args)] = scheduler.scheduled
+    assert args == (msg, 5)
+    assert 29 <= delay <= 45
+    stats = mail_queue.snapshot()
+    assert stats['deferred'] == 1
+    assert stats['dropped'] == 0 and stats['retried'] == 0
+
+
+def test_mail_stats_consistent_across_senders(monkeypatch):
+    sent = []
+    mail_queue = app.MailQueue(workers=4, batch_size=1)
+    monkeypatch.setattr(mail_queue, '_connect', lambda: FakeSMTP(sent))
+    for msg in queued_messages(200):
+        mail_queue.enqueue(msg)
+
+    assert mail_queue.drain(10) is True
+    stats = mail_queue.snapshot()
+    assert stats['queued'] == stats['sent'] == len(sent) == 200
@@ -0,0 +1,76 @@
+import threading
+import time
+
+import app
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_task_fires_once_after_delay():
+    scheduler = app.SessionScheduler(workers=1)
+    fired = []
+    started = time.monotonic()
+    scheduler.schedule('s1', 0.05, lambda: fired.append(time.monotonic() - started))
+
+    assert wait_until(lambda: fired)
+    time.sleep(0.1)
+    assert len(fired) == 1
+    assert fired[0] >= 0.05
+    assert 's1' not in scheduler
+
+
+def test_reschedule_replaces_previous_deadline():
+    scheduler = app.SessionScheduler(workers=1)
+    fired = []
+    scheduler.schedule('s1', 0.05, fired.append, 'first')
+    scheduler.schedule('s1', 0.15, fired.append, 'second')
+
+    time.sleep(0.1)
+    assert fired == []
+    assert wait_until(lambda: fired)
+    time.sleep(0.05)
+    assert fired == ['second']
+
+
+def test_cancel_prevents_callback():
+    scheduler = app.SessionScheduler(workers=1)
+    fired = []
+    scheduler.schedule('s1', 0.05, fired.append, 's1')
+    scheduler.schedule('s2', 0.05, fired.append, 's2')
+
+    assert scheduler.cancel('s1')
+    assert not scheduler.cancel('s1')
+    assert wait_until(lambda: fired)
+    time.sleep(0.05)
+    assert fired == ['s2']
+
+
+def test_many_sessions_use_constant_threads():
+    scheduler = app.SessionScheduler(workers=2)
+    baseline = threading.active_count()
+    for index in range(5000):
+        scheduler.schedule(f'session-{index}', 600, lambda: None)
+    for index in range(5000):
+        scheduler.schedule(f'session-{index}', 600, lambda: None)
+
+    assert len(scheduler) == 5000
+    assert threading.active_count() - baseline == 1
+    # Az elavult heap bejegyzések nem halmozódnak korlát nélkül
+    assert len(scheduler._heap) <= 2 * len(scheduler) + 64
+
+
+def test_failing_callback_does_not_stop_scheduler():
+    scheduler = app.SessionScheduler(workers=1)
+    fired = []
+    scheduler.schedule('bad', 0.01, lambda: 1 / 0)
+    scheduler.schedule('good', 0.05, fired.append, 'good')
+
+    assert wait_until(lambda: fired)
+    assert fired == ['good']
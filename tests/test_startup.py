@@ -0,0 +1,72 @@
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+# Lusta módban az `import app` kumulatív ideje (-X importtime) legfeljebb ekkora hányada lehet
+# az ugyanabban a futásban mért LAZY_IMPORTS=0 importénak; így a gép terhelése nem számít
+IMPORT_TIME_RATIO = float(os.getenv("IMPORT_TIME_RATIO", 0.5))
+EAGER_IMPORTS = "import openai, cairosvg, PIL.Image, requests\nfrom fpdf import FPDF, XPos, YPos"
+EAGER_SKIP_REASON = 'a teljes (nem lusta) importhoz hiányzik egy függőség (pl. libcairo vagy fpdf2)'
+HEAVY_MODULES = ('openai', 'cairosvg', 'fpdf', 'PIL', 'requests', 'smtplib')
+
+
+def run_python(code, *flags, **env):
+    return subprocess.run(
+        [sys.executable, *flags, '-c', code],
+        cwd=ROOT,
+        env=dict(os.environ, **env),
+        capture_output=True,
+        text=True,
+        timeout=60,
+        check=True,
+    )
+
+
+def test_import_keeps_heavy_modules_unloaded():
+    code = (
+        "import sys, app\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    result = run_python(code, LAZY_IMPORTS='1')
+    assert result.stdout.strip() == ''
+
+
+def require_eager_imports():
+    try:
+        run_python(EAGER_IMPORTS)
+    except subprocess.CalledProcessError:
+        pytest.skip(EAGER_SKIP_REASON)
+
+
+def import_seconds(lazy):
+    result = run_python('import app', '-X', 'importtime', LAZY_IMPORTS=lazy)
+    match = re.search(r'^import time:\s+\d+ \|\s+(\d+) \| app$', result.stderr, re.MULTILINE)
+    assert match, result.stderr[-2000:]
+    return int(match.group(1)) / 1e6
+
+
+def test_import_time_within_budget():
+    require_eager_imports()
+    eager_seconds = import_seconds('0')
+    lazy_seconds = import_seconds('1')
+    assert lazy_seconds < eager_seconds * IMPORT_TIME_RATIO, (lazy_seconds, eager_seconds)
+
+
+def test_lazy_module_loads_on_first_use():
+    code = (
+        "import sys, app\n"
+        "assert 'smtplib' not in sys.modules\n"
+        "print(app.smtplib.SMTP.__name__, 'smtplib' in sys.modules)\n"
+    )
+    assert run_python(code, LAZY_IMPORTS='1').stdout.strip() == 'SMTP True'
+
+
+def test_eager_mode_imports_at_startup():
+    require_eager_imports()
+    code = "import sys, app\nprint('smtplib' in sys.modules, 'openai' in sys.modules)\n"
+    assert run_python(code, LAZY_IMPORTS='0').stdout.strip() == 'True True'
@@ -0,0 +1,168 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return app.MemoryStateStore()
+    return app.SQLiteStateStore(str(tmp_path / 'state.db'), app.HISTORY_SESSION_MAX_ENTRIES)
+
+
+def run_concurrently(count, target):
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def worker(index):
+        barrier.wait()
+        results[index] = target()
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results
+
+
+def test_concurrent_first_requests_create_one_thread(store):
+    calls = []
+
+    def create():
+        calls.append(1)
+        time.sleep(0.1)
+        return 'thread_1'
+
+    results = run_concurrently(16, lambda: store.get_or_create_thread('s1', create))
+
+    assert results == ['thread_1'] * 16
+    assert len(calls) == 1
+
+
+def test_create_failure_is_not_cached(store):
+    def failing():
+        raise RuntimeError('openai down')
+
+    with pytest.raises(RuntimeError):
+        store.get_or_create_thread('s1', failing)
+    assert store.get_or_create_thread('s1', lambda: 'thread_2') == 'thread_2'
+
+
+def test_lookup_does_not_wait_for_other_session_create():
+    store = app.MemoryStateStore()
+    store.get_or_create_thread('existing', lambda: 'thread_old')
+    creating = threading.Event()
+    release = threading.Event()
+
+    def slow_create():
+        creating.set()
+        release.wait(5)
+        return 'thread_new'
+
+    creator = threading.Thread(target=store.get_or_create_thread, args=('new', slow_create))
+    creator.start()
+    try:
+        assert creating.wait(5)
+        started = time.perf_counter()
+        assert store.get_or_create_thread('existing', lambda: 'unused') == 'thread_old'
+        assert time.perf_counter() - started < 0.05
+    finally:
+        release.set()
+        creator.join(5)
+    assert store.get_or_create_thread('new', lambda: 'unused') == 'thread_new'
+
+
+def test_reaper_retries_failed_delete(monkeypatch):
+    attempts = []
+
+    def delete(thread_id):
+        attempts.append(thread_id)
+        if len(attempts) == 1:
+            raise RuntimeError('temporary error')
+
+    monkeypatch.setattr(app, 'openai', SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(delete=delete))))
+    reaper = app.ThreadReaper(interval=3600, batch_size=4, rate_per_second=1000)
+    reaper.enqueue('thread_1', 's1')
+
+    deadline = time.monotonic() + 5
+    while reaper.stats['deleted'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert reaper.stats == {'deleted': 1, 'failed': 0}
+    assert attempts == ['thread_1', 'thread_1']
+
+
+def test_reaper_gives_up_after_max_attempts(monkeypatch):
+    def delete(thread_id):
+        raise RuntimeError('permanent error')
+
+    monkeypatch.setattr(app, 'openai', SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(delete=delete))))
+    reaper = app.ThreadReaper(interval=3600, batch_size=4, rate_per_second=1000, max_attempts=2)
+    reaper.enqueue('thread_1', 's1')
+
+    deadline = time.monotonic() + 5
+    while reaper.stats['failed'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert reaper.stats == {'deleted': 0, 'failed': 1}
+
+
+def test_compaction_needs_margin_over_seed(monkeypatch):
+    store = app.MemoryStateStore()
+    created, reaped = [], []
+
+    def create(messages):
+        created.append(messages)
+        return SimpleNamespace(id=f'thread_{len(created) + 1}')
+
+    monkeypatch.setattr(app, 'state_store', store)
+    monkeypatch.setattr(app, 'openai', SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(create=create))))
+    monkeypatch.setattr(app, 'thread_reaper', SimpleNamespace(enqueue=lambda *args: reaped.append(args)))
+    monkeypatch.setattr(app, 'CONTEXT_MODE', 'compact')
+    monkeypatch.setattr(app, 'THREAD_COMPACT_CHARS', 4000)
+    monkeypatch.setattr(app, 'THREAD_COMPACT_MIN_SAVINGS', 2000)
+    # A nagy diagram miatt a mag egymagában is a küszöb közelében van
+    diagram = '@startuml\nstart\n' + ':Lépés;\n' * 400 + 'stop\n@enduml'
+    store.append_history('s1', 'Rendelés', diagram)
+    store.get_or_create_thread('s1', lambda: 'thread_1')
+
+    store.add_thread_context('s1', 8000)
+    assert app.compact_thread_if_needed('s1', 'thread_1') == 'thread_2'
+    seed_chars = store.thread_context_chars('s1')
+    assert seed_chars > app.THREAD_COMPACT_CHARS - 1000
+
+    # Egy újabb kör a mag fölé viszi a küszöböt, de a tömörítés nem takarítana meg eleget
+    store.add_thread_context('s1', 1000)
+    assert app.compact_thread_if_needed('s1', 'thread_2') == 'thread_2'
+    store.add_thread_context('s1', 1500)
+    assert app.compact_thread_if_needed('s1', 'thread_2') == 'thread_3'
+    assert len(created) == 2
+    assert reaped == [('thread_1', 's1'), ('thread_2', 's1')]
+
+
+def test_sqlite_lost_claim_discards_own_thread(tmp_path):
+    store = app.SQLiteStateStore(str(tmp_path / 'state.db'), app.HISTORY_SESSION_MAX_ENTRIES, claim_timeout=0.2)
+    discarded = []
+    slow_started = threading.Event()
+
+    def slow_create():
+        slow_started.set()
+        time.sleep(0.6)
+        return 'thread_slow'
+
+    results = {}
+    slow = threading.Thread(target=lambda: results.setdefault('slow', store.get_or_create_thread(
+        's1', slow_create, discard_thread=discarded.append)))
+    slow.start()
+    assert slow_started.wait(5)
+    time.sleep(0.3)
+    # A foglalás lejárt: egy másik worker átveszi és gyorsan létrehozza a saját thread-jét
+    results['fast'] = store.get_or_create_thread('s1', lambda: 'thread_fast', discard_thread=discarded.append)
+    slow.join(5)
+
+    assert results == {'slow': 'thread_fast', 'fast': 'thread_fast'}
+    assert discarded == ['thread_slow']
+    assert store.get_or_create_thread('s1', lambda: 'unused') == 'thread_fast'